@@ -0,0 +1,306 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module benchmarks the codebook and panel steps on synthetic data. It generates BMF, Core and
+school files that look like the real ones at a chosen scale, from the size of North Carolina up to
+the whole country, and times and memory-profiles filter_data, format_orgs, matching_process,
+build_panel and the panel derivations separately.
+
+Each run appends one row per step to a JSON lines results file, labeled with the version of the
+code it ran on, so a new version can be compared against an earlier one with --compare.
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import panel
+import pto_codebook
+
+
+# synthetic data sizes as (BMF rows, schools), the BMF rows include orgs of other states and NTEE codes
+SCALES = {
+    'small': (5000, 300),
+    'nc': (60000, 2700),
+    'south': (600000, 25000),
+    'national': (2500000, 100000),
+}
+
+# the states the orgs and schools are spread over at each scale, the first one gets the most
+SCALE_STATES = {
+    'small': ['NC'],
+    'nc': ['NC'],
+    'south': ['NC', 'SC', 'VA', 'GA', 'TN', 'FL', 'AL', 'KY'],
+    'national': ['CA', 'TX', 'FL', 'NY', 'PA', 'IL', 'OH', 'GA', 'NC', 'MI', 'NJ', 'VA', 'WA', 'AZ', 'TN', 'MA', 'IN', 'MO',
+                 'MD', 'WI', 'CO', 'MN', 'SC', 'AL', 'LA', 'KY', 'OR', 'OK', 'CT', 'UT', 'IA', 'NV', 'AR', 'MS', 'KS', 'NM',
+                 'NE', 'ID', 'WV', 'HI', 'NH', 'ME', 'MT', 'RI', 'DE', 'SD', 'ND', 'AK', 'VT', 'WY'],
+}
+
+# words school names are made of
+PLACE_WORDS = ["oak", "pine", "cedar", "maple", "walnut", "willow", "hickory", "magnolia", "river", "lake", "creek", "hill",
+               "ridge", "valley", "spring", "meadow", "forest", "grove", "park", "view", "north", "south", "east", "west",
+               "central", "mount", "stone", "bridge", "mill", "fox", "deer", "eagle", "hawk", "sandy", "rocky", "green",
+               "blue", "white", "lincoln", "washington", "jefferson", "franklin", "madison", "jackson", "king", "carver",
+               "douglas", "wake", "union", "liberty", "heritage", "pioneer", "summit", "harbor", "crossroads", "brook"]
+SCHOOL_LEVELS = [("elementary", "Primary"), ("elem", "Primary"), ("middle", "Middle"), ("high", "High"), ("academy", "Other")]
+STREET_WORDS = ["main", "church", "school", "college", "academy", "old mill", "county line", "oak", "pine", "lake", "park"]
+STREET_SUFFIXES = ["ST", "RD", "AVE", "DR", "LN", "HWY"]
+
+# suffixes of org names, with how often they are used, the last ones are not kept by the classifier
+ORG_SUFFIXES = [(" PTA", 0.30), (" PTO", 0.15), (" PTSA", 0.05), (" BAND BOOSTERS", 0.08), (" ATHLETIC BOOSTER CLUB", 0.07),
+                (" SCHOOL FOUNDATION", 0.05), (" HOME SCHOOL GROUP", 0.05), (" SCHOLARSHIP FUND", 0.25)]
+
+# the steps that are timed, in the order they run
+STAGES = ['filter_data', 'format_orgs', 'format_schools', 'matching_process', 'build_panel', 'derive_variables',
+          'build_long_panel', 'derive_long']
+
+
+def generate(root, scale='nc', year=2019, seed=0):
+    """
+    Writes synthetic BMF, Core and school files in the layout the pipeline reads.
+
+    Schools get names made of place words and a level, and most orgs are named after a school with
+    a PTA, PTO or booster suffix, with some misspelled and some at a PO box or another ZIP. The
+    rest of the BMF rows are orgs of other states, other NTEE codes or names the classifier drops.
+
+    Args:
+        root (str): The directory to write bmf/<year>/, core/<year>/ and schools_<year>.csv to.
+        scale (str): One of SCALES.
+        year (int): The year of the files.
+        seed (int): The seed of the random generator, the same seed always gives the same files.
+
+    Returns:
+        dict: The paths of the BMF directory, Core directory and school file.
+
+    """
+    n_orgs, n_schools = SCALES[scale]
+    states = SCALE_STATES[scale]
+    rng = np.random.default_rng(seed)
+
+    # schools, spread over the states with the first state getting the most
+    weights = 1 / np.arange(1, len(states) + 1)
+    school_states = rng.choice(states, n_schools, p=weights / weights.sum())
+    levels = rng.integers(0, len(SCHOOL_LEVELS), n_schools)
+    stems = (pd.Series(rng.choice(PLACE_WORDS, n_schools)) + ' ' + pd.Series(rng.choice(PLACE_WORDS, n_schools))).str.title()
+    zips = pd.Series(rng.integers(10000, 99999, n_schools) // 20 * 20)
+    streets = (pd.Series(rng.integers(100, 9999, n_schools)).astype(str) + ' ' + pd.Series(rng.choice(STREET_WORDS, n_schools)).str.upper()
+               + ' ' + pd.Series(rng.choice(STREET_SUFFIXES, n_schools)))
+    school_ids = np.arange(n_schools) + (370000000000 if year >= 2020 else 0) + 1000
+    df_schools = pd.DataFrame({
+        'school_id': school_ids,
+        'leaid': 3700000 + rng.integers(0, max(n_schools // 20, 1), n_schools),
+        'school_name': stems + ' ' + pd.Series([SCHOOL_LEVELS[level][0].title() for level in levels]),
+        'street_location': streets,
+        'zip_location': zips,
+        'school_level': [SCHOOL_LEVELS[level][1] for level in levels],
+        'state_location': school_states,
+        'year': year,
+    })
+
+    # orgs, most of them named after a school
+    school = rng.integers(0, n_schools, n_orgs)
+    suffix = rng.choice([name for name, _ in ORG_SUFFIXES], n_orgs, p=[share for _, share in ORG_SUFFIXES])
+    names = df_schools['school_name'].str.upper().values[school] + suffix
+    # swap two letters in some names so not every match is exact
+    typo = rng.random(n_orgs) < 0.1
+    names[typo] = [name[:3] + name[4] + name[3] + name[5:] for name in names[typo]]
+    pobox = rng.random(n_orgs) < 0.15
+    addresses = np.where(pobox, 'PO BOX ' + pd.Series(rng.integers(1, 9999, n_orgs)).astype(str).values,
+                         df_schools['street_location'].values[school])
+    org_zips = np.where(rng.random(n_orgs) < 0.8, zips.values[school], rng.integers(10000, 99999, n_orgs))
+    org_states = np.where(rng.random(n_orgs) < 0.85, school_states[school], rng.choice(SCALE_STATES['national'], n_orgs))
+    df_orgs = pd.DataFrame({
+        'EIN': 10000000 + rng.choice(89999999, n_orgs, replace=False),
+        'NAME': names,
+        'SEC_NAME': np.where(rng.random(n_orgs) < 0.05, names, None),
+        'STATE': org_states,
+        'NTEE1': np.where(rng.random(n_orgs) < 0.7, 'B', rng.choice(list('ACEPS'), n_orgs)),
+        'NTEEFINAL': 'B94',
+        'ADDRESS': addresses,
+        'ZIP5': org_zips,
+        'FIPS': 37000 + rng.integers(1, 200, n_orgs),
+        'TOTREV': rng.lognormal(10, 1.5, n_orgs).round(),
+    })
+
+    paths = {'bmf': os.path.join(root, 'bmf', str(year)), 'core': os.path.join(root, 'core', str(year)),
+             'schools': os.path.join(root, f'schools_{year}.csv')}
+    os.makedirs(paths['bmf'], exist_ok=True)
+    os.makedirs(paths['core'], exist_ok=True)
+    # the BMF files have no revenue and the Core files only cover part of the orgs
+    df_orgs.drop(columns='TOTREV').to_csv(os.path.join(paths['bmf'], 'bmf.csv'), index=False)
+    df_core = df_orgs[rng.random(n_orgs) < 0.5].copy()
+    df_core['TOTREV2'] = df_core['TOTREV']
+    df_core.to_csv(os.path.join(paths['core'], 'core.csv'), index=False)
+    df_schools.to_csv(paths['schools'], index=False)
+    return paths
+
+
+def measure(results, stage, func, *args, trace_memory=True, **kwargs):
+    """
+    Runs one step and records its wall time, peak memory and output size.
+
+    Args:
+        results (list): The list to append the measurement to.
+        stage (str): The name of the step.
+        func (callable): The step.
+        *args: Positional arguments for func.
+        trace_memory (bool): Whether to trace the memory allocated by the step, which slows it down.
+        **kwargs: Keyword arguments for func.
+
+    Returns:
+        The output of the step.
+
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    frames = output if isinstance(output, tuple) else (output,)
+    rows = sum(len(frame) for frame in frames if isinstance(frame, pd.DataFrame))
+    results.append({'stage': stage, 'seconds': seconds, 'peak_mb': None if peak is None else peak / 2 ** 20, 'rows_out': rows})
+    return output
+
+
+def benchmark(root, scale='nc', year=2019, seed=0, trace_memory=True):
+    """
+    Runs the codebook and panel steps on the synthetic files of a scale and measures each step.
+
+    Args:
+        root (str): The directory to write the synthetic files and matches to.
+        scale (str): One of SCALES.
+        year (int): The year of the synthetic files.
+        seed (int): The seed of the synthetic data.
+        trace_memory (bool): Whether to record the peak memory of each step.
+
+    Returns:
+        list: One measurement per step, see measure.
+
+    """
+    paths = generate(root, scale, year, seed)
+    # orgs of every state of the scale are kept
+    state = '|'.join(SCALE_STATES[scale])
+    results = []
+
+    def filter_both():
+        return pto_codebook.filter_data(paths['bmf'], state=state), pto_codebook.filter_data(paths['core'], state=state)
+
+    df_bmf, df_core = measure(results, 'filter_data', filter_both, trace_memory=trace_memory)
+    df_bmf['NAME'] = df_bmf['SEC_NAME'].fillna(df_bmf['NAME'])
+    df_allorgs = pd.merge(df_bmf, df_core, on='EIN', how='outer', indicator=True)
+    df_orgs, df_orgs_copy, df_orgs_withpo = measure(results, 'format_orgs', pto_codebook.format_orgs, df_allorgs, trace_memory=trace_memory)
+    df_schools = measure(results, 'format_schools', pto_codebook.format_schools, paths['schools'], trace_memory=trace_memory)
+
+    round1, round2 = measure(results, 'matching_process', pto_codebook.matching_process, df_orgs, df_schools, df_orgs_copy,
+                             df_orgs_withpo, trace_memory=trace_memory)
+    final_matches = pto_codebook.filter_bad_matches(pd.merge(round1, round2, how='outer'))
+    final_matches.to_csv(os.path.join(root, f'finalmatches{year}.csv'))
+
+    matches = panel.read_matches(root, year)
+    wide = measure(results, 'build_panel', panel.build_panel, matches, trace_memory=trace_memory)
+    measure(results, 'derive_variables', panel.derive_variables, wide, trace_memory=trace_memory)
+    long_panel = measure(results, 'build_long_panel', panel.build_long_panel, matches, trace_memory=trace_memory)
+    measure(results, 'derive_long', panel.derive_long, long_panel, trace_memory=trace_memory)
+
+    for result in results:
+        result.update({'scale': scale, 'seed': seed, 'orgs': SCALES[scale][0], 'schools': SCALES[scale][1], 'trace_memory': trace_memory})
+    return results
+
+
+def code_version():
+    """
+    Describes the version of the code being benchmarked.
+
+    Returns:
+        str: The git commit of the repository, with a -dirty suffix if there are uncommitted changes,
+            or None outside of a git checkout.
+
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, path, label=None):
+    """
+    Appends measurements to a JSON lines results file.
+
+    Args:
+        results (list): The measurements of a run.
+        path (str): The results file.
+        label (str): The name to compare the run under, defaults to the code version.
+
+    """
+    version = code_version()
+    run = {'label': label or version, 'version': version, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+           'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__}
+    with open(path, 'a') as file:
+        for result in results:
+            file.write(json.dumps({**run, **result}) + '\n')
+
+
+def compare_results(path, baseline, current):
+    """
+    Compares the measurements of two labeled runs step by step.
+
+    When a label was run several times, the fastest time and lowest peak memory of each step are
+    used, since they are the least affected by other load on the machine.
+
+    Args:
+        path (str): The results file.
+        baseline (str): The label of the earlier run.
+        current (str): The label of the later run.
+
+    Returns:
+        pandas.DataFrame: One row per scale and step with the seconds and peak memory of both runs
+            and the ratio of the current run to the baseline.
+
+    """
+    results = pd.read_json(path, lines=True)
+    best = results.groupby(['label', 'scale', 'stage'])[['seconds', 'peak_mb']].min()
+    report = best.loc[baseline].join(best.loc[current], lsuffix='_baseline', rsuffix='_current', how='inner')
+    report['time_ratio'] = report['seconds_current'] / report['seconds_baseline']
+    report['memory_ratio'] = report['peak_mb_current'] / report['peak_mb_baseline']
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    return report.reset_index().sort_values(['scale', 'stage'], key=lambda col: col.map(order) if col.name == 'stage' else col)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the codebook and panel steps on synthetic data.")
+    parser.add_argument("--scale", choices=list(SCALES), nargs="+", default=['small'], help="sizes of synthetic data to run")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times to run each scale")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--results", default="benchmarks.jsonl", help="JSON lines file to append the measurements to")
+    parser.add_argument("--label", help="name to store the run under, defaults to the git commit")
+    parser.add_argument("--workdir", help="directory for the synthetic files, defaults to a temporary directory")
+    parser.add_argument("--no-memory", action="store_true", help="do not trace memory, which makes the timings more accurate")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two stored runs instead of running")
+    args = parser.parse_args()
+
+    pd.set_option('display.width', 200)
+    if args.compare:
+        print(compare_results(args.results, *args.compare).to_string(index=False))
+    else:
+        for scale in args.scale:
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory(dir=args.workdir) as root:
+                    results = benchmark(root, scale, seed=args.seed, trace_memory=not args.no_memory)
+                save_results(results, args.results, args.label)
+                print(pd.DataFrame(results)[['scale', 'stage', 'seconds', 'peak_mb', 'rows_out']].to_string(index=False))
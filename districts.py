@@ -0,0 +1,152 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module rolls the school-year panel up to districts, with one row per leaID and Year. Each row
+has the number of schools, the share of schools with any matched organization, the organizations
+of each type and the distribution of TotRev across the schools of the district: the total, the
+mean, percentiles, the Gini coefficient and the share of the top decile of schools.
+
+The rollups are computed in one pass over the school-years sorted by district, year and revenue,
+and written as Parquet files partitioned by year. A year whose panel slice changed is refreshed on
+its own, so district dashboards read the rollups and never rescan the school-level panel.
+
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from panel_index import panel_links, panel_school_years
+from schema import DISTRICT_SCHEMA, apply_schema, read_panel, write_panel
+
+
+# the organization count columns and the Org_code they count, as in the *alive variables of the panel
+ORG_CODE_COUNTS = {'PTAorgs': 1, 'PTOorgs': 2, 'BOOSTorgs': 3, 'OTHERorgs': 4}
+
+# the percentiles of TotRev across the schools of each district
+DISTRICT_PERCENTILES = [10, 25, 50, 75, 90]
+
+
+def district_rollup(panel, school_years=None, percentiles=DISTRICT_PERCENTILES):
+    """
+    Rolls a panel up to one row per district and year.
+
+    Schools without a matched organization count as schools with no revenue, so the distribution
+    covers every school of the district. The percentiles interpolate linearly between schools like
+    pandas.Series.quantile.
+
+    Args:
+        panel (pandas.DataFrame): The wide panel, or the long panel of the long layout.
+        school_years (pandas.DataFrame): The school-year variables of the long layout, None for a wide panel.
+        percentiles (list): The percentiles of TotRev to compute, between 0 and 100.
+
+    Returns:
+        pandas.DataFrame: The rollups with the DISTRICT_SCHEMA types, sorted by leaID and Year.
+
+    """
+    schools = panel_school_years(panel if school_years is None else school_years)
+    schools = schools[schools['leaID'].notna()][['schID', 'Year', 'leaID', 'TotRev']]
+
+    # the organizations of each type linked to each school-year
+    links = panel_links(panel)
+    codes = np.column_stack([(links['Org_code'] == code).to_numpy(dtype=np.int64, na_value=0) for code in ORG_CODE_COUNTS.values()])
+    counts = pd.DataFrame(codes, columns=list(ORG_CODE_COUNTS), index=pd.MultiIndex.from_frame(links[['schID', 'Year']]))
+    counts = counts.groupby(level=[0, 1]).sum()
+    counts['Orgs'] = links.groupby(['schID', 'Year']).size()
+    schools = schools.join(counts, on=['schID', 'Year'])
+
+    lea = schools['leaID'].to_numpy(dtype=np.int64)
+    year = schools['Year'].to_numpy(dtype=np.int64)
+    rev = schools['TotRev'].to_numpy(dtype=float, na_value=0.0)
+    # sort once by district, year and revenue, every measure is then read off the sorted arrays
+    order = np.lexsort((rev, year, lea))
+    lea, year, rev = lea[order], year[order], rev[order]
+    orgs = schools[list(ORG_CODE_COUNTS) + ['Orgs']].to_numpy(dtype=float, na_value=0.0)[order]
+
+    if len(rev):
+        starts = np.flatnonzero(np.r_[True, (lea[1:] != lea[:-1]) | (year[1:] != year[:-1])])
+    else:
+        starts = np.array([], dtype=np.int64)
+    n = np.diff(np.r_[starts, len(rev)])
+    group = np.repeat(np.arange(len(starts)), n)
+    rank = np.arange(len(rev)) - starts[group] + 1
+
+    def group_sum(values):
+        return np.add.reduceat(values, starts, axis=0) if len(starts) else np.zeros((0,) + values.shape[1:])
+
+    total = group_sum(rev)
+    with_orgs = group_sum((orgs[:, -1] > 0).astype(float))
+    # the Gini coefficient of revenues sorted in ascending order, with ranks starting at 1
+    weighted = group_sum(rank * rev)
+    # the top decile is the largest tenth of the schools, at least one
+    top = rank > n[group] - np.ceil(n[group] / 10)
+    top_total = group_sum(np.where(top, rev, 0.0))
+
+    rollup = pd.DataFrame({'leaID': lea[starts], 'Year': year[starts], 'Schools': n,
+                           'SchoolsWithOrgs': with_orgs, 'ShareWithOrgs': with_orgs / np.maximum(n, 1)})
+    for i, col in enumerate(list(ORG_CODE_COUNTS) + ['Orgs']):
+        rollup[col] = group_sum(orgs[:, i])
+    rollup['TotRev'] = total
+    rollup['MeanRev'] = total / np.maximum(n, 1)
+    for q in percentiles:
+        position = q / 100 * (n - 1)
+        low, high = np.floor(position).astype(np.int64), np.ceil(position).astype(np.int64)
+        rollup[f'P{q}Rev'] = rev[starts + low] + (position - low) * (rev[starts + high] - rev[starts + low])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # both are undefined for districts whose schools have no revenue, or lose more than they raise
+        rollup['Gini'] = np.where(total > 0, 2 * weighted / (n * total) - (n + 1) / n, np.nan)
+        rollup['TopDecileShare'] = np.where(total > 0, top_total / total, np.nan)
+    return apply_schema(rollup, DISTRICT_SCHEMA)
+
+
+def write_rollup(panel, root, school_years=None, years=None):
+    """
+    Computes the district rollups of a panel and writes them partitioned by year.
+
+    Args:
+        panel (pandas.DataFrame): The wide panel, or the long panel of the long layout.
+        root (str): The directory of the rollups.
+        school_years (pandas.DataFrame): The school-year variables of the long layout, None for a wide panel.
+        years (list): The years whose panel slice changed, None to write every year. Only those
+            years are rolled up and rewritten, the other years in the directory are kept.
+
+    Returns:
+        pandas.DataFrame: The rollups that were written.
+
+    """
+    if years is not None:
+        panel = panel[panel['Year'].isin(years)]
+        if school_years is not None:
+            school_years = school_years[school_years['Year'].isin(years)]
+    rollup = district_rollup(panel, school_years)
+    write_panel(rollup, root, years=years, schema=DISTRICT_SCHEMA)
+    return rollup
+
+
+def read_rollup(root, years=None, columns=None):
+    """
+    Reads the district rollups written by write_rollup.
+
+    Args:
+        root (str): The directory of the rollups.
+        years (list): The years to read, None for every year.
+        columns (list): The columns to read, None for every column.
+
+    Returns:
+        pandas.DataFrame: The rollups sorted by leaID and Year.
+
+    """
+    return read_panel(root, years=years, columns=columns, schema=DISTRICT_SCHEMA)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roll the panel written by panel.py --parquet-root up to districts.")
+    parser.add_argument("--panel-root", required=True, help="the Parquet directory of the wide panel")
+    parser.add_argument("--output-root", required=True, help="the directory to write the district rollups to")
+    parser.add_argument("--years", type=int, nargs="+", help="only refresh these years, defaults to every year of the panel")
+    args = parser.parse_args()
+
+    panel = read_panel(args.panel_root, years=args.years)
+    write_rollup(panel, args.output_root, years=args.years)
@@ -0,0 +1,219 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module contains an on-disk cache for the dataframes produced by the filtering and formatting
+steps of the codebook. Entries are stored as Parquet files and are keyed by a hash of the contents
+of the input files and of the parameters used to produce them, so an entry is only reused when
+nothing upstream changed. The cache is kept under a size limit by evicting the least recently
+used entries.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    Hashes the contents of a file.
+
+    Args:
+        path (str): The path of the file.
+        block_size (int): The number of bytes to read at a time.
+
+    Returns:
+        str: The hex SHA-256 digest of the file contents.
+
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_files(paths):
+    """
+    Lists the input files behind a list of paths, where a directory stands for the CSV files in it.
+
+    Args:
+        paths (list): File or directory paths.
+
+    Returns:
+        list: The sorted file paths.
+
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, file) for file in os.listdir(path) if file.endswith(".csv"))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+class FrameCache:
+    """
+    A content-addressed cache of dataframes stored as Parquet files.
+
+    Each entry is a directory named after its key that holds one Parquet file per dataframe and a
+    meta.json file. Reading an entry updates its access time, and writing an entry evicts the least
+    recently used entries until the cache is under max_bytes.
+
+    Args:
+        root (str): The directory to store the cache in.
+        max_bytes (int): The largest total size of the cached files.
+
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, name, paths, params=None):
+        """
+        Builds the key of an entry from the contents of its input files and its parameters.
+
+        Args:
+            name (str): The name of the step that produced the entry.
+            paths (list): The input files or directories of the step.
+            params (dict): Any other values the output depends on, such as the classifier rule lists.
+
+        Returns:
+            str: The hex SHA-256 key of the entry.
+
+        """
+        digest = hashlib.sha256()
+        digest.update(name.encode())
+        for path in input_files(paths):
+            digest.update(os.path.basename(path).encode())
+            digest.update(file_digest(path).encode())
+        digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """
+        Reads an entry from the cache.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            pandas.DataFrame or tuple: The cached dataframe or tuple of dataframes, None if the entry does not exist.
+
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, 'meta.json')) as file:
+                meta = json.load(file)
+            frames = [pd.read_parquet(os.path.join(entry, f'{i}.parquet')) for i in range(meta['frames'])]
+        except (FileNotFoundError, OSError, ValueError):
+            # the entry is missing, was evicted while reading or was only partly written
+            return None
+
+        # mark the entry as recently used
+        os.utime(os.path.join(entry, 'meta.json'))
+        return tuple(frames) if meta['tuple'] else frames[0]
+
+    def put(self, key, frames):
+        """
+        Writes an entry to the cache and evicts old entries if the cache is over its size limit.
+
+        Args:
+            key (str): The key of the entry.
+            frames (pandas.DataFrame or tuple): The dataframe or tuple of dataframes to cache.
+
+        Returns:
+            bool: Whether the entry was written. Dataframes that Parquet cannot store, such as
+                columns with mixed types, are not cached.
+
+        """
+        is_tuple = isinstance(frames, tuple)
+        frames = frames if is_tuple else (frames,)
+
+        # write to a temporary directory first so other processes never read a partial entry
+        tmp = tempfile.mkdtemp(dir=self.root, prefix='.tmp-')
+        try:
+            for i, frame in enumerate(frames):
+                frame.to_parquet(os.path.join(tmp, f'{i}.parquet'))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as file:
+                json.dump({'frames': len(frames), 'tuple': is_tuple, 'created': time.time()}, file)
+            os.replace(tmp, self._entry(key))
+        except (ValueError, TypeError, NotImplementedError, ImportError, OSError) as err:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if isinstance(err, ImportError):
+                raise
+            return False
+
+        self.evict()
+        return True
+
+    def entries(self):
+        """
+        Lists the entries in the cache.
+
+        Returns:
+            pandas.DataFrame: The key, size in bytes and last access time of each entry.
+
+        """
+        rows = []
+        for key in os.listdir(self.root):
+            entry = self._entry(key)
+            if key.startswith('.tmp-') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+                used = os.path.getmtime(os.path.join(entry, 'meta.json'))
+            except FileNotFoundError:
+                continue
+            rows.append({'key': key, 'bytes': size, 'used': used})
+        return pd.DataFrame(rows, columns=['key', 'bytes', 'used'])
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is under its size limit.
+
+        Returns:
+            list: The keys of the removed entries.
+
+        """
+        entries = self.entries().sort_values('used', ascending=False)
+        # keep the most recently used entries that fit in the size limit
+        over = entries[entries['bytes'].cumsum() > self.max_bytes]
+        for key in over['key']:
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+        return list(over['key'])
+
+    def cached(self, name, paths, params, func, *args, **kwargs):
+        """
+        Returns the cached output of a step, running the step and caching its output on a miss.
+
+        Args:
+            name (str): The name of the step.
+            paths (list): The input files or directories of the step.
+            params (dict): Any other values the output depends on.
+            func (callable): The step to run on a miss.
+            *args: Positional arguments for func.
+            **kwargs: Keyword arguments for func.
+
+        Returns:
+            pandas.DataFrame or tuple: The output of the step.
+
+        """
+        key = self.key(name, paths, params)
+        frames = self.get(key)
+        if frames is None:
+            frames = func(*args, **kwargs)
+            self.put(key, frames)
+        return frames
@@ -0,0 +1,228 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module contains a batched Jaro-Winkler similarity kernel written with NumPy. Strings are
+encoded as arrays of code points padded to the same length, and a whole batch of pairs, such as
+one organization name against every school name, is scored with array operations instead of one
+pair at a time. The scores are the same as those of jellyfish.jaro_winkler_similarity, which
+recordlinkage uses for Compare.string(..., method='jarowinkler').
+
+Pairs whose lengths are too different to reach a threshold can be skipped without being scored,
+and batches are scored on several threads since NumPy releases the GIL inside its array operations.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def encode(s1, s2):
+    """
+    Encodes aligned pairs of strings as code point arrays.
+
+    Both sides are encoded with the same integer type. The first strings are padded with zeros and
+    the second strings with the largest value of the type, so that padding never matches a
+    character or the padding of the other side.
+
+    Args:
+        s1 (numpy.ndarray): The first strings.
+        s2 (numpy.ndarray): The second strings, aligned with s1.
+
+    Returns:
+        tuple: The code points of the first and of the second strings, with one row per pair.
+
+    """
+    strings = np.concatenate([s1, s2]).astype(str)
+    lengths = np.char.str_len(strings)
+    width = max(int(lengths.max(initial=0)), 1)
+    codes = strings.astype(f'U{width}').view(np.uint32).reshape(len(strings), width)
+    # most names are ASCII, and comparing single bytes is faster than comparing four
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if codes.max(initial=0) < np.iinfo(dtype).max:
+            codes = codes.astype(dtype)
+            break
+    codes1, codes2 = codes[:len(s1)], codes[len(s1):]
+    codes2 = np.where(np.arange(width) < lengths[len(s1):, None], codes2, np.iinfo(codes.dtype).max)
+    return codes1, codes2
+
+
+def common_prefix(codes1, codes2):
+    """
+    Measures the common prefix of encoded pairs of strings, up to the four characters the Winkler
+    boost looks at.
+
+    Args:
+        codes1 (numpy.ndarray): The code points of the first strings, as returned by encode.
+        codes2 (numpy.ndarray): The code points of the second strings, as returned by encode.
+
+    Returns:
+        numpy.ndarray: The length of the common prefix of each pair.
+
+    """
+    same = codes1[:, :4] == codes2[:, :4]
+    return np.cumprod(same, axis=1).sum(axis=1)
+
+
+def max_similarity(len1, len2, common=None, prefix=4):
+    """
+    Computes the largest Jaro-Winkler similarity that two strings can have given their lengths, the
+    most characters they can have in common and the length of their common prefix. The bound is
+    reached when all the common characters are matched in order.
+
+    Args:
+        len1 (numpy.ndarray): The lengths of the first strings.
+        len2 (numpy.ndarray): The lengths of the second strings.
+        common (numpy.ndarray): The most characters each pair can have in common, defaults to the length of the shorter string.
+        prefix (numpy.ndarray): The length of the common prefix of each pair, at most 4.
+
+    Returns:
+        numpy.ndarray: The upper bound of the similarity of each pair, 0 where either string is empty.
+
+    """
+    len1, len2 = np.asarray(len1, dtype=float), np.asarray(len2, dtype=float)
+    shortest = np.minimum(len1, len2)
+    common = shortest if common is None else np.minimum(common, shortest)
+    prefix = np.minimum(prefix, np.minimum(shortest, 4))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jaro = (common / len1 + common / len2 + 1.0) / 3.0
+    bound = np.where(jaro > 0.7, jaro + prefix * 0.1 * (1.0 - jaro), jaro)
+    return np.where(common > 0, bound, 0.0)
+
+
+def shared_characters(codes1, codes2):
+    """
+    Counts the characters two strings have in common regardless of their position, which is the
+    most characters the Jaro similarity can match.
+
+    Args:
+        codes1 (numpy.ndarray): The code points of the first strings, as returned by encode.
+        codes2 (numpy.ndarray): The code points of the second strings, as returned by encode.
+
+    Returns:
+        numpy.ndarray: The number of shared characters of each pair, counting repeated characters as often as both strings have them.
+
+    """
+    n = len(codes1)
+    if codes1.dtype == np.uint8:
+        ids1, ids2, alphabet = codes1.astype(np.int64), codes2.astype(np.int64), 256
+    else:
+        # number the characters of the batch so the counts only need one column per character
+        _, ids = np.unique(np.concatenate([codes1.ravel(), codes2.ravel()]), return_inverse=True)
+        ids = ids.reshape(-1)
+        ids1, ids2 = ids[:codes1.size].reshape(codes1.shape), ids[codes1.size:].reshape(codes2.shape)
+        alphabet = int(ids.max(initial=0)) + 1
+    offsets = (np.arange(n) * alphabet)[:, None]
+    counts1 = np.bincount((ids1 + offsets).ravel(), minlength=n * alphabet)
+    counts2 = np.bincount((ids2 + offsets).ravel(), minlength=n * alphabet)
+    return np.minimum(counts1, counts2).reshape(n, alphabet).sum(axis=1)
+
+
+def jaro_winkler_codes(codes1, len1, codes2, len2):
+    """
+    Computes the Jaro-Winkler similarity of aligned pairs of encoded strings.
+
+    This follows the reference implementation in jellyfish step by step, with each step applied to
+    every pair of the batch at once, so the scores are identical to it.
+
+    Args:
+        codes1 (numpy.ndarray): The code points of the first strings, as returned by encode.
+        len1 (numpy.ndarray): The lengths of the first strings.
+        codes2 (numpy.ndarray): The code points of the second strings, as returned by encode.
+        len2 (numpy.ndarray): The lengths of the second strings.
+
+    Returns:
+        numpy.ndarray: The similarity of each pair.
+
+    """
+    n, width1 = codes1.shape
+    width2 = codes2.shape[1]
+    rows = np.arange(n)
+    positions = np.arange(width2)
+
+    # characters only match if they are within half the length of the longer string of each other
+    search_range = np.maximum(np.maximum(len1, len2) // 2 - 1, 0)[:, None]
+    flags1 = np.zeros((n, width1), dtype=bool)
+    flags2 = np.zeros((n, width2), dtype=bool)
+    for i in range(width1):
+        candidates = (codes2 == codes1[:, i:i + 1]) & (np.abs(positions - i) <= search_range) & ~flags2
+        # each character of the first string is matched with the first free equal character in its window
+        first = candidates.argmax(axis=1)
+        found = candidates[rows, first]
+        flags2[rows[found], first[found]] = True
+        flags1[found, i] = True
+    common = flags1.sum(axis=1)
+
+    # transpositions are the matched characters that are out of order, counted in halves
+    order1 = np.argsort(~flags1, axis=1, kind='stable')
+    order2 = np.argsort(~flags2, axis=1, kind='stable')
+    width = min(width1, width2)
+    matched1 = np.take_along_axis(codes1, order1, axis=1)[:, :width]
+    matched2 = np.take_along_axis(codes2, order2, axis=1)[:, :width]
+    transpositions = ((matched1 != matched2) & (np.arange(width) < common[:, None])).sum(axis=1) // 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = (common / len1 + common / len2 + (common - transpositions) / common) / 3.0
+
+    # the Winkler boost for a common prefix of up to four characters
+    prefix = common_prefix(codes1, codes2)
+    weight = np.where((weight > 0.7) & (prefix > 0), weight + prefix * 0.1 * (1.0 - weight), weight)
+
+    return np.where(common > 0, weight, 0.0)
+
+
+def jaro_winkler(s1, s2, threshold=None, batch_size=20000, workers=None):
+    """
+    Computes the Jaro-Winkler similarity of each pair of strings in batches.
+
+    Either side can be a single string, so one organization name can be scored against all school
+    names in one call. Pairs are sorted by length before they are split into batches, so each batch
+    is only padded to about the length of its own strings.
+
+    Args:
+        s1 (str or array-like): The first strings.
+        s2 (str or array-like): The second strings, aligned with s1.
+        threshold (float): Skip the pairs that cannot reach this similarity, None to score every pair.
+        batch_size (int): The number of pairs to score at a time.
+        workers (int): The number of threads to score batches on, defaults to one.
+
+    Returns:
+        numpy.ndarray: The similarity of each pair, NaN for the skipped pairs and 0 for pairs with an empty string.
+
+    """
+    s1, s2 = np.broadcast_arrays(np.asarray(s1, dtype=object), np.asarray(s2, dtype=object))
+    s1, s2 = s1.ravel(), s2.ravel()
+    # missing strings score 0 like empty strings, as recordlinkage scores missing values
+    len1 = pd.Series(s1, dtype=object).str.len().fillna(0).to_numpy(dtype=np.int64)
+    len2 = pd.Series(s2, dtype=object).str.len().fillna(0).to_numpy(dtype=np.int64)
+    result = np.zeros(len(s1))
+    todo = (len1 > 0) & (len2 > 0)
+    if threshold is not None:
+        # pairs whose lengths are too different are skipped before they are even encoded
+        skip = todo & (max_similarity(len1, len2) < threshold)
+        result[skip] = np.nan
+        todo &= ~skip
+    todo = np.flatnonzero(todo)
+    todo = todo[np.argsort(np.maximum(len1[todo], len2[todo]), kind='stable')]
+
+    def score(batch):
+        codes1, codes2 = encode(s1[batch], s2[batch])
+        if threshold is not None:
+            # then the pairs that do not share enough characters to reach the threshold
+            bound = max_similarity(len1[batch], len2[batch], shared_characters(codes1, codes2), common_prefix(codes1, codes2))
+            keep = bound >= threshold
+            result[batch[~keep]] = np.nan
+            batch, codes1, codes2 = batch[keep], codes1[keep], codes2[keep]
+        result[batch] = jaro_winkler_codes(codes1, len1[batch], codes2, len2[batch])
+
+    batches = [todo[start:start + batch_size] for start in range(0, len(todo), batch_size)]
+    if workers is None or workers <= 1 or len(batches) <= 1:
+        for batch in batches:
+            score(batch)
+    else:
+        # each batch writes to its own positions of the result
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(score, batches))
+    return result
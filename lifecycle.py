@@ -0,0 +1,257 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module follows each organization across the yearly matches: the years it was matched, the
+years it was missing in between, the schools it moved between, its reclassifications and how its
+revenue changed from one year to the next. It also counts, for each school, how often each type of
+organization appeared and disappeared from one roster year to the next, as in the *alive variables
+of the panel.
+
+The matches of all years are sorted once by EIN and Year, so the previous year of an organization
+is the row before it and every measure is read off the sorted arrays in one pass, without melting
+the EIN1..EINn columns of the wide panel or comparing years pairwise.
+
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from panel import ALIVE_CODES, read_matches
+from school_registry import SchoolRegistry
+from schema import LIFECYCLE_SCHEMA, apply_schema
+
+
+# the flags counted for each school, ANYalive for any organization and one per organization code
+ALIVE_FLAGS = {'ANYalive': None, **ALIVE_CODES}
+
+# the files written by write_lifecycle
+LIFECYCLE_FILES = {'org_years': 'org_years.parquet', 'orgs': 'orgs.parquet', 'schools': 'schools.parquet'}
+
+
+def read_year_matches(years, matches_root, registry=None):
+    """
+    Reads the matches of years with one row per organization and year.
+
+    Args:
+        years (list): The years to read.
+        matches_root (str): The directory containing the finalmatches<year>.csv files.
+        registry (SchoolRegistry): The school ID crosswalk, None to convert the IDs without one.
+
+    Returns:
+        pandas.DataFrame: The EIN, Year, schID, leaID, Org_code and Revenue of each organization and
+            year, sorted by EIN and Year. An organization matched to several schools in a year keeps
+            its match with the highest Total_Score.
+
+    """
+    matches = pd.concat([read_matches(matches_root, year, registry) for year in years], axis=0, ignore_index=True)
+    matches = matches[matches['EIN'].notna()]
+    score = matches['Total_Score'].to_numpy(dtype=float, na_value=-np.inf)
+    order = np.lexsort((-score, matches['Year'].to_numpy(dtype=np.int64), matches['EIN'].to_numpy(dtype=np.int64)))
+    matches = matches.iloc[order].drop_duplicates(['EIN', 'Year'])
+    return matches[['EIN', 'Year', 'schID', 'leaID', 'Org_code', 'Revenue']].reset_index(drop=True)
+
+
+def org_transitions(matches):
+    """
+    Compares each organization-year with the previous year the organization was matched.
+
+    Args:
+        matches (pandas.DataFrame): The matches read by read_year_matches, sorted by EIN and Year.
+
+    Returns:
+        pandas.DataFrame: The matches with the Prev_Year, Prev_schID, Prev_Org_code and Prev_Revenue of
+            the previous year of the organization, the Gap_Years it was not matched in between,
+            School_Changed and Reclassified when its school or Org_code differ from that year, and
+            Rev_Delta, its change in revenue. First_Seen and Last_Seen flag its first and last year.
+            The previous values are missing in the first year of each organization.
+
+    """
+    transitions = matches.reset_index(drop=True)
+    ein = transitions['EIN'].to_numpy(dtype=np.int64)
+    # the previous row is the previous year of the same organization, except on the first row of each EIN
+    first = np.r_[True, ein[1:] != ein[:-1]]
+    last = np.r_[ein[1:] != ein[:-1], True]
+
+    def previous(col):
+        values = transitions[col].shift()
+        return values.where(~first)
+
+    for col in ['Year', 'schID', 'Org_code', 'Revenue']:
+        transitions[f'Prev_{col}'] = previous(col)
+    transitions['Gap_Years'] = transitions['Year'] - transitions['Prev_Year'] - 1
+    # a change needs both years to be known, a missing school or code is not counted as a change
+    transitions['School_Changed'] = (transitions['schID'] != transitions['Prev_schID']).to_numpy(dtype=bool, na_value=False) & ~first
+    transitions['Reclassified'] = (transitions['Org_code'] != transitions['Prev_Org_code']).to_numpy(dtype=bool, na_value=False) & ~first
+    transitions['Rev_Delta'] = transitions['Revenue'] - transitions['Prev_Revenue']
+    transitions['First_Seen'] = first
+    transitions['Last_Seen'] = last
+    return apply_schema(transitions, LIFECYCLE_SCHEMA)
+
+
+def org_lifecycles(transitions):
+    """
+    Sums up the transitions of each organization.
+
+    Args:
+        transitions (pandas.DataFrame): The transitions computed by org_transitions.
+
+    Returns:
+        pandas.DataFrame: One row per EIN with its First_Year and Last_Year, the Years_Seen, the
+            Gap_Years it was not matched between them and the Gaps they form, its School_Changes and
+            Reclassifications, the schID, Org_code and Revenue of its first and last year, and its
+            Rev_Change between them.
+
+    """
+    first = transitions['First_Seen'].to_numpy()
+    last = transitions['Last_Seen'].to_numpy()
+    starts = np.flatnonzero(first)
+    gaps = transitions['Gap_Years'].to_numpy(dtype=np.int64, na_value=0)
+
+    def group_sum(values):
+        return np.add.reduceat(values, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+
+    first_rows, last_rows = transitions[first].reset_index(drop=True), transitions[last].reset_index(drop=True)
+    lifecycles = pd.DataFrame({
+        'EIN': first_rows['EIN'],
+        'First_Year': first_rows['Year'],
+        'Last_Year': last_rows['Year'],
+        'Years_Seen': np.diff(np.r_[starts, len(transitions)]),
+        'Gap_Years': group_sum(gaps),
+        'Gaps': group_sum((gaps > 0).astype(np.int64)),
+        'School_Changes': group_sum(transitions['School_Changed'].to_numpy(dtype=np.int64)),
+        'Reclassifications': group_sum(transitions['Reclassified'].to_numpy(dtype=np.int64)),
+    })
+    for col in ['schID', 'Org_code', 'Revenue']:
+        lifecycles[f'First_{col}'] = first_rows[col]
+        lifecycles[f'Last_{col}'] = last_rows[col]
+    lifecycles['Rev_Change'] = lifecycles['Last_Revenue'] - lifecycles['First_Revenue']
+    return apply_schema(lifecycles, LIFECYCLE_SCHEMA)
+
+
+def school_transitions(matches, school_years):
+    """
+    Counts how often each type of organization appeared at and disappeared from each school.
+
+    A school has a flag in a year when an organization of that type is matched to it that year, as
+    the *alive variables of the panel. A birth is a flag that is set in a roster year of the school
+    but not in its previous roster year, and a death the other way around.
+
+    Args:
+        matches (pandas.DataFrame): The matches read by read_year_matches.
+        school_years (pandas.DataFrame): The schID and Year of every roster school-year.
+
+    Returns:
+        pandas.DataFrame: One row per school with the Years it is in the rosters and the Births and
+            Deaths of each of the ALIVE_FLAGS, such as PTAalive_Births, sorted by schID.
+
+    """
+    school_years = school_years[['schID', 'Year']].drop_duplicates()
+    sch = school_years['schID'].to_numpy(dtype=np.int64)
+    year = school_years['Year'].to_numpy(dtype=np.int64)
+    order = np.lexsort((year, sch))
+    sch, year = sch[order], year[order]
+    keys = pd.MultiIndex.from_arrays([sch, year])
+
+    # the rows of the roster school-years each match falls on, matches outside the rosters are left out
+    matched = matches[matches['schID'].notna()]
+    rows = keys.get_indexer(pd.MultiIndex.from_arrays([matched['schID'].to_numpy(dtype=np.int64), matched['Year'].to_numpy(dtype=np.int64)]))
+    codes = matched['Org_code'].to_numpy(dtype=np.int64, na_value=0)[rows >= 0]
+    rows = rows[rows >= 0]
+
+    starts = np.flatnonzero(np.r_[True, sch[1:] != sch[:-1]]) if len(sch) else np.array([], dtype=np.int64)
+    # a school's first roster year has no previous year to appear or disappear from
+    previous = np.r_[False, sch[1:] == sch[:-1]]
+
+    def group_sum(values):
+        return np.add.reduceat(values, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+
+    schools = pd.DataFrame({'schID': sch[starts], 'Years': np.diff(np.r_[starts, len(sch)])})
+    for flag, code in ALIVE_FLAGS.items():
+        alive = np.zeros(len(sch), dtype=bool)
+        alive[rows if code is None else rows[codes == code]] = True
+        was_alive = np.r_[False, alive[:-1]]
+        schools[f'{flag}_Births'] = group_sum((previous & alive & ~was_alive).astype(np.int64))
+        schools[f'{flag}_Deaths'] = group_sum((previous & ~alive & was_alive).astype(np.int64))
+    return apply_schema(schools, LIFECYCLE_SCHEMA)
+
+
+def build_lifecycle(years, matches_root, schools_root, registry=None):
+    """
+    Follows the organizations and schools across the matches of years.
+
+    Args:
+        years (list): The years to include.
+        matches_root (str): The directory containing the finalmatches<year>.csv files.
+        schools_root (str): The directory containing the schools_<year>.csv files.
+        registry (SchoolRegistry): The school ID crosswalk, None to build one from the rosters of the years.
+
+    Returns:
+        dict: The org_years computed by org_transitions, the orgs computed by org_lifecycles and the
+            schools computed by school_transitions.
+
+    """
+    if registry is None:
+        registry = SchoolRegistry()
+    school_years = registry.add_years(years, schools_root).schools(years)
+    matches = read_year_matches(years, matches_root, registry)
+    transitions = org_transitions(matches)
+    return {
+        'org_years': transitions,
+        'orgs': org_lifecycles(transitions),
+        'schools': school_transitions(matches, school_years),
+    }
+
+
+def write_lifecycle(lifecycle, root):
+    """
+    Writes the outputs of build_lifecycle to the LIFECYCLE_FILES, replacing each file at once.
+
+    Args:
+        lifecycle (dict): The outputs of build_lifecycle.
+        root (str): The directory to write the files to.
+
+    Returns:
+        str: The directory of the files.
+
+    """
+    os.makedirs(root, exist_ok=True)
+    for name, file in LIFECYCLE_FILES.items():
+        path = os.path.join(root, file)
+        lifecycle[name].to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+    return root
+
+
+def read_lifecycle(root, name, columns=None):
+    """
+    Reads one of the files written by write_lifecycle.
+
+    Args:
+        root (str): The directory of the files.
+        name (str): org_years, orgs or schools.
+        columns (list): The columns to read, None for every column.
+
+    Returns:
+        pandas.DataFrame: The file with the LIFECYCLE_SCHEMA types.
+
+    """
+    return apply_schema(pd.read_parquet(os.path.join(root, LIFECYCLE_FILES[name]), columns=columns), LIFECYCLE_SCHEMA)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow organizations and schools across the yearly matches.")
+    parser.add_argument("--years", type=int, nargs="+", default=[2016, 2017, 2018, 2019, 2020, 2021], help="years to include")
+    parser.add_argument("--matches-root", required=True, help="directory with the finalmatches<year>.csv files")
+    parser.add_argument("--schools-root", required=True, help="directory with the schools_<year>.csv files")
+    parser.add_argument("--output-root", required=True, help="directory to write org_years, orgs and schools Parquet files to")
+    parser.add_argument("--school-registry", help="Parquet file to keep the school ID crosswalk in across runs")
+    args = parser.parse_args()
+
+    lifecycle = build_lifecycle(args.years, args.matches_root, args.schools_root, SchoolRegistry(args.school_registry))
+    write_lifecycle(lifecycle, args.output_root)
+    for name, df in lifecycle.items():
+        print(f"{name}: {len(df)} rows")
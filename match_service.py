@@ -0,0 +1,295 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module keeps the schools of a year in memory and matches organizations against them on
+request, so a single organization or a small batch is classified and matched in milliseconds
+instead of rerunning the whole year.
+
+The school file is formatted once, and the n-gram index of the school names, the hash indexes of
+the exact matching stage and the name and address scores are built once and reused by every
+request. Each organization goes through the same steps as in run_year: the state and NTEE filters
+and classifier of filter_data, format_orgs, the exact matches and both rounds of matching_process,
+and the cutoff of filter_bad_matches. Organizations are matched independently of each other, so an
+organization gets the same school whether it is sent alone or with the rest of its year.
+
+The service runs as a local HTTP server with only the standard library, or reads one JSON request
+per line from stdin for batch jobs.
+
+"""
+
+import argparse
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import numpy as np
+import pandas as pd
+
+from name_index import NameIndex
+from pto_codebook import classify_orgs, filter_bad_matches, find_matches, format_orgs, format_schools, school_lookups
+from schema import MATCH_SCHEMA, apply_schema
+from score_cache import ScoreCache
+
+
+# the fields of an organization in a request, as named in the BMF and Core files
+REQUEST_FIELDS = ['EIN', 'NAME', 'SEC_NAME', 'STATE', 'NTEE1', 'NTEEFINAL', 'ADDRESS', 'ZIP5', 'TOTREV', 'TOTREV2']
+
+# the columns of a match in a response, as written to finalmatches<year>.csv
+MATCH_COLUMNS = ['EIN', 'Organization_Name', 'Org_code', 'Organization_Street', 'Revenue', 'schID', 'leaID', 'School_Name',
+                 'School_Street', 'School_level', 'Name_Score', 'Address_Score', 'Zip_Score', 'Total_Score', 'Match_Parameter']
+
+# the largest number of name and address scores the service keeps in memory, so it does not grow with every request
+MAX_MEMORY_SCORES = 500000
+
+
+def orgs_frame(orgs):
+    """
+    Builds the organizations of a request in the layout of the BMF and Core files.
+
+    Args:
+        orgs (list): The organizations as dicts with the REQUEST_FIELDS, only EIN and NAME are required.
+
+    Returns:
+        pandas.DataFrame: One row per organization with every REQUEST_FIELDS column.
+
+    Raises:
+        ValueError: If an organization has no EIN or NAME.
+
+    """
+    df_orgs = pd.DataFrame([{key.upper(): value for key, value in org.items()} for org in orgs])
+    df_orgs = df_orgs.reindex(columns=REQUEST_FIELDS)
+    if df_orgs[['EIN', 'NAME']].isna().any(axis=None):
+        raise ValueError("every organization needs an EIN and a NAME")
+
+    df_orgs['EIN'] = pd.to_numeric(df_orgs['EIN']).astype(np.int64)
+    # ZIP codes and revenues are read in as numbers from the files
+    for col in ['ZIP5', 'TOTREV', 'TOTREV2']:
+        df_orgs[col] = pd.to_numeric(df_orgs[col], errors='coerce')
+    # names and addresses are upper case in the files, which the classifier rules expect
+    for col in ['NAME', 'SEC_NAME', 'ADDRESS', 'STATE', 'NTEE1']:
+        df_orgs[col] = df_orgs[col].map(lambda value: None if pd.isna(value) else str(value).upper()).astype(object)
+    return df_orgs
+
+
+class MatchService:
+    """
+    The schools of a year held in memory to match organizations against.
+
+    Args:
+        schools_path (str): The file path to the CSV file containing the school data.
+        cutoff (float): The smallest similarity score of a good match.
+        state (str): The state the organizations need to be in, None to keep the organizations of all states.
+        ntee (str): The NTEE code the organizations need to have.
+        score_cache_path (str): The SQLite file of name and address scores to start from and write back on close,
+            None to only keep the scores in memory.
+        max_memory_scores (int): The largest number of scores to keep in memory between requests, the rest are
+            written to the score file, or dropped without one.
+
+    """
+
+    def __init__(self, schools_path, cutoff=0.7, state='NC', ntee='B', score_cache_path=None, max_memory_scores=MAX_MEMORY_SCORES):
+        self.cutoff = cutoff
+        self.state = state
+        self.ntee = ntee
+        # STEP 5 and the school indexes of STEP 6A and round 2 are only built once
+        self.df_schools = format_schools(schools_path)
+        self.name_index = NameIndex(self.df_schools['school_name'])
+        self.lookups = school_lookups(self.df_schools)
+        self.score_cache = ScoreCache(score_cache_path, max_memory_entries=max_memory_scores)
+
+    def close(self):
+        """
+        Writes the scores to the score file and closes it.
+        """
+        self.score_cache.close()
+
+    def classify(self, df_orgs):
+        """
+        Applies the filters and classifier of filter_data to the organizations of a request.
+
+        The state and NTEE filters are only applied to the organizations that have a STATE and NTEE1.
+        Organizations without an address are dropped, since format_orgs keeps neither them nor the PO box orgs.
+
+        Args:
+            df_orgs (pandas.DataFrame): The organizations built by orgs_frame.
+
+        Returns:
+            tuple: The kept organizations with their ORG CODE, and the EIN and Reason of each dropped
+                organization, 'state', 'ntee', 'not school-linked' or 'no address'.
+
+        """
+        reason = pd.Series(None, index=df_orgs.index, dtype=object)
+        if self.state is not None:
+            reason[df_orgs['STATE'].notna() & ~df_orgs['STATE'].str.contains(self.state, na=False)] = 'state'
+        reason[reason.isna() & df_orgs['NTEE1'].notna() & ~df_orgs['NTEE1'].str.contains(self.ntee, na=False)] = 'ntee'
+
+        # orgs are classified on their primary name, before STEP 1A
+        df_orgs = df_orgs.assign(**{'ORG CODE': classify_orgs(df_orgs['NAME'])})
+        reason[reason.isna() & (df_orgs['ORG CODE'] == 0)] = 'not school-linked'
+        reason[reason.isna() & df_orgs['ADDRESS'].isna()] = 'no address'
+        dropped = pd.DataFrame({'EIN': df_orgs['EIN'], 'Reason': reason})[reason.notna()]
+        return df_orgs[reason.isna()], dropped
+
+    def match_orgs(self, df_orgs):
+        """
+        Classifies and matches organizations to the schools.
+
+        Args:
+            df_orgs (pandas.DataFrame): The organizations built by orgs_frame.
+
+        Returns:
+            tuple: The good matches with the MATCH_COLUMNS, and the EIN and Reason of each organization
+                without a match, the reasons of classify or 'no match'.
+
+        """
+        df_orgs, dropped = self.classify(df_orgs)
+
+        # STEP 1A: use the secondary name of an organization when it has one
+        df_orgs = df_orgs.assign(NAME=df_orgs['SEC_NAME'].fillna(df_orgs['NAME']))
+        # STEP 3 and STEP 4: the request stands in for the BMF side of the merged files
+        df_allorgs = df_orgs.drop(columns=['STATE', 'NTEE1']).rename(columns={col: f'{col}_x' for col in ['SEC_NAME', 'NAME', 'ADDRESS', 'NTEEFINAL', 'ZIP5', 'ORG CODE']})
+        for col in ['NAME_y', 'ADDRESS_y']:
+            df_allorgs[col] = pd.Series(None, index=df_allorgs.index, dtype=object)
+        for col in ['ZIP5_y', 'ORG CODE_y']:
+            df_allorgs[col] = np.nan
+        df_allorgs['_merge'] = 'left_only'
+        df_final_orgs, df_final_orgs_copy, df_allorgs_withpo = format_orgs(df_allorgs.reset_index(drop=True))
+
+        matches = find_matches(df_final_orgs, df_final_orgs_copy, df_allorgs_withpo, self.df_schools, score_cache=self.score_cache,
+                               name_cutoff=self.cutoff, name_index=self.name_index, lookups=self.lookups)
+        matches = apply_schema(filter_bad_matches(matches, cutoff=self.cutoff), MATCH_SCHEMA)[MATCH_COLUMNS]
+
+        unmatched = df_orgs.loc[~df_orgs['EIN'].isin(matches['EIN']), ['EIN']].assign(Reason='no match')
+        unmatched = pd.concat([dropped, unmatched], axis=0, ignore_index=True)
+        return matches.reset_index(drop=True), unmatched
+
+    def handle(self, request):
+        """
+        Answers a request with a single organization or a batch of organizations.
+
+        Args:
+            request (dict): An organization, or {"orgs": [...]} with a list of organizations.
+
+        Returns:
+            dict: The matches and the unmatched organizations as lists of records.
+
+        Raises:
+            ValueError: If an organization has no EIN or NAME.
+
+        """
+        orgs = request['orgs'] if 'orgs' in request else [request]
+        if not orgs:
+            return {'matches': [], 'unmatched': []}
+        matches, unmatched = self.match_orgs(orgs_frame(orgs))
+        # to_json writes missing values as null and nullable integers as numbers
+        return {'matches': json.loads(matches.to_json(orient='records')),
+                'unmatched': json.loads(unmatched.to_json(orient='records'))}
+
+
+def make_handler(service):
+    """
+    Builds the HTTP request handler of a service.
+
+    Args:
+        service (MatchService): The service that answers the requests.
+
+    Returns:
+        type: The handler class. GET /health reports the loaded schools, POST /match matches the
+            organizations in the JSON body.
+
+    """
+    class MatchHandler(BaseHTTPRequestHandler):
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != '/health':
+                self._reply(404, {'error': f"unknown path {self.path}"})
+                return
+            self._reply(200, {'schools': len(service.df_schools), 'cutoff': service.cutoff, 'state': service.state})
+
+        def do_POST(self):
+            if self.path != '/match':
+                self._reply(404, {'error': f"unknown path {self.path}"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                self._reply(200, service.handle(request))
+            except (ValueError, TypeError, KeyError) as error:
+                self._reply(400, {'error': str(error)})
+
+        def log_message(self, format, *args):
+            # requests are not logged to keep the latency of small requests down
+            pass
+
+    return MatchHandler
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    """
+    Answers HTTP requests until interrupted. Requests are answered one at a time, since they share the score cache.
+
+    Args:
+        service (MatchService): The service that answers the requests.
+        host (str): The address to listen on, only the local machine by default.
+        port (int): The port to listen on.
+
+    """
+    server = HTTPServer((host, port), make_handler(service))
+    print(f"matching against {len(service.df_schools)} schools on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve_lines(service, lines=sys.stdin, output=sys.stdout):
+    """
+    Answers one JSON request per line, writing one JSON response per line.
+
+    Args:
+        service (MatchService): The service that answers the requests.
+        lines (iterable): The request lines.
+        output (file): Where to write the responses.
+
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            response = service.handle(json.loads(line))
+        except (ValueError, TypeError, KeyError) as error:
+            response = {'error': str(error)}
+        output.write(json.dumps(response) + '\n')
+        output.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the schools of a year in memory and match organizations against them on request.")
+    parser.add_argument("--schools", required=True, help="the schools_<year>.csv file to match against")
+    parser.add_argument("--cutoff", type=float, default=0.7, help="smallest similarity score of a good match")
+    parser.add_argument("--state", default="NC", help="the state the organizations need to be in")
+    parser.add_argument("--score-cache", help="SQLite file of name and address scores to start from and write back on exit")
+    parser.add_argument("--max-memory-scores", type=int, default=MAX_MEMORY_SCORES, help="largest number of scores to keep in memory")
+    parser.add_argument("--port", type=int, default=8765, help="the port to listen on")
+    parser.add_argument("--stdin", action="store_true", help="read one JSON request per line from stdin instead of listening")
+    args = parser.parse_args()
+
+    service = MatchService(args.schools, cutoff=args.cutoff, state=args.state, score_cache_path=args.score_cache,
+                           max_memory_scores=args.max_memory_scores)
+    try:
+        if args.stdin:
+            serve_lines(service)
+        else:
+            serve(service, port=args.port)
+    finally:
+        service.close()
@@ -0,0 +1,87 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module contains a character n-gram index over school names that is used to find the few
+schools whose names are closest to an organization's name. The index is a sparse TF-IDF matrix
+that is built once per school file, and the closest schools of many organizations are found at
+once with a sparse matrix product, so the exact Jaro-Winkler score only needs to be computed for
+those schools instead of every school.
+
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+class NameIndex:
+    """
+    A sparse character n-gram TF-IDF index over school names.
+
+    Args:
+        school_names (pandas.Series): The lowercase school names, indexed like the school dataframe.
+        ngram_range (tuple): The smallest and largest n-gram lengths.
+
+    """
+
+    def __init__(self, school_names, ngram_range=(2, 3)):
+        self.school_index = school_names.index
+        # char_wb only builds n-grams inside words, padded with a space on each side
+        self.vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=ngram_range, lowercase=True, dtype=np.float32)
+        self.matrix = self.vectorizer.fit_transform(school_names.fillna('').astype(str)).T.tocsr()
+
+    def top_k(self, names, k=10, chunk_size=5000):
+        """
+        Finds the k schools with the most similar n-gram profile for each name.
+
+        Args:
+            names (pandas.Series): The lowercase organization names, indexed like the org dataframe.
+            k (int): The number of schools to keep for each name.
+            chunk_size (int): The number of names to multiply against the index at a time.
+
+        Returns:
+            pandas.DataFrame: One row per candidate with the org index in level_0, the school index in
+                level_1 and the cosine similarity of their n-gram profiles in Similarity. Names that
+                share no n-gram with any school have no candidates.
+
+        """
+        queries = self.vectorizer.transform(names.fillna('').astype(str))
+        org_pos, school_pos, similarity = [], [], []
+
+        for start in range(0, queries.shape[0], chunk_size):
+            scores = (queries[start:start + chunk_size] @ self.matrix).tocsr()
+            for row in range(scores.shape[0]):
+                lo, hi = scores.indptr[row], scores.indptr[row + 1]
+                data, cols = scores.data[lo:hi], scores.indices[lo:hi]
+                if len(data) > k:
+                    # the k largest scores, in no particular order
+                    top = np.argpartition(-data, k - 1)[:k]
+                    data, cols = data[top], cols[top]
+                org_pos.append(np.full(len(cols), start + row))
+                school_pos.append(cols)
+                similarity.append(data)
+
+        if not org_pos:
+            return pd.DataFrame({'level_0': names.index[:0], 'level_1': self.school_index[:0], 'Similarity': []})
+        org_pos, school_pos = np.concatenate(org_pos), np.concatenate(school_pos)
+        return pd.DataFrame({
+            'level_0': names.index[org_pos],
+            'level_1': self.school_index[school_pos],
+            'Similarity': np.concatenate(similarity),
+        })
+
+    def pairs(self, names, k=10):
+        """
+        Builds the candidate (org, school) pairs of the k most similar schools of each name.
+
+        Args:
+            names (pandas.Series): The lowercase organization names, indexed like the org dataframe.
+            k (int): The number of schools to keep for each name.
+
+        Returns:
+            pandas.MultiIndex: The candidate pairs, with the org index first and the school index second.
+
+        """
+        candidates = self.top_k(names, k)
+        return pd.MultiIndex.from_arrays([candidates['level_0'].values, candidates['level_1'].values])
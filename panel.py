@@ -1,65 +1,89 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module builds a school-year panel from the yearly matches of school-linked non profits
+to schools, adds the schools that were not matched to any organization and derives school-year
+variables such as total revenue, revenue tiers and which types of organizations are alive.
+
+"""
+
 import pandas as pd
 import os
-import glob
+import argparse
 import numpy as np
-from pathlib import Path
-import fuzzymatcher
-import recordlinkage
-import math
-
-df2016 = pd.read_csv("/Users/malavikakalani/Desktop/matches crf/finalmatches2016.csv") 
-df2016['Year'] = 2016
-df2017 = pd.read_csv("/Users/malavikakalani/Desktop/matches crf/finalmatches2017.csv") 
-df2017['Year'] = 2017
-df2018 = pd.read_csv("/Users/malavikakalani/Desktop/matches crf/finalmatches2018.csv") 
-df2018['Year'] = 2018
-df2019 = pd.read_csv("/Users/malavikakalani/Desktop/matches crf/finalmatches2019.csv") 
-df2019['Year'] = 2019
-
-df2020 = pd.read_csv("/Users/malavikakalani/Desktop/matches crf/finalmatches2020.csv") 
-df2020['Year'] = 2020
-df2020.loc[(df2020['Year'] == 2020) & (df2020['schID'].astype(str).str.startswith('370')), 'schID'] = df2020['schID'].astype(str).str[3:]
-df2020['schID'] = df2020['schID'].astype(str).str.lstrip('0')
-df2020['schID'] = df2020['schID'].astype(int)
-
-df2021 = pd.read_csv("/Users/malavikakalani/Desktop/matches crf/finalmatches2021.csv") 
-df2021['Year'] = 2021
-df2021.loc[(df2021['Year'] == 2021) & (df2021['schID'].astype(str).str.startswith('370')), 'schID'] = df2021['schID'].astype(str).str[3:]
-df2021['schID'] = df2021['schID'].astype(str).str.lstrip('0')
-df2021['schID'] = df2021['schID'].astype(int)
-
-
-
-def get_unmatched_schools(schools_filepath, matches_filepath):
-    df_all = pd.read_csv(schools_filepath)
-    df_matched = pd.read_csv(matches_filepath)
-    df_all = df_all.rename(columns={'school_id': 'schID'})
-    #df_all = df_all.rename(columns={'school_level': 'School_level'})
-    merged_df = pd.merge(df_all, df_matched, on='schID', how='outer', indicator=True)
-    merged_df.to_csv("/Users/malavikakalani/Desktop/schoolcheck.csv")
-    merged_df = merged_df.rename(columns={'leaid': 'leaID'})
-    merged_df = merged_df.rename(columns={'school_name': 'School_Name'})
-    merged_df = merged_df.rename(columns={'school_level': 'School_level'})
-    merged_df = merged_df.rename(columns={'year': 'Year'})
-    merged_df['Year'] = merged_df['Year'].replace('mixed - most recent', 2021)
-    merged_df.loc[(merged_df['Year'].isin([2020, 2021])) & (merged_df['schID'].astype(str).str.startswith('370')), 'schID'] = merged_df['schID'].astype(str).str[3:]
-    merged_df['schID'] = merged_df['schID'].astype(str).str.lstrip('0')
-    merged_df['schID'] = merged_df['schID'].astype(int)
-    df_unmatched = merged_df[merged_df['_merge'] == 'left_only'].copy()
-    df_unmatched = df_unmatched[['schID', 'Year', 'leaID', 'School_Name', 'School_level']]
+from run_manifest import RunManifest
+from districts import write_rollup
+from panel_index import PanelIndex
+from school_registry import SchoolRegistry
+from schema import MATCH_SCHEMA, PANEL_SCHEMA, apply_schema, to_revenue, write_panel
+
+
+def read_matches(matches_root, year, registry=None):
+    """
+    Reads in the final matches of a year and adds the year to each match.
+
+    From 2020 on, school IDs are 12-digit NCES IDs with a 370 prefix and leading zeros, so they are
+    replaced with the school keys of the registry, which are the shorter IDs used in the earlier years.
+
+    Args:
+        matches_root (str): The directory containing the finalmatches<year>.csv files.
+        year (int): The year of the matches.
+        registry (SchoolRegistry): The school ID crosswalk, None to convert the IDs without one.
+
+    Returns:
+        pandas.DataFrame: The matches of the year.
+
+    """
+    df = pd.read_csv(os.path.join(matches_root, f"finalmatches{year}.csv"))
+    df['Year'] = year
+    if registry is None:
+        registry = SchoolRegistry()
+    df['schID'] = registry.school_keys(df['schID'], year)
+    # IDs, codes and revenue get their schema types, names are kept as strings for the groupings of the panel
+    return apply_schema(df, MATCH_SCHEMA, categorical=False)
+
+
+def get_unmatched_schools(years, matches_root, schools_root, debug_path=None, registry=None):
+    """
+    Finds the schools of the rosters that were not matched to any organization, for all years at once.
+
+    The roster schools come from the school registry and the school IDs of each year's matches are
+    read once and looked up in it, so the schools are kept with an anti-join on the school key and year.
+
+    Args:
+        years (list): The years to include.
+        matches_root (str): The directory containing the finalmatches<year>.csv files.
+        schools_root (str): The directory containing the schools_<year>.csv files.
+        debug_path (str): Write every roster school with a matched column to this CSV file, None to not write it.
+        registry (SchoolRegistry): The school ID crosswalk, None to build one from the rosters of the years.
+
+    Returns:
+        pandas.DataFrame: The unmatched schools with their schID, Year, leaID, School_Name and School_level.
+
+    """
+    if registry is None:
+        registry = SchoolRegistry()
+    roster = registry.add_years(years, schools_root).schools(years)
+
+    matched = []
+    for year in years:
+        matches = pd.read_csv(os.path.join(matches_root, f"finalmatches{year}.csv"), usecols=['schID'])
+        matches['Year'] = year
+        matched.append(matches)
+    matched = pd.concat(matched, axis=0, ignore_index=True)
+    matched['schID'] = registry.school_keys(matched['schID'], matched['Year'])
+
+    keys = pd.MultiIndex.from_frame(roster[['schID', 'Year']])
+    roster['matched'] = keys.isin(pd.MultiIndex.from_frame(matched[['schID', 'Year']]))
+    if debug_path is not None:
+        roster.to_csv(debug_path, index=False)
+
+    df_unmatched = roster[~roster['matched']].drop(columns='matched')
     df_unmatched = df_unmatched.dropna(axis = 1, how = 'all')
-    
-
-    return df_unmatched
 
-df_unmatched2016 = get_unmatched_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2016.csv", "/Users/malavikakalani/Desktop/matches crf/finalmatches2016.csv")
-df_unmatched2017 = get_unmatched_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2017.csv", "/Users/malavikakalani/Desktop/matches crf/finalmatches2017.csv")
-df_unmatched2018 = get_unmatched_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2018.csv", "/Users/malavikakalani/Desktop/matches crf/finalmatches2018.csv")
-df_unmatched2019 = get_unmatched_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2019.csv", "/Users/malavikakalani/Desktop/matches crf/finalmatches2019.csv")
-df_unmatched2020 = get_unmatched_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2020.csv", "/Users/malavikakalani/Desktop/matches crf/finalmatches2020.csv")
-df_unmatched2021 = get_unmatched_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2021.csv", "/Users/malavikakalani/Desktop/matches crf/finalmatches2021.csv")
+    return df_unmatched.reset_index(drop=True)
 
-df_all_unmatched = pd.concat([df_unmatched2016, df_unmatched2017, df_unmatched2018, df_unmatched2019, df_unmatched2020, df_unmatched2021], axis=0, ignore_index=True)
 
 def build_panel(df):
     
@@ -75,7 +99,7 @@ def build_panel(df):
     sorted_df['School_org'] = sorted_df.groupby('School_Name').cumcount() + 1
 
     # Pivot the dataframe
-    pivoted_df = sorted_df.pivot_table(index=['schID','Year', 'leaID', 'School_Name', 'School_level'], columns='School_org', values=['EIN','Org_name', 'Org_code','Rev'])
+    pivoted_df = sorted_df.pivot_table(index=['schID','Year', 'leaID', 'School_Name', 'School_level'], columns='School_org', values=['EIN','Org_name', 'Org_code','Rev'], aggfunc='first')
 
     # Flatten the multi-level column index and assign new column names
     pivoted_df.columns = [f'{col[0]}{col[1]}' for col in pivoted_df.columns.to_flat_index()]
@@ -109,100 +133,418 @@ def build_panel(df):
     pivoted_df.reset_index(inplace=True)
     
 
-    return pivoted_df
+    return apply_schema(pivoted_df, PANEL_SCHEMA)
 
 
-panel2016 = build_panel(df2016)
-panel2017 = build_panel(df2017)
-panel2018 = build_panel(df2018)
-panel2019 = build_panel(df2019)
-panel2020 = build_panel(df2020)
-panel2021 = build_panel(df2021)
+# revenue tiers as (column, lowest total revenue), in order from the highest tier down
+# a school is only flagged in the highest tier its total revenue reaches
+REVENUE_TIERS = [('ANYenormous2', 200000), ('ANYenormous', 100000), ('ANYhuge', 50000), ('ANYbig', 25000)]
 
-final_panel = pd.concat([panel2016, panel2017, panel2018, panel2019, panel2020, panel2021], axis=0, ignore_index=True)
+# organization code that each alive variable looks for
+ALIVE_CODES = {'PTAalive': 1, 'PTOalive': 2, 'BOOSTalive': 3, 'OTHERalive': 4}
 
-# ADD NEW VARIABLES TO THE PANEL AFTER BUILDING AN INITIAL FORMAT WITH ALL THE YEARS
-rev_cols = []
-for col in final_panel.columns:
-    if col.startswith('Rev'):
-        rev_cols.append(col)
 
+def parse_revenue(revs):
+    """
+    Converts revenue columns to numbers, removing dollar signs and thousands separators from strings.
 
-final_panel['TotRev'] = 0
-row_counter1 = 0 
-for school in final_panel['School_Name']:
-    revs = []
-    for rev_col in rev_cols:
-        if type(final_panel.loc[row_counter1, rev_col]) == str:
-            final_panel.loc[row_counter1, rev_col] = final_panel.loc[row_counter1, rev_col].replace('$','')
-            final_panel.loc[row_counter1, rev_col] = final_panel.loc[row_counter1, rev_col].replace(',','')
-        
-        
-        revs.append(float(final_panel.loc[row_counter1, rev_col]))
+    Args:
+        revs (pandas.DataFrame): The revenue columns.
 
-    new_revs = [x if not math.isnan(x) else 0 for x in revs]
-    final_panel.loc[row_counter1, 'TotRev'] = sum(new_revs)
-    #print(revs, row_counter1)
-    row_counter1 += 1
+    Returns:
+        pandas.DataFrame: The revenues as floats, with missing values where there is no revenue.
 
-final_panel['ANYbig'] = 0 # indicate orgs with revenue greater than $25000
-final_panel['ANYhuge'] = 0 # indicate orgs with revenue greater than $50000
-final_panel['ANYenormous'] = 0 # indicate orgs with revenue greater than $100000
-final_panel['ANYenormous2'] = 0 # indicate orgs with revenue greater than $200000
+    """
+    return revs.apply(to_revenue)
 
-row_counter0 = 0
-for school in final_panel['School_Name']: 
-    if (final_panel.loc[row_counter0, 'TotRev'] >= 200000):
-        final_panel.loc[row_counter0, 'ANYenormous2'] = 1
 
-    elif (final_panel.loc[row_counter0, 'TotRev'] >= 100000):
-        final_panel.loc[row_counter0, 'ANYenormous'] = 1
+def derive_variables(final_panel, tiers=REVENUE_TIERS):
+    """
+    Adds the derived school-year variables to the panel, working on whole columns at once.
 
-    elif (final_panel.loc[row_counter0, 'TotRev'] >= 50000):
-        final_panel.loc[row_counter0, 'ANYenormous'] = 1
+    TotRev is the sum of the Rev columns, the tier variables flag the highest revenue tier each
+    school reaches, ANYalive flags schools with any organization and PTAalive, PTOalive, BOOSTalive
+    and OTHERalive flag schools with an organization of that type.
 
-    elif (final_panel.loc[row_counter0, 'TotRev'] >= 25000):
-        final_panel.loc[row_counter0, 'ANYbig'] = 1
+    Args:
+        final_panel (pandas.DataFrame): The panel built by build_panel for one or more years.
+        tiers (list): The revenue tiers as (column, lowest total revenue).
 
-    row_counter0 += 1
-    
-org_code_cols = []
-for col in final_panel.columns:
-    if col.startswith('Org_code'): 
-        org_code_cols.append(col)
-
-#variables needed: ANYalive, PTOalive, PTAalive, BOOSTalive, OTHERalive
-final_panel['ANYalive'] = 0
-final_panel['PTAalive'] = 0
-final_panel['PTOalive'] = 0
-final_panel['BOOSTalive'] = 0
-final_panel['OTHERalive'] = 0
-row_counter2 = 0
-for school in final_panel['School_Name']: # iterate through each row
-    codes = []
-    for code_col in org_code_cols:
-        codes.append(final_panel.loc[row_counter2, code_col])
-    
-    if len(codes) != 0:
-        final_panel.loc[row_counter2, 'ANYalive'] = 1
+    Returns:
+        pandas.DataFrame: The panel with the derived variables.
 
-    if codes.__contains__(1):
-        final_panel.loc[row_counter2, 'PTAalive'] = 1
+    """
+    final_panel = final_panel.copy()
+    rev_cols = [col for col in final_panel.columns if col.startswith('Rev')]
+    org_code_cols = [col for col in final_panel.columns if col.startswith('Org_code')]
+    ein_cols = [col for col in final_panel.columns if col.startswith('EIN')]
 
-    if codes.__contains__(2):
-        final_panel.loc[row_counter2, 'PTOalive'] = 1
+    # ADD NEW VARIABLES TO THE PANEL AFTER BUILDING AN INITIAL FORMAT WITH ALL THE YEARS
+    final_panel[rev_cols] = parse_revenue(final_panel[rev_cols])
+    final_panel['TotRev'] = final_panel[rev_cols].sum(axis=1)
 
-    if codes.__contains__(3):
-        final_panel.loc[row_counter2, 'BOOSTalive'] = 1
-    
-    if codes.__contains__(4):
-        final_panel.loc[row_counter2, 'OTHERalive'] = 1
+    # only flag the highest tier a school reaches, the tier variables are added from the lowest tier up
+    tiers = sorted(tiers, key=lambda tier: tier[1], reverse=True)
+    tier_index = np.select([final_panel['TotRev'] >= threshold for col, threshold in tiers], range(len(tiers)), default=-1)
+    for i, (col, threshold) in reversed(list(enumerate(tiers))):
+        final_panel[col] = (tier_index == i).astype(int)
+
+    #variables needed: ANYalive, PTOalive, PTAalive, BOOSTalive, OTHERalive
+    codes = final_panel[org_code_cols]
+    final_panel['ANYalive'] = final_panel[ein_cols].notna().any(axis=1).astype(int)
+    for col, code in ALIVE_CODES.items():
+        final_panel[col] = (codes == code).any(axis=1).astype(int)
+
+    return apply_schema(final_panel, PANEL_SCHEMA)
+
+
+def order_panel_columns(panel):
+    """
+    Orders the columns of a wide panel as the school keys, EIN{i}, Org_name{i}, Org_code{i} and Rev{i}
+    for each organization in turn, and then the derived variables.
+
+    Args:
+        panel (pandas.DataFrame): The wide panel.
+
+    Returns:
+        pandas.DataFrame: The panel with its columns reordered.
+
+    """
+    keys = ['schID', 'Year', 'leaID', 'School_Name', 'School_level']
+    num_orgs = max([int(col[3:]) for col in panel.columns if col.startswith('EIN') and col[3:].isdigit()], default=0)
+    org_cols = [f'{col}{i}' for i in range(1, num_orgs + 1) for col in ['EIN', 'Org_name', 'Org_code', 'Rev']]
+    org_cols = [col for col in org_cols if col in panel.columns]
+    other_cols = [col for col in panel.columns if col not in keys and col not in org_cols]
+    return panel[[col for col in keys if col in panel.columns] + org_cols + other_cols]
+
+
+def update_panel(panel, year, matches_root, schools_root, tiers=REVENUE_TIERS, unmatched_debug_path=None, registry=None):
+    """
+    Adds a new year to an existing final panel without rebuilding the years it already has.
+
+    Only the new year's matches and schools are read. Its slice of the panel is built and derived on
+    its own, together with its unmatched schools, and merged into the panel sorted by schID and Year.
+    Rows of the panel that already have the new year are replaced, so rerunning an update is safe.
+
+    Args:
+        panel (pandas.DataFrame): The existing final panel.
+        year (int): The year to add.
+        matches_root (str): The directory containing the finalmatches<year>.csv file of the year.
+        schools_root (str): The directory containing the schools_<year>.csv file of the year.
+        tiers (list): The revenue tiers as (column, lowest total revenue).
+        unmatched_debug_path (str): Write the year's roster with a matched column to this CSV file, None to not write it.
+        registry (SchoolRegistry): The school ID crosswalk, None to build one from the roster of the year.
+
+    Returns:
+        pandas.DataFrame: The panel with the new year.
+
+    """
+    if registry is None:
+        registry = SchoolRegistry()
+    registry.add_years([year], schools_root)
+    year_panel = derive_variables(build_panel(read_matches(matches_root, year, registry)), tiers)
+    df_unmatched = get_unmatched_schools([year], matches_root, schools_root, debug_path=unmatched_debug_path, registry=registry)
+
+    new_panel = pd.concat([panel[panel['Year'] != year], year_panel, df_unmatched], axis=0, ignore_index=True)
+    new_panel = apply_schema(new_panel.sort_values(by=['schID', 'Year']), PANEL_SCHEMA)
+    # a year with more organizations per school than before adds new EIN{i} columns at the end
+    return order_panel_columns(new_panel)
+
+
+# columns that identify a school-year in the panel
+SCHOOL_KEYS = ['schID', 'Year', 'leaID', 'School_Name', 'School_level']
+
+
+def build_long_panel(df):
+    """
+    Builds a long panel from the matches of one or more years, with one row per school, year and organization.
 
-    row_counter2 += 1
+    The rows are built in a single groupby pass over (schID, Year, EIN), which keeps the first match of
+    an organization to a school in a year. School_org numbers the organizations of each school-year in
+    the order they appear in the matches.
 
-new_panel = pd.concat([final_panel,df_all_unmatched],axis=0, ignore_index=True)
-new_panel = new_panel.sort_values(by=['schID', 'Year'])
+    Args:
+        df (pandas.DataFrame): The matches, with a Year column.
 
+    Returns:
+        pandas.DataFrame: The long panel with the SCHOOL_KEYS columns and EIN, School_org, Org_name, Org_code and Rev.
 
-new_panel.to_csv("/Users/malavikakalani/Desktop/FINAL_PANEL.csv")
+    """
+    df = df[SCHOOL_KEYS + ['EIN', 'Organization_Name', 'Org_code', 'Revenue']]
+    df = df.rename(columns={'Organization_Name': 'Org_name', 'Revenue': 'Rev'})
+
+    long_panel = df.groupby(['schID', 'Year', 'EIN'], sort=False, dropna=False).first().reset_index()
+    long_panel['Rev'] = parse_revenue(long_panel[['Rev']])['Rev']
+    long_panel['School_org'] = long_panel.groupby(['schID', 'Year']).cumcount() + 1
+
+    return apply_schema(long_panel[SCHOOL_KEYS + ['School_org', 'EIN', 'Org_name', 'Org_code', 'Rev']], PANEL_SCHEMA)
+
+
+def derive_long(long_panel, tiers=REVENUE_TIERS):
+    """
+    Derives the school-year variables from a long panel in a single grouped pass.
+
+    The variables are the same as the ones derive_variables adds to the wide panel, together with
+    Orgs, the number of organizations of each school-year.
+
+    Args:
+        long_panel (pandas.DataFrame): The long panel built by build_long_panel.
+        tiers (list): The revenue tiers as (column, lowest total revenue).
+
+    Returns:
+        pandas.DataFrame: One row per school-year with the SCHOOL_KEYS columns and the derived variables.
 
+    """
+    # indicator columns for each organization type, so that the flags are maxima within a school-year
+    flags = long_panel[SCHOOL_KEYS].copy()
+    flags['TotRev'] = long_panel['Rev'].fillna(0)
+    flags['Orgs'] = long_panel['EIN'].notna().astype(int)
+    for col, code in ALIVE_CODES.items():
+        flags[col] = (long_panel['Org_code'] == code).astype(int)
+
+    school_years = flags.groupby(SCHOOL_KEYS, sort=False, dropna=False, observed=True).agg(
+        {'TotRev': 'sum', 'Orgs': 'sum', **{col: 'max' for col in ALIVE_CODES}}).reset_index()
+
+    # only flag the highest tier a school reaches, the tier variables are added from the lowest tier up
+    tiers = sorted(tiers, key=lambda tier: tier[1], reverse=True)
+    tier_index = np.select([school_years['TotRev'] >= threshold for col, threshold in tiers], range(len(tiers)), default=-1)
+    for i, (col, threshold) in reversed(list(enumerate(tiers))):
+        school_years[col] = (tier_index == i).astype(int)
+    school_years['ANYalive'] = (school_years['Orgs'] > 0).astype(int)
+
+    tier_cols = [col for col, threshold in reversed(tiers)]
+    return apply_schema(school_years[SCHOOL_KEYS + ['Orgs', 'TotRev'] + tier_cols + ['ANYalive'] + list(ALIVE_CODES)], PANEL_SCHEMA)
+
+
+def widen_panel(long_panel, school_years=None):
+    """
+    Produces the wide view of a long panel, with EIN{i}, Org_name{i}, Org_code{i} and Rev{i} columns
+    for the i-th organization of each school-year.
+
+    Args:
+        long_panel (pandas.DataFrame): The long panel built by build_long_panel.
+        school_years (pandas.DataFrame): The derived school-year variables to add, None to leave them out.
+
+    Returns:
+        pandas.DataFrame: The wide panel with one row per school-year.
+
+    """
+    orgs = long_panel[long_panel['EIN'].notna()]
+    wide = orgs.set_index(SCHOOL_KEYS + ['School_org'])[['EIN', 'Org_name', 'Org_code', 'Rev']].unstack('School_org')
+
+    # order the columns as EIN1, Org_name1, Org_code1, Rev1, EIN2, ...
+    wide = wide.sort_index(axis=1, level='School_org', sort_remaining=False)
+    wide.columns = [f'{col}{i}' for col, i in wide.columns]
+    wide = wide.reset_index()
+
+    if school_years is not None:
+        wide = school_years[SCHOOL_KEYS].merge(wide, on=SCHOOL_KEYS, how='left').merge(school_years, on=SCHOOL_KEYS, how='left')
+    return wide
+
+
+def build_long_final_panel(years, matches_root, schools_root, tiers=REVENUE_TIERS, manifest=None, unmatched_debug_path=None, registry=None):
+    """
+    Builds the long panel of all years and its school-year variables, including the schools without any
+    matched organization.
+
+    Args:
+        years (list): The years to include.
+        matches_root (str): The directory containing the finalmatches<year>.csv files.
+        schools_root (str): The directory containing the schools_<year>.csv files.
+        tiers (list): The revenue tiers as (column, lowest total revenue).
+        manifest (RunManifest): Records the time and rows of each step.
+        unmatched_debug_path (str): Write the rosters with a matched column to this CSV file, None to not write it.
+        registry (SchoolRegistry): The school ID crosswalk, None to build one from the rosters of the years.
+
+    Returns:
+        tuple: The long panel with one row per school, year and organization, and the school-year
+            variables with one row per school-year, both sorted by schID and Year.
+
+    """
+    if manifest is None:
+        manifest = RunManifest()
+    if registry is None:
+        registry = SchoolRegistry()
+
+    with manifest.stage('school_registry') as stage:
+        registry.add_years(years, schools_root)
+        stage['rows_out'] = len(registry.crosswalk)
+    with manifest.stage('read_matches') as stage:
+        matches = pd.concat([read_matches(matches_root, year, registry) for year in years], axis=0, ignore_index=True)
+        stage['rows_out'] = len(matches)
+    with manifest.stage('build_long_panel', rows_in=len(matches)) as stage:
+        long_panel = build_long_panel(matches)
+        stage['rows_out'] = len(long_panel)
+    with manifest.stage('derive_long', rows_in=len(long_panel)) as stage:
+        school_years = derive_long(long_panel, tiers)
+        stage['rows_out'] = len(school_years)
+
+    with manifest.stage('unmatched_schools') as stage:
+        df_all_unmatched = get_unmatched_schools(years, matches_root, schools_root, debug_path=unmatched_debug_path, registry=registry)
+        stage['rows_out'] = len(df_all_unmatched)
+
+    # unmatched schools have a single row without an organization
+    long_panel = pd.concat([long_panel, df_all_unmatched], axis=0, ignore_index=True).sort_values(by=['schID', 'Year'])
+    school_years = pd.concat([school_years, df_all_unmatched], axis=0, ignore_index=True).sort_values(by=['schID', 'Year'])
+    return apply_schema(long_panel, PANEL_SCHEMA), apply_schema(school_years, PANEL_SCHEMA)
+
+
+def update_long_panel(long_panel, school_years, year, matches_root, schools_root, tiers=REVENUE_TIERS, unmatched_debug_path=None, registry=None):
+    """
+    Adds a new year to an existing long panel and its school-year variables without rebuilding the
+    years they already have.
+
+    Only the new year's matches and schools are read. Rows that already have the new year are
+    replaced, so rerunning an update is safe.
+
+    Args:
+        long_panel (pandas.DataFrame): The existing long panel.
+        school_years (pandas.DataFrame): The existing school-year variables of the long panel.
+        year (int): The year to add.
+        matches_root (str): The directory containing the finalmatches<year>.csv file of the year.
+        schools_root (str): The directory containing the schools_<year>.csv file of the year.
+        tiers (list): The revenue tiers as (column, lowest total revenue).
+        unmatched_debug_path (str): Write the year's roster with a matched column to this CSV file, None to not write it.
+        registry (SchoolRegistry): The school ID crosswalk, None to build one from the roster of the year.
+
+    Returns:
+        tuple: The long panel and the school-year variables with the new year, sorted by schID and Year.
+
+    """
+    year_panel, year_school_years = build_long_final_panel([year], matches_root, schools_root, tiers,
+                                                           unmatched_debug_path=unmatched_debug_path, registry=registry)
+    long_panel = pd.concat([long_panel[long_panel['Year'] != year], year_panel], axis=0, ignore_index=True)
+    school_years = pd.concat([school_years[school_years['Year'] != year], year_school_years], axis=0, ignore_index=True)
+    # stable sorts keep the organizations of each school-year in their School_org order
+    long_panel = long_panel.sort_values(by=['schID', 'Year'], kind='stable')
+    school_years = school_years.sort_values(by=['schID', 'Year'], kind='stable')
+    return apply_schema(long_panel, PANEL_SCHEMA), apply_schema(school_years, PANEL_SCHEMA)
+
+
+def build_final_panel(years, matches_root, schools_root, tiers=REVENUE_TIERS, manifest=None, unmatched_debug_path=None, registry=None):
+    """
+    Builds the final panel of all years, including the schools without any matched organization.
+
+    Args:
+        years (list): The years to include.
+        matches_root (str): The directory containing the finalmatches<year>.csv files.
+        schools_root (str): The directory containing the schools_<year>.csv files.
+        tiers (list): The revenue tiers as (column, lowest total revenue).
+        manifest (RunManifest): Records the time and rows of each step.
+        unmatched_debug_path (str): Write the rosters with a matched column to this CSV file, None to not write it.
+        registry (SchoolRegistry): The school ID crosswalk, None to build one from the rosters of the years.
+
+    Returns:
+        pandas.DataFrame: The panel sorted by schID and Year.
+
+    """
+    if manifest is None:
+        manifest = RunManifest()
+    if registry is None:
+        registry = SchoolRegistry()
+
+    with manifest.stage('school_registry') as stage:
+        registry.add_years(years, schools_root)
+        stage['rows_out'] = len(registry.crosswalk)
+    with manifest.stage('read_matches') as stage:
+        matches = [read_matches(matches_root, year, registry) for year in years]
+        stage['rows_out'] = sum(len(df) for df in matches)
+    with manifest.stage('build_panel', rows_in=sum(len(df) for df in matches)) as stage:
+        panels = [build_panel(df) for df in matches]
+        final_panel = pd.concat(panels, axis=0, ignore_index=True)
+        stage['rows_out'] = len(final_panel)
+    with manifest.stage('derive_variables', rows_in=len(final_panel)) as stage:
+        final_panel = derive_variables(final_panel, tiers)
+        stage['rows_out'] = len(final_panel)
+
+    with manifest.stage('unmatched_schools') as stage:
+        df_all_unmatched = get_unmatched_schools(years, matches_root, schools_root, debug_path=unmatched_debug_path, registry=registry)
+        stage['rows_out'] = len(df_all_unmatched)
+
+    new_panel = pd.concat([final_panel,df_all_unmatched],axis=0, ignore_index=True)
+    new_panel = new_panel.sort_values(by=['schID', 'Year'])
+    return apply_schema(new_panel, PANEL_SCHEMA)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the school-year panel from the yearly matches.")
+    parser.add_argument("--years", type=int, nargs="+", default=[2016, 2017, 2018, 2019, 2020, 2021], help="years to include")
+    parser.add_argument("--matches-root", required=True, help="directory with the finalmatches<year>.csv files")
+    parser.add_argument("--schools-root", required=True, help="directory with the schools_<year>.csv files")
+    parser.add_argument("--output", default="FINAL_PANEL.csv", help="path to write the panel to")
+    parser.add_argument("--layout", choices=["wide", "long"], default="wide",
+                        help="wide writes one row per school-year with EIN1..EINn columns, long writes one row per school, year and organization")
+    parser.add_argument("--school-years-output", default="FINAL_PANEL_SCHOOL_YEARS.csv",
+                        help="path to write the school-year variables to in the long layout")
+    parser.add_argument("--update-year", type=int,
+                        help="add this year to the existing panel at --output, and --school-years-output in the long layout, instead of rebuilding all years")
+    parser.add_argument("--profile", type=int, choices=[0, 1, 2], default=0,
+                        help="write a <output>.manifest.json, 1 records time, memory and rows of each step, 2 also traces allocations")
+    parser.add_argument("--parquet-root",
+                        help="also write the panel as Parquet files partitioned by year to this directory, an update only rewrites its year")
+    parser.add_argument("--index",
+                        help="also write the panel to this indexed SQLite file for panel_index.py queries, an update only rewrites its year")
+    parser.add_argument("--district-root",
+                        help="also write the leaID x Year district rollups as Parquet files partitioned by year to this directory, an update only rewrites its year")
+    parser.add_argument("--unmatched-debug", help="write the school rosters with a matched column to this CSV file")
+    parser.add_argument("--school-registry",
+                        help="keep the crosswalk from roster school IDs to school keys in this Parquet file, rosters already in it are not read again")
+    args = parser.parse_args()
+
+    manifest = RunManifest(args.profile, years=args.years, layout=args.layout)
+    registry = SchoolRegistry(args.school_registry)
+
+    if args.update_year is not None and args.layout == "long":
+        long_panel = pd.read_csv(args.output)
+        school_years = pd.read_csv(args.school_years_output)
+        with manifest.stage('update_panel', rows_in=len(long_panel), year=args.update_year) as stage:
+            long_panel, school_years = update_long_panel(long_panel, school_years, args.update_year, args.matches_root, args.schools_root,
+                                                         unmatched_debug_path=args.unmatched_debug, registry=registry)
+            stage['rows_out'] = len(long_panel)
+        long_panel.to_csv(args.output, index=False)
+        school_years.to_csv(args.school_years_output, index=False)
+        if args.parquet_root:
+            write_panel(long_panel, args.parquet_root, years=[args.update_year])
+        if args.index:
+            PanelIndex(args.index).build(long_panel, school_years, years=[args.update_year]).close()
+        if args.district_root:
+            with manifest.stage('district_rollup', year=args.update_year):
+                write_rollup(long_panel, args.district_root, school_years, years=[args.update_year])
+    elif args.update_year is not None:
+        panel = pd.read_csv(args.output, index_col=0)
+        with manifest.stage('update_panel', rows_in=len(panel), year=args.update_year) as stage:
+            new_panel = update_panel(panel, args.update_year, args.matches_root, args.schools_root,
+                                     unmatched_debug_path=args.unmatched_debug, registry=registry)
+            stage['rows_out'] = len(new_panel)
+        new_panel.to_csv(args.output)
+        if args.parquet_root:
+            write_panel(new_panel, args.parquet_root, years=[args.update_year])
+        if args.index:
+            PanelIndex(args.index).build(new_panel, years=[args.update_year]).close()
+        if args.district_root:
+            with manifest.stage('district_rollup', year=args.update_year):
+                write_rollup(new_panel, args.district_root, years=[args.update_year])
+    elif args.layout == "long":
+        long_panel, school_years = build_long_final_panel(args.years, args.matches_root, args.schools_root, manifest=manifest,
+                                                          unmatched_debug_path=args.unmatched_debug, registry=registry)
+        long_panel.to_csv(args.output, index=False)
+        school_years.to_csv(args.school_years_output, index=False)
+        if args.parquet_root:
+            write_panel(long_panel, args.parquet_root)
+        if args.index:
+            PanelIndex(args.index).build(long_panel, school_years).close()
+        if args.district_root:
+            with manifest.stage('district_rollup'):
+                write_rollup(long_panel, args.district_root, school_years)
+    else:
+        new_panel = build_final_panel(args.years, args.matches_root, args.schools_root, manifest=manifest,
+                                      unmatched_debug_path=args.unmatched_debug, registry=registry)
+        new_panel.to_csv(args.output)
+        if args.parquet_root:
+            write_panel(new_panel, args.parquet_root)
+        if args.index:
+            PanelIndex(args.index).build(new_panel).close()
+        if args.district_root:
+            with manifest.stage('district_rollup'):
+                write_rollup(new_panel, args.district_root)
+    manifest.write(f"{args.output}.manifest.json")
@@ -0,0 +1,241 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module keeps the final panel in an indexed SQLite file, so questions such as all
+organizations ever linked to a school, all schools of a district in some years or every school an
+EIN has matched to are answered without loading the whole panel.
+
+The file has two tables. school_years has one row per school-year with the school variables of the
+panel, and links has one row per school, year and matched organization. Both are indexed on the
+school, the district and the year, and links is also indexed on the EIN. The file is built by the
+panel step and only needs the sqlite3 module of the standard library, so it works offline.
+
+"""
+
+import argparse
+import re
+import sqlite3
+
+import pandas as pd
+
+from schema import PANEL_SCHEMA, apply_schema
+
+
+# the columns of an organization linked to a school-year, numbered EIN1..EINn in the wide panel
+ORG_COLUMNS = ['EIN', 'Org_name', 'Org_code', 'Rev']
+
+LINK_KEYS = ['schID', 'Year', 'leaID', 'School_Name', 'School_level', 'School_org']
+
+INDEXES = {
+    'school_years': [('schID', 'Year'), ('leaID', 'Year'), ('Year',)],
+    'links': [('schID', 'Year'), ('EIN', 'Year'), ('leaID', 'Year'), ('Year',)],
+}
+
+
+def panel_links(panel):
+    """
+    Lists the organizations linked to each school-year of a panel.
+
+    Args:
+        panel (pandas.DataFrame): The wide panel with EIN{i} columns or the long panel with an EIN column.
+
+    Returns:
+        pandas.DataFrame: One row per school, year and organization, with the LINK_KEYS and ORG_COLUMNS.
+
+    """
+    if 'EIN' in panel.columns:
+        links = panel[[col for col in LINK_KEYS + ORG_COLUMNS if col in panel.columns]]
+    else:
+        num_orgs = max([int(col[3:]) for col in panel.columns if re.fullmatch(r'EIN\d+', col)], default=0)
+        keys = [col for col in LINK_KEYS if col in panel.columns and col != 'School_org']
+        # one slice per organization number, renamed to the long columns
+        links = pd.concat([panel[keys + [f'{col}{i}' for col in ORG_COLUMNS]]
+                           .rename(columns={f'{col}{i}': col for col in ORG_COLUMNS})
+                           .assign(School_org=i)
+                           for i in range(1, num_orgs + 1)], axis=0, ignore_index=True)
+    links = links[links['EIN'].notna()]
+    return links.sort_values(['schID', 'Year', 'School_org']).reset_index(drop=True)
+
+
+def panel_school_years(panel):
+    """
+    Keeps the school variables of a wide panel, one row per school-year.
+
+    Args:
+        panel (pandas.DataFrame): The wide panel, or the school-year variables of the long layout.
+
+    Returns:
+        pandas.DataFrame: The panel without the organization columns.
+
+    """
+    org_cols = [col for col in panel.columns if re.fullmatch(r'(EIN|Org_name|Org_code|Rev)\d*', col)]
+    return panel.drop(columns=org_cols + ['School_org'], errors='ignore').drop_duplicates(['schID', 'Year'])
+
+
+class PanelIndex:
+    """
+    The final panel in an indexed SQLite file.
+
+    Args:
+        path (str): The SQLite file of the index.
+
+    """
+
+    def __init__(self, path):
+        # the panel step can rebuild a year while researchers keep querying the file
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.execute("PRAGMA journal_mode=WAL")
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.db.close()
+
+    def _tables(self):
+        """
+        Lists the tables already in the file.
+        """
+        return {name for (name,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    def build(self, panel, school_years=None, years=None):
+        """
+        Writes a panel to the index.
+
+        Args:
+            panel (pandas.DataFrame): The wide panel, or the long panel of the long layout.
+            school_years (pandas.DataFrame): The school-year variables of the long layout, None for a wide panel.
+            years (list): The years of the panel to replace in the index, None to replace the whole index.
+                The other years already in the index are kept, so a single year can be updated.
+
+        Returns:
+            PanelIndex: The index.
+
+        """
+        tables = {
+            'school_years': panel_school_years(panel if school_years is None else school_years),
+            'links': panel_links(panel),
+        }
+        existing = self._tables()
+        # a year is replaced in a single transaction, so queries never see it half written
+        with self.db:
+            for table, df in tables.items():
+                if years is not None:
+                    df = df[df['Year'].isin(years)]
+                if years is None or table not in existing:
+                    self.db.execute(f"DROP TABLE IF EXISTS {table}")
+                    self.db.execute(pd.io.sql.get_schema(df, table, con=self.db))
+                    for i, cols in enumerate(INDEXES[table]):
+                        self.db.execute(f"CREATE INDEX {table}_{i} ON {table} ({', '.join(cols)})")
+                else:
+                    self.db.executemany(f"DELETE FROM {table} WHERE Year = ?", [(int(year),) for year in years])
+                columns = ', '.join(f'"{col}"' for col in df.columns)
+                marks = ', '.join('?' * len(df.columns))
+                # nullable integers and categoricals are written as Python values with None for missing ones
+                rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+                self.db.executemany(f"INSERT INTO {table} ({columns}) VALUES ({marks})", rows)
+        return self
+
+    def _select(self, table, where, params, years=None, columns=None):
+        """
+        Reads the rows of a table that match a condition.
+
+        Args:
+            table (str): school_years or links.
+            where (str): The SQL condition on the indexed columns.
+            params (list): The values of the condition.
+            years (list): The years to keep, None for every year.
+            columns (list): The columns to read, None for every column.
+
+        Returns:
+            pandas.DataFrame: The rows with the panel types, sorted by schID and Year.
+
+        """
+        if years is not None:
+            years = [int(year) for year in years]
+            where += f" AND Year IN ({', '.join('?' * len(years))})"
+            params = list(params) + years
+        selected = '*' if columns is None else ', '.join(f'"{col}"' for col in columns)
+        order = 'schID, Year, School_org' if table == 'links' else 'schID, Year'
+        df = pd.read_sql_query(f"SELECT {selected} FROM {table} WHERE {where} ORDER BY {order}", self.db, params=params)
+        return apply_schema(df, PANEL_SCHEMA)
+
+    def school(self, schID, years=None, columns=None):
+        """
+        Reads the school-year rows of a school.
+
+        Args:
+            schID (int): The school ID.
+            years (list): The years to read, None for every year.
+            columns (list): The columns to read, None for every column.
+
+        Returns:
+            pandas.DataFrame: The school variables of each year of the school.
+
+        """
+        return self._select('school_years', 'schID = ?', [int(schID)], years, columns)
+
+    def school_orgs(self, schID, years=None):
+        """
+        Reads all organizations ever linked to a school.
+
+        Args:
+            schID (int): The school ID.
+            years (list): The years to read, None for every year.
+
+        Returns:
+            pandas.DataFrame: One row per year and organization of the school.
+
+        """
+        return self._select('links', 'schID = ?', [int(schID)], years)
+
+    def district_schools(self, leaID, years=None, columns=None):
+        """
+        Reads the school-year rows of all schools of a district.
+
+        Args:
+            leaID (int): The district ID.
+            years (list): The years to read, such as range(2018, 2021), None for every year.
+            columns (list): The columns to read, None for every column.
+
+        Returns:
+            pandas.DataFrame: The school variables of each school and year of the district.
+
+        """
+        return self._select('school_years', 'leaID = ?', [int(leaID)], years, columns)
+
+    def ein_schools(self, ein, years=None):
+        """
+        Reads every school an organization has matched to.
+
+        Args:
+            ein (int): The EIN of the organization.
+            years (list): The years to read, None for every year.
+
+        Returns:
+            pandas.DataFrame: One row per school and year the organization is linked to.
+
+        """
+        return self._select('links', 'EIN = ?', [int(ein)], years)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the indexed final panel built by panel.py --index.")
+    parser.add_argument("--index", required=True, help="the SQLite file of the index")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--school", type=int, help="all organizations ever linked to this schID")
+    query.add_argument("--district", type=int, help="all schools of this leaID")
+    query.add_argument("--ein", type=int, help="every school this EIN has matched to")
+    parser.add_argument("--years", type=int, nargs="+", help="only these years")
+    args = parser.parse_args()
+
+    index = PanelIndex(args.index)
+    if args.school is not None:
+        result = index.school_orgs(args.school, args.years)
+    elif args.district is not None:
+        result = index.district_schools(args.district, args.years)
+    else:
+        result = index.ein_schools(args.ein, args.years)
+    index.close()
+    print(result.to_csv(index=False), end='')
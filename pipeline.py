@@ -0,0 +1,356 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module runs the matching pipeline and the panel as a graph of stages, driven by a JSON
+config file. Each year has its own stages:
+
+    orgs:<org year>     filter the BMF and Core files and format the organizations (STEP 1 to STEP 4)
+    schools:<year>      format the schools (STEP 5)
+    candidates:<year>   the exact matches and both matching rounds, before filtering (STEP 6A to STEP 7)
+    matches:<year>      filter out the bad matches and write finalmatches<year>.csv (STEP 8 and STEP 9)
+    panel:<year>        build and derive the panel slice of the year, with its unmatched schools
+
+and an export stage writes the panel of all years, with its Parquet files, index and district
+rollups if the config asks for them. A lifecycle stage follows the organizations and schools
+across the matches of all years if the config has a lifecycle_root.
+
+Each stage has a fingerprint made of its parameters, the contents of its input files, the code it
+runs and the fingerprints of the stages it depends on. A stage is only run again when its
+fingerprint changed or its outputs are missing, so changing the STEP 8 cutoff only reruns the
+matches, panel and export stages, and adding a year only runs the stages of that year. Stages
+whose dependencies are done run at the same time in separate processes.
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+
+import lifecycle
+import panel
+import pto_codebook
+from districts import write_rollup
+from frame_cache import file_digest, input_files
+from panel_index import PanelIndex
+from schema import PANEL_SCHEMA, apply_schema, write_panel
+from score_cache import ScoreCache
+
+
+# the settings of a run, any of which can be set in the config file
+DEFAULT_CONFIG = {
+    'years': [2016, 2017, 2018, 2019, 2020, 2021],
+    # the year of BMF and Core files of each school year, as {"<year>": <org year>}, defaults to the school year
+    'org_years': {},
+    'bmf_root': None,
+    'core_root': None,
+    'schools_root': None,
+    'output_root': None,
+    # the directory of the intermediate results and fingerprints of the stages
+    'work_dir': 'pipeline_work',
+    'state': 'NC',
+    'cutoff': 0.7,
+    # the round 2 name pairs below this score are not scored, it needs to be at most the cutoff and
+    # keeping it at the lowest cutoff that will be tried means a new cutoff does not rerun the matching
+    'prune_cutoff': None,
+    'chunk_size': None,
+    'score_cache': None,
+    'score_threads': None,
+    'panel_output': 'FINAL_PANEL.csv',
+    'parquet_root': None,
+    'index': None,
+    'district_root': None,
+    # the directory of the org_years, orgs and schools files of lifecycle.py, None to not follow the orgs
+    'lifecycle_root': None,
+    'workers': None,
+}
+
+# the settings that change the results of a stage, the others only change how fast it runs
+STAGE_PARAMS = {
+    'orgs': ['state'],
+    'schools': [],
+    'candidates': ['prune_cutoff'],
+    'matches': ['cutoff'],
+    'panel': [],
+    'export': ['parquet_root', 'index', 'district_root'],
+    'lifecycle': ['lifecycle_root'],
+}
+
+# the modules each kind of stage runs, school_registry.py uses the name stems of pto_codebook.py and
+# the file digests of frame_cache.py
+STAGE_CODE = {
+    'orgs': ['pto_codebook.py', 'frame_cache.py'],
+    'schools': ['pto_codebook.py'],
+    'candidates': ['pto_codebook.py', 'jaro_winkler.py', 'score_cache.py', 'name_index.py'],
+    'matches': ['pto_codebook.py', 'schema.py'],
+    'panel': ['panel.py', 'schema.py', 'school_registry.py', 'pto_codebook.py', 'frame_cache.py'],
+    'export': ['panel.py', 'schema.py', 'panel_index.py', 'districts.py'],
+    'lifecycle': ['lifecycle.py', 'panel.py', 'schema.py', 'school_registry.py', 'pto_codebook.py', 'frame_cache.py'],
+}
+
+
+def load_config(path):
+    """
+    Reads a pipeline config file. Relative paths in the file are relative to the file.
+
+    Args:
+        path (str): The JSON config file.
+
+    Returns:
+        dict: The config with the defaults of the settings it does not set.
+
+    Raises:
+        ValueError: If the config has unknown settings, misses a required directory or has a
+            prune_cutoff above its cutoff.
+
+    """
+    with open(path) as file:
+        config = json.load(file)
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"unknown settings in {path}: {', '.join(sorted(unknown))}")
+    config = {**DEFAULT_CONFIG, **config}
+
+    base = os.path.dirname(os.path.abspath(path))
+    for key in ['bmf_root', 'core_root', 'schools_root', 'output_root', 'work_dir', 'score_cache',
+                'panel_output', 'parquet_root', 'index', 'district_root', 'lifecycle_root']:
+        if config[key] is not None:
+            config[key] = os.path.join(base, config[key])
+    for key in ['bmf_root', 'core_root', 'schools_root', 'output_root']:
+        if config[key] is None:
+            raise ValueError(f"{path} needs a {key}")
+    if config['prune_cutoff'] is not None and config['prune_cutoff'] > config['cutoff']:
+        raise ValueError("prune_cutoff cannot be above cutoff, the pruned pairs could be good matches")
+    return config
+
+
+def plan_stages(config):
+    """
+    Declares the stages of a run and what each of them reads, writes and depends on.
+
+    Args:
+        config (dict): The config of the run.
+
+    Returns:
+        dict: The stages by name in dependency order, each with its kind, year, dependencies, input
+            files and output files.
+
+    """
+    work = config['work_dir']
+    stages = {}
+
+    def add(name, kind, year=None, deps=(), inputs=(), outputs=()):
+        stages[name] = {'name': name, 'kind': kind, 'year': year, 'deps': list(deps), 'inputs': list(inputs), 'outputs': list(outputs)}
+
+    for year in config['years']:
+        org_year = int(config['org_years'].get(str(year), year))
+        if f'orgs:{org_year}' not in stages:
+            add(f'orgs:{org_year}', 'orgs', org_year,
+                inputs=[os.path.join(config['bmf_root'], str(org_year)), os.path.join(config['core_root'], str(org_year))],
+                outputs=[os.path.join(work, 'orgs', f'{org_year}.pkl')])
+        schools_path = os.path.join(config['schools_root'], f"schools_{year}.csv")
+        add(f'schools:{year}', 'schools', year, inputs=[schools_path], outputs=[os.path.join(work, 'schools', f'{year}.pkl')])
+        add(f'candidates:{year}', 'candidates', year, deps=[f'orgs:{org_year}', f'schools:{year}'],
+            outputs=[os.path.join(work, 'candidates', f'{year}.pkl')])
+        add(f'matches:{year}', 'matches', year, deps=[f'candidates:{year}'],
+            outputs=[os.path.join(config['output_root'], f"finalmatches{year}.csv")])
+        add(f'panel:{year}', 'panel', year, deps=[f'matches:{year}'], inputs=[schools_path],
+            outputs=[os.path.join(work, 'panel', f'{year}.pkl')])
+
+    outputs = [config['panel_output']] + [config[key] for key in ['parquet_root', 'index', 'district_root'] if config[key]]
+    add('export', 'export', deps=[f'panel:{year}' for year in config['years']], outputs=outputs)
+    if config['lifecycle_root']:
+        add('lifecycle', 'lifecycle', deps=[f'matches:{year}' for year in config['years']],
+            inputs=[os.path.join(config['schools_root'], f"schools_{year}.csv") for year in config['years']],
+            outputs=[os.path.join(config['lifecycle_root'], file) for file in lifecycle.LIFECYCLE_FILES.values()])
+    return stages
+
+
+def fingerprint(stage, config, fingerprints):
+    """
+    Computes the fingerprint of a stage.
+
+    Args:
+        stage (dict): The stage, as planned by plan_stages.
+        config (dict): The config of the run.
+        fingerprints (dict): The fingerprints of the stages it depends on.
+
+    Returns:
+        str: The hex SHA-256 fingerprint of the stage.
+
+    """
+    digest = hashlib.sha256()
+    params = {key: config[key] for key in STAGE_PARAMS[stage['kind']]}
+    # the export and lifecycle stages depend on which years they put together
+    params['years'] = config['years'] if stage['year'] is None else stage['year']
+    digest.update(json.dumps({'name': stage['name'], 'params': params}, sort_keys=True).encode())
+    for path in input_files(stage['inputs']):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in STAGE_CODE[stage['kind']]:
+        digest.update(file_digest(os.path.join(here, module)).encode())
+    for dep in stage['deps']:
+        digest.update(fingerprints[dep].encode())
+    return digest.hexdigest()
+
+
+def _write_pickle(obj, path):
+    """
+    Writes an intermediate result of a stage, so a stage that fails halfway leaves no partial output.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.to_pickle(obj, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def run_stage(stage, config, dep_outputs):
+    """
+    Runs one stage.
+
+    Args:
+        stage (dict): The stage, as planned by plan_stages.
+        config (dict): The config of the run.
+        dep_outputs (dict): The output files of the stages it depends on.
+
+    Returns:
+        str: The name of the stage.
+
+    """
+    kind, year, output = stage['kind'], stage['year'], stage['outputs'][0]
+    if kind == 'orgs':
+        bmf_path, core_path = stage['inputs']
+        _write_pickle(pto_codebook.prepare_orgs(bmf_path, core_path, state=config['state']), output)
+    elif kind == 'schools':
+        _write_pickle(pto_codebook.prepare_schools(stage['inputs'][0]), output)
+    elif kind == 'candidates':
+        orgs_output, schools_output = (dep_outputs[dep][0] for dep in stage['deps'])
+        df_final_orgs, df_final_orgs_copy, df_allorgs_withpo = pd.read_pickle(orgs_output)
+        score_cache = ScoreCache(config['score_cache'], workers=config['score_threads'])
+        candidates = pto_codebook.find_matches(df_final_orgs, df_final_orgs_copy, df_allorgs_withpo, pd.read_pickle(schools_output),
+                                               chunk_size=config['chunk_size'], score_cache=score_cache, name_cutoff=config['prune_cutoff'])
+        score_cache.close()
+        _write_pickle(candidates, output)
+    elif kind == 'matches':
+        candidates = pd.read_pickle(dep_outputs[stage['deps'][0]][0])
+        pto_codebook.write_matches(candidates, year, config['output_root'], config['cutoff'])
+    elif kind == 'panel':
+        _write_pickle(panel.build_final_panel([year], config['output_root'], config['schools_root']), output)
+    elif kind == 'export':
+        export_panel(config, [dep_outputs[dep][0] for dep in stage['deps']])
+    elif kind == 'lifecycle':
+        lifecycle.write_lifecycle(lifecycle.build_lifecycle(config['years'], config['output_root'], config['schools_root']),
+                                  config['lifecycle_root'])
+    return stage['name']
+
+
+def export_panel(config, year_outputs):
+    """
+    Puts the panel slices of the years together and writes the panel and its other outputs.
+
+    Args:
+        config (dict): The config of the run.
+        year_outputs (list): The files of the panel slices of the years.
+
+    """
+    new_panel = pd.concat([pd.read_pickle(path) for path in year_outputs], axis=0, ignore_index=True)
+    new_panel = panel.order_panel_columns(apply_schema(new_panel.sort_values(by=['schID', 'Year']), PANEL_SCHEMA))
+    new_panel.to_csv(config['panel_output'])
+    if config['parquet_root']:
+        write_panel(new_panel, config['parquet_root'])
+    if config['index']:
+        PanelIndex(config['index']).build(new_panel).close()
+    if config['district_root']:
+        write_rollup(new_panel, config['district_root'])
+
+
+def run_pipeline(config, force=(), dry_run=False):
+    """
+    Runs the stages of a config whose fingerprint changed or whose outputs are missing.
+
+    Args:
+        config (dict): The config of the run, as read by load_config.
+        force (list): Names of stages to run even if they are up to date, such as matches:2021.
+        dry_run (bool): Only report which stages would run.
+
+    Returns:
+        dict: The status of each stage, 'fresh' if it was up to date and 'ran' or 'stale' otherwise.
+
+    Raises:
+        RuntimeError: If stages failed, after the stages that do not depend on them have run.
+
+    """
+    stages = plan_stages(config)
+    state_path = os.path.join(config['work_dir'], 'pipeline_state.json')
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path) as file:
+            state = json.load(file)
+
+    fingerprints, status = {}, {}
+    for name, stage in stages.items():
+        fingerprints[name] = fingerprint(stage, config, fingerprints)
+        fresh = (state.get(name) == fingerprints[name] and name not in force
+                 and all(os.path.exists(path) for path in stage['outputs'])
+                 and all(status[dep] == 'fresh' for dep in stage['deps']))
+        status[name] = 'fresh' if fresh else 'stale'
+    if dry_run:
+        return status
+
+    def save_state():
+        os.makedirs(config['work_dir'], exist_ok=True)
+        with open(f"{state_path}.tmp", 'w') as file:
+            json.dump(state, file, indent=2, sort_keys=True)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    pending = {name for name in stages if status[name] == 'stale'}
+    failed = {}
+    workers = config['workers'] or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while pending or running:
+            # start every stage whose dependencies are done
+            for name in sorted(pending):
+                deps = stages[name]['deps']
+                if any(dep in failed for dep in deps):
+                    pending.discard(name)
+                    failed[name] = "depends on a failed stage"
+                elif all(status[dep] in ('fresh', 'ran') for dep in deps):
+                    pending.discard(name)
+                    dep_outputs = {dep: stages[dep]['outputs'] for dep in deps}
+                    running[executor.submit(run_stage, stages[name], config, dep_outputs)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except Exception as error:
+                    failed[name] = repr(error)
+                    continue
+                status[name] = 'ran'
+                state[name] = fingerprints[name]
+                save_state()
+                print(f"{name}: done")
+
+    if failed:
+        raise RuntimeError("stages failed: " + ", ".join(f"{name} ({error})" for name, error in sorted(failed.items())))
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stages of the matching pipeline and panel that are out of date.")
+    parser.add_argument("--config", required=True, help="the JSON config file of the run")
+    parser.add_argument("--force", nargs="+", default=[], help="stages to run even if they are up to date, such as matches:2021")
+    parser.add_argument("--dry-run", action="store_true", help="only list the stages and whether they are up to date")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    status = run_pipeline(config, force=args.force, dry_run=args.dry_run)
+    for name, stage_status in status.items():
+        print(f"{name}: {stage_status}")
@@ -16,14 +16,249 @@ Date: June 12, 2023
 # python libraries required for codebook
 import pandas as pd
 import os
-import glob
+import re
+import argparse
 import numpy as np
-from pathlib import Path
-import fuzzymatcher
 import recordlinkage
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from frame_cache import FrameCache
+from name_index import NameIndex
+from score_cache import ScoreCache
+from run_manifest import RunManifest
+from schema import MATCH_SCHEMA, apply_schema
+
+
+# In the original file, 4 and 6 are recoded to boosters, 5, 8, 9, 10, 11, 12 are recoded as other
+
+# list to store possible explicit terms for a PTA
+PTA_NAMES = ["PTA ", " PTA", "P T A", "PTA-", "PTSA", "P T S A", "PARENT TEACHER ASSOCIATION", "PARENT-TEACHER ASSOCIATION", "PARENT-TEACHER ASS",
+    "PARENT TEACHER ASS", "PARENT TEACHER STUDENT ASSOCIATION", "PARENT AND TEACHER ASSOCIATION", "PARENTS AND TEACHERS ASSOCIATION",
+    "PARENTS TEACHERS ASSOCIATION", "PARENT & TEACHER ASSOCIATION", "PARENT TEACHERS ASSOCIATION", "PARENT- TEACHERS ASSOCIATION",
+    "PARENT- TEACHER ASSOCIATION", "PARENT-TEACHERS ASSOCIATION", "PARENTS-TEACHERS ASSOCIATION", "PARENT-TEACHER- STUDENT ASSOCIATION",
+    "PARENT- TEACHER-STUDENT ASSOCIATION", "PARENT TEACHER STUDENT ASSOCIATON", "PARENTS TEACHERS AND STUDENTS ASSOC", "PARENTS TEACHERS & STUDENTS ASSO",
+    "PARENT-TEACHER-STUDENT ASSOCIATION", "PARENT-TEACHER STUDENT ASSOCIATION", "PARENT TEACHER STUDENT ASS", "PARENT TEACHERS STUDENT ASSOCIATION",
+    "PARENTS & TEACHERS ASSN", "PARENT & TEACHERS ASSOC", "PARENT AND TEACHERS ASSOCATION", "PARENT TEACHERS ASSN", "PARENT TEACHERS ASSO", "PARENTS TEACHERS ASSOC",
+    "PARENT-TEACHERS ASSN", "PARENTS TEACHER ASSOCIATION", "PARENT TEACHERS ASS", "PARENTS & TEACHERS ASSOCIATION", "PARENT TEACHER AND STUDENT ASSOC", "PARENT & TEACHER ASSOC", "PARENT TEACHER FELLOWSHIP"]
+
+# list to store possible explicit terms for a PTO
+PTO_NAMES = ["PTO "," PTO","P T O","PTO-","-PTO","PTSO","P T S O","PTO "," PTO",
+    "P T O","-PTO", "PTSO", "SUNDANCE PARENTS ASSOCIATION", "LULING PARENTEACHER BOOSTERS",
+    "BEVERLEY MANOR ELEMENTARY PARENT TEACHER BOOSTER CLUB"]
+
+# list to store possible occurences of words in any order to indicate a PTO
+PTO_TERMS = [["PARENT","TEACHER", "ORG"],["PARENTS","TEACHER", "ORG"],
+    ["PARENT","TEACHER", " ORG"],["PARENT","TEACH", " ORG"],["PARENT","TEACH"," ASS"],
+    ["PARENT","STAFF"," ORG"],["PARENT","SCHOOL"," ORG"],["PARENT","SCHOOL"," ORG"],
+    ["PARENT","FACUL"," ORG"]]
+
+# list to store possible explicit terms for arts and sports boosters
+BOOSTER_NAMES = ["BOOSTER CLUB", "BOOSTERS CLUB", "BAND BOOSTER", "MUSIC BOOSTER", "BAND", "MUSIC", "MARCHING", "CHOIR", "SPIRIT", "DANCE", "FIRST FLIGHT HIGH SCHOOL FINE ARTS BOOSTERS",
+    "MINT HILL MIDDLE SCHOOL PERFORMING ARTS BOOSTER CLUB", "PANTHER CREEK HIGH SCHOOL FINE ARTS BOOSTER CLUB", "HOLLY SPRINGS HIGH SCHOOL FINE ARTS BOOSTERS INC",
+    "CRESTDALE MIDDLE SCHOOL ARTS BOOSTERS INC", "GREEN HOPE HIGH SCHOOL FINE ARTS BOOSTERS", "CARY HIGH SCHOOL PERFORMING ARTS BOOSTER CLUB",
+    "LEESVILLE ROAD HIGH SCHOOL PERFORMING ARTS BOOSTERS", "CLAYTON HIGH SCHOOL PERFORMING ARTS BOOSTER CLUB", "SOUTH CHARLOTTE MIDDLE SCHOOL FINE ARTS NETWORK",
+    "NORTHEAST MIDDLE SCHOOL PERFORMING ARTS BOOSTER CLUB", "EAST MECK ART BOOSTERS", "ATHLETIC BOOSTER", "FOOTBALL BOOSTER", " SPORTS BOOSTER", "ATHLETIC",
+    "QUARTERBACK CLUB", "SOCCER", "SWIM", "GYMNAST", "FOOTBALL", "TOUCHDOWN", "CHEER", "CREW", " SPORT", "PARENT BOOSTER", "BOOSTER ASSOCIATION", "MILE-HIGH DIVING TEAM BOOSTER CLUB",
+    "CREW BOOSTERS OF WINTER PARK INC", "CREW BOOSTERS CLUB OF CENTRAL FLORIDA INC", "LAKE ZURICH POM BOOSTER CLUB", "ICE ATHLETICS BOOSTERS CLUB INC", "LAKES CROSS-COUNTRY BOOSTER CLU",
+    "J J PEARCE PACESETTER BOOSTER CLUB", "HARMONY HIGH BALLROOM BOOSTERS INC", "YORBA LINDA MIDDLE SCHOOL INSTRUCTIONAL MUCIC BOOSTER CLUB", "BOOSTER ASSOCIATION FOR STRING STUDENTS",
+    "FORT MADISON VOCAL BOOSTERS INC", "MERIDIAN MARCHING UNIT BOOSTERS", "FRIENDS OF BEETHOVEN BOOSTER CLUB", "CASTILLERO VOCAL BOOSTER CLUB 6384 LEYLAND PARK DR"]
+
+# list to store possible occurences of words in any order to indicate arts and sports boosters
+BOOSTER_TERMS = [["SCHOOL", "BAND"], ["SCHOOL", "MUSIC"], ["SCHOOL", "CHOIR"], ["SCHOOL", "CHORAL"],
+    ["SCHOOL", "THEATER"], ["SCHOOL", "THEATRE"], ["SCHOOL", "DRAMA"], ["SCHOOL", "DANCE"], ["BAND", "HIGH"], ["CHORAL", "HIGH"],
+    ["DRAMA", "HIGH"], ["BAND", "HS "], ["PARENT", "GYMNAST"], ["PARENT", " SPORT"], ["PARENT", "CHEER"], ["SCHOOL", "ATHLETIC BOOSTER"],
+    ["SCHOOL", "QUARTERBACK CLUB"], ["SCHOOL", "LACROSSE"], ["SCHOOL", "CHEER"], ["SCHOOL", "VOLLEYBALL"], ["SCHOOL", "ATHLETIC"],
+    ["HIGH", "ATHLETIC BOOSTER"], ["HIGH", "ATHLETIC"], ["HS ", "ATHLETIC BOOSTER"], [ "HS ", "CHEER"], ]
+
+# list to store possible explicit terms for other school-linked organizations
+OTHER_NAMES = ["NEWPORT HARBOR HIGH SCHOOL AQUATIC BOOSTER CLUB", "FOUNTAIN VALLEY HIGH SCHOOL GIRLS VALLEYBALL BOOSTERS", "LINCOLN HIGH HOMEPLATE CLUB INC HIGH SCHOOL BOOSTER ORGANIZA",
+    "KENNESAW MOUNTAIN HIGH SCHOOL LACROSS BOOSTER CLUB", "CHAMPAIGN CENTRAL HIGH SCHOOL BASEB ALL BOOSTERS", "AG BOOSTER", "AGRICULTURE BOOSTER", "SPEECH AND DEBATE BOOSTER", "TECHNOLOGY BOOSTER",
+    "INTERNATIONAL BACCALAUREATE BOOSTER", "COMMUNITY COUNCIL", "PARTNERS IN EDUCATION", "EDUCATIONAL SUPPORT", "SCHOOL SUPPORT", "SCHOOL FOUNDATION", "PARENT"]
+
+# list to store possible occurences of words in any order to indicate other school-linked organizations
+OTHER_TERMS = [["SCHOOL", "FOUNDATION"], ["FRIENDS OF", "HIGH"], ["FRIENDS OF", "HS"], ["FRIENDS OF", "ELEM"], ["FRIENDS OF", "SCHOOL"]]
 
+# list to store terms that need to be dropped from the dataset
+DROP_NAMES = ["HOME SCHOOL", "HOME AND SCHOOL", "LESBIANS AND GAYS", "LESBIANS & GAYS"]
+
+# organization codes in order of priority, an org that matches the rules of several categories
+# is given the first code: PTA > PTO > booster > other
+ORG_CODE_RULES = [(1, PTA_NAMES, []), (2, PTO_NAMES, PTO_TERMS), (3, BOOSTER_NAMES, BOOSTER_TERMS), (4, OTHER_NAMES, OTHER_TERMS)]
+
+
+def compile_names(names):
+    """
+    Compiles a list of explicit names into a single regular expression that matches if any of the
+    names appears in an org name.
+
+    The names are merged into a trie so that names with a common prefix share their branches, which
+    lets the expression check all names in one scan of the org name instead of one scan per name.
+
+    Args:
+        names (list): The explicit names of a category.
+
+    Returns:
+        re.Pattern: The compiled regular expression for the names.
+
+    """
+    trie = {}
+    for name in names:
+        node = trie
+        for char in name:
+            node = node.setdefault(char, {})
+        # an empty key marks the end of a name
+        node[''] = {}
 
-def filter_data(path):
+    def build(node):
+        if list(node) == ['']:
+            return ''
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char != '']
+        if len(branches) == 1 and '' not in node:
+            return branches[0]
+        # a name can end here even though longer names continue, so the rest is optional
+        return '(?:' + '|'.join(branches) + ')' + ('?' if '' in node else '')
+
+    return re.compile(build(trie))
+
+
+# precompiled classifier, one regular expression for the drop list and for the explicit names of each category
+DROP_PATTERN = compile_names(DROP_NAMES)
+ORG_CODE_PATTERNS = [(code, compile_names(names), terms) for code, names, terms in ORG_CODE_RULES]
+
+
+def classify_orgs(names, drop=False):
+    """
+    Categorizes organization names into PTAs (1), PTOs (2), boosters (3) and other school-linked
+    organizations (4), with 0 for names that do not fall into any category.
+
+    The whole column is classified at once. The explicit names of each category are checked with
+    one regular expression, and each term of the co-occurrence lists is looked up once and combined
+    across lists with boolean masks. Only the names that are still unclassified are given the code
+    of the next category.
+
+    In the original loop the drop list check was always overwritten by the category checks that
+    follow it, so names on the drop list keep the code of their category. This is kept by default
+    so the codes of existing data do not change.
+
+    Args:
+        names (pandas.Series): The upper case organization names.
+        drop (bool): Mark the names on the drop list as 0 even when they fall into a category.
+
+    Returns:
+        pandas.Series: The organization code of each name, indexed like names.
+
+    """
+    # classify each distinct name once
+    name_ids, unique_names = pd.factorize(names.fillna('').astype(str))
+    unique_names = pd.Series(unique_names, dtype=object)
+    codes = np.zeros(len(unique_names), dtype=np.int64)
+
+    # masks of the names that contain each term, shared by all categories
+    term_masks = {}
+    def contains_term(word):
+        if word not in term_masks:
+            term_masks[word] = unique_names.str.contains(word, regex=False).values
+        return term_masks[word]
+
+    remaining = np.ones(len(unique_names), dtype=bool)
+    if drop:
+        # orgs on the drop list are marked as 0 and never categorized
+        remaining &= ~unique_names.str.contains(DROP_PATTERN).values
+    for code, pattern, terms in ORG_CODE_PATTERNS:
+        matched = unique_names.str.contains(pattern).values
+        for words in terms:
+            matched = matched | np.logical_and.reduce([contains_term(word) for word in words])
+        matched &= remaining
+        codes[matched] = code
+        remaining &= ~matched
+
+    return pd.Series(codes[name_ids], index=names.index)
+
+
+# columns of the BMF and Core files that are used by the rest of the pipeline, all other columns are not read in
+ORG_COLUMNS = ['EIN', 'NAME', 'SEC_NAME', 'STATE', 'NTEE1', 'NTEEFINAL', 'ADDRESS', 'ZIP5', 'FIPS', 'TOTREV', 'TOTREV2']
+
+
+def iter_orgs(path, state='NC', ntee='B', usecols=ORG_COLUMNS, chunksize=100000):
+    """
+    Reads in the CSV files in the given directory in chunks and yields the organizations of a state
+    and NTEE code of each chunk.
+
+    The state and NTEE filters and the column projection are applied to each chunk as it is read,
+    and EINs that were already seen in an earlier chunk or file are removed, so only one chunk is
+    ever held in memory. Every chunk has the columns of all files, with missing values where a
+    file does not have a column.
+
+    Args:
+        path (str): The path to the directory containing CSV files.
+        state (str): The state the organizations need to be in, None to keep the organizations of all states.
+        ntee (str): The NTEE code the organizations need to have.
+        usecols (list): The columns to read in, columns that are missing from a file are skipped.
+            None reads in all columns.
+        chunksize (int): The number of rows to read in at a time.
+
+    Yields:
+        pandas.DataFrame: The filtered organizations of a chunk, each EIN only in the first chunk it is in.
+
+    Raises:
+        FileNotFoundError: If the specified directory does not exist.
+
+    """
+    # column names are compared in upper case because all column strings are made upper case later on
+    wanted = None if usecols is None else {col.upper() for col in usecols} | {'EIN', 'STATE', 'NTEE1'}
+    usecols = None if wanted is None else (lambda col: col.upper() in wanted)
+    seen_eins = set()
+
+    # read all CSV files in the given year's directory to combine all provided months
+    files = [os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith(".csv")]
+    # the columns of all files in the order they first appear, as they would be after concatenating the files
+    columns = []
+    for file_path in files:
+        columns += [col for col in pd.read_csv(file_path, nrows=0, usecols=usecols).columns if col not in columns]
+
+    for file_path in files:
+        reader = pd.read_csv(file_path, chunksize=chunksize, low_memory=False, usecols=usecols)
+        for chunk in reader:
+            # filtering by state and by NTEE code to only look at education indicated by B
+            keep = chunk['NTEE1'].str.contains(ntee, na = False)
+            if state is not None:
+                keep &= chunk['STATE'].str.contains(state, na = False)
+            chunk = chunk[keep]
+            # removing the EINs of orgs that have already been seen once in that year
+            chunk = chunk.drop_duplicates(subset = "EIN")
+            chunk = chunk[~chunk['EIN'].isin(seen_eins)]
+            seen_eins.update(chunk['EIN'])
+            yield chunk.reindex(columns=columns)
+
+
+def read_orgs(path, state='NC', ntee='B', usecols=ORG_COLUMNS, chunksize=100000):
+    """
+    Reads in the CSV files in the given directory in chunks and keeps the organizations of a state and NTEE code.
+
+    The chunks are read and filtered by iter_orgs, so only the filtered organizations are ever held in memory.
+
+    Args:
+        path (str): The path to the directory containing CSV files.
+        state (str): The state the organizations need to be in, None to keep the organizations of all states.
+        ntee (str): The NTEE code the organizations need to have.
+        usecols (list): The columns to read in, columns that are missing from a file are skipped.
+            None reads in all columns.
+        chunksize (int): The number of rows to read in at a time.
+
+    Returns:
+        pandas.DataFrame: The filtered organizations, one row per EIN.
+
+    Raises:
+        FileNotFoundError: If the specified directory does not exist.
+
+    """
+    chunks = list(iter_orgs(path, state, ntee, usecols, chunksize))
+    if not chunks:
+        wanted = None if usecols is None else {col.upper() for col in usecols} | {'EIN', 'STATE', 'NTEE1'}
+        return pd.DataFrame(columns=sorted(wanted or []))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def filter_data(path, state='NC', ntee='B', chunksize=100000, manifest=None):
     """
     Reads in and filters CSV files in the given directory.
     Categorizes data of non-profit organizations down to traditional 
@@ -33,6 +268,10 @@ def filter_data(path):
 
     Args:
         path (str): The path to the directory containing CSV files.
+        state (str): The state the organizations need to be in.
+        ntee (str): The NTEE code the organizations need to have.
+        chunksize (int): The number of rows to read in at a time.
+        manifest (RunManifest): Records the time and rows of reading and classifying the organizations.
 
     Returns:
         pandas.DataFrame: The filtered and categorized data as a DataFrame.
@@ -41,125 +280,21 @@ def filter_data(path):
         FileNotFoundError: If the specified directory does not exist.
 
     """
-    
-     # read all csv files from the given directory 
-    files_orgs = os.listdir(path)
-
-    # create an empty dataframe to store the organization data 
-    df_orgs = pd.DataFrame() 
-
-    # read all CSV files in the given year's directory to combine all provided months 
-    for file in files_orgs:
-        file_path = os.path.join(path, file)  # Get the full file path
-        if file.endswith(".csv"):  # Check if the file is a CSV file
-            df_temp = pd.read_csv(file_path)
-            df_orgs = df_orgs.append(df_temp, ignore_index=True)
-
-    # filtering by state to only look at NC 
-    df_orgs = df_orgs[df_orgs['STATE'].str.contains('NC', na = False)]
-
-    # filtering by NTEE code to only look at education indicated by B
-    df_orgs = df_orgs[df_orgs['NTEE1'].str.contains('B', na = False)]
-
-    # removing the EINs of orgs that have already been seen once in that year 
-    df_orgs = df_orgs.drop_duplicates(subset = "EIN")
-    # reset indices of rows after removing duplicates 
-    df_orgs = df_orgs.reset_index()
-
-
-    # In the original file, 4 and 6 are recoded to boosters, 5, 8, 9, 10, 11, 12 are recoded as other
-
-    # array to store possible explicit terms for a PTA
-    pta_names = np.array(["PTA ", " PTA", "P T A", "PTA-", "PTSA", "P T S A", "PARENT TEACHER ASSOCIATION", "PARENT-TEACHER ASSOCIATION", "PARENT-TEACHER ASS", 
-    "PARENT TEACHER ASS", "PARENT TEACHER STUDENT ASSOCIATION", "PARENT AND TEACHER ASSOCIATION", "PARENTS AND TEACHERS ASSOCIATION", 
-    "PARENTS TEACHERS ASSOCIATION", "PARENT & TEACHER ASSOCIATION", "PARENT TEACHERS ASSOCIATION", "PARENT- TEACHERS ASSOCIATION", 
-    "PARENT- TEACHER ASSOCIATION", "PARENT-TEACHERS ASSOCIATION", "PARENTS-TEACHERS ASSOCIATION", "PARENT-TEACHER- STUDENT ASSOCIATION", 
-    "PARENT- TEACHER-STUDENT ASSOCIATION", "PARENT TEACHER STUDENT ASSOCIATON", "PARENTS TEACHERS AND STUDENTS ASSOC", "PARENTS TEACHERS & STUDENTS ASSO", 
-    "PARENT-TEACHER-STUDENT ASSOCIATION", "PARENT-TEACHER STUDENT ASSOCIATION", "PARENT TEACHER STUDENT ASS", "PARENT TEACHERS STUDENT ASSOCIATION", 
-    "PARENTS & TEACHERS ASSN", "PARENT & TEACHERS ASSOC", "PARENT AND TEACHERS ASSOCATION", "PARENT TEACHERS ASSN", "PARENT TEACHERS ASSO", "PARENTS TEACHERS ASSOC", 
-    "PARENT-TEACHERS ASSN", "PARENTS TEACHER ASSOCIATION", "PARENT TEACHERS ASS", "PARENTS & TEACHERS ASSOCIATION", "PARENT TEACHER AND STUDENT ASSOC", "PARENT & TEACHER ASSOC", "PARENT TEACHER FELLOWSHIP"])
-
-    # array to store possible explicit terms for a PTO
-    pto_names = np.array(["PTO "," PTO","P T O","PTO-","-PTO","PTSO","P T S O","PTO "," PTO",
-                        "P T O","-PTO", "PTSO", "SUNDANCE PARENTS ASSOCIATION", "LULING PARENTEACHER BOOSTERS", 
-                        "BEVERLEY MANOR ELEMENTARY PARENT TEACHER BOOSTER CLUB"])
-
-    # array to store possible occurences of words in any order to indicate a PTO
-    pto_terms = np.array([["PARENT","TEACHER", "ORG"],["PARENTS","TEACHER", "ORG"],
-                        ["PARENT","TEACHER", " ORG"],["PARENT","TEACH", " ORG"],["PARENT","TEACH"," ASS"],
-                        ["PARENT","STAFF"," ORG"],["PARENT","SCHOOL"," ORG"],["PARENT","SCHOOL"," ORG"],
-                        ["PARENT","FACUL"," ORG"]])
-
-    # array to store possible explicit terms for arts and sports boosters 
-    booster_names = np.array(["BOOSTER CLUB", "BOOSTERS CLUB", "BAND BOOSTER", "MUSIC BOOSTER", "BAND", "MUSIC", "MARCHING", "CHOIR", "SPIRIT", "DANCE", "FIRST FLIGHT HIGH SCHOOL FINE ARTS BOOSTERS", 
-    "MINT HILL MIDDLE SCHOOL PERFORMING ARTS BOOSTER CLUB", "PANTHER CREEK HIGH SCHOOL FINE ARTS BOOSTER CLUB", "HOLLY SPRINGS HIGH SCHOOL FINE ARTS BOOSTERS INC", 
-    "CRESTDALE MIDDLE SCHOOL ARTS BOOSTERS INC", "GREEN HOPE HIGH SCHOOL FINE ARTS BOOSTERS", "CARY HIGH SCHOOL PERFORMING ARTS BOOSTER CLUB", 
-    "LEESVILLE ROAD HIGH SCHOOL PERFORMING ARTS BOOSTERS", "CLAYTON HIGH SCHOOL PERFORMING ARTS BOOSTER CLUB", "SOUTH CHARLOTTE MIDDLE SCHOOL FINE ARTS NETWORK", 
-    "NORTHEAST MIDDLE SCHOOL PERFORMING ARTS BOOSTER CLUB", "EAST MECK ART BOOSTERS", "ATHLETIC BOOSTER", "FOOTBALL BOOSTER", " SPORTS BOOSTER", "ATHLETIC", 
-    "QUARTERBACK CLUB", "SOCCER", "SWIM", "GYMNAST", "FOOTBALL", "TOUCHDOWN", "CHEER", "CREW", " SPORT", "PARENT BOOSTER", "BOOSTER ASSOCIATION", "MILE-HIGH DIVING TEAM BOOSTER CLUB", 
-    "CREW BOOSTERS OF WINTER PARK INC", "CREW BOOSTERS CLUB OF CENTRAL FLORIDA INC", "LAKE ZURICH POM BOOSTER CLUB", "ICE ATHLETICS BOOSTERS CLUB INC", "LAKES CROSS-COUNTRY BOOSTER CLU", 
-    "J J PEARCE PACESETTER BOOSTER CLUB", "HARMONY HIGH BALLROOM BOOSTERS INC", "YORBA LINDA MIDDLE SCHOOL INSTRUCTIONAL MUCIC BOOSTER CLUB", "BOOSTER ASSOCIATION FOR STRING STUDENTS", 
-    "FORT MADISON VOCAL BOOSTERS INC", "MERIDIAN MARCHING UNIT BOOSTERS", "FRIENDS OF BEETHOVEN BOOSTER CLUB", "CASTILLERO VOCAL BOOSTER CLUB 6384 LEYLAND PARK DR"])
-
-    # array to store possible occurences of words in any order to indicate arts and sports boosters 
-    booster_terms = np.array([["SCHOOL", "BAND"], ["SCHOOL", "MUSIC"], ["SCHOOL", "CHOIR"], ["SCHOOL", "CHORAL"],
-    ["SCHOOL", "THEATER"], ["SCHOOL", "THEATRE"], ["SCHOOL", "DRAMA"], ["SCHOOL", "DANCE"], ["BAND", "HIGH"], ["CHORAL", "HIGH"],
-    ["DRAMA", "HIGH"], ["BAND", "HS "], ["PARENT", "GYMNAST"], ["PARENT", " SPORT"], ["PARENT", "CHEER"], ["SCHOOL", "ATHLETIC BOOSTER"],
-    ["SCHOOL", "QUARTERBACK CLUB"], ["SCHOOL", "LACROSSE"], ["SCHOOL", "CHEER"], ["SCHOOL", "VOLLEYBALL"], ["SCHOOL", "ATHLETIC"], 
-    ["HIGH", "ATHLETIC BOOSTER"], ["HIGH", "ATHLETIC"], ["HS ", "ATHLETIC BOOSTER"], [ "HS ", "CHEER"], ])
+    if manifest is None:
+        manifest = RunManifest()
 
-    # array to store possible explicit terms for other school-linked organizations 
-    other_names = np.array(["NEWPORT HARBOR HIGH SCHOOL AQUATIC BOOSTER CLUB", "FOUNTAIN VALLEY HIGH SCHOOL GIRLS VALLEYBALL BOOSTERS", "LINCOLN HIGH HOMEPLATE CLUB INC HIGH SCHOOL BOOSTER ORGANIZA", 
-    "KENNESAW MOUNTAIN HIGH SCHOOL LACROSS BOOSTER CLUB", "CHAMPAIGN CENTRAL HIGH SCHOOL BASEB ALL BOOSTERS", "AG BOOSTER", "AGRICULTURE BOOSTER", "SPEECH AND DEBATE BOOSTER", "TECHNOLOGY BOOSTER", 
-    "INTERNATIONAL BACCALAUREATE BOOSTER", "COMMUNITY COUNCIL", "PARTNERS IN EDUCATION", "EDUCATIONAL SUPPORT", "SCHOOL SUPPORT", "SCHOOL FOUNDATION", "PARENT"])
+    # read in the organizations of the state with an education NTEE code, one row per EIN
+    with manifest.stage('read_orgs', path=path) as stage:
+        df_orgs = read_orgs(path, state=state, ntee=ntee, chunksize=chunksize)
+        stage['rows_out'] = len(df_orgs)
 
-    # array to store possible occurences of words in any order to indicate other school-linked organizations
-    other_terms = np.array([["SCHOOL", "FOUNDATION"], ["FRIENDS OF", "HIGH"], ["FRIENDS OF", "HS"], ["FRIENDS OF", "ELEM"], ["FRIENDS OF", "SCHOOL"]])
+    # categorize each organization, orgs on the drop list or outside of every category are marked as 0
+    with manifest.stage('classify_orgs', rows_in=len(df_orgs), path=path) as stage:
+        df_orgs['ORG CODE'] = classify_orgs(df_orgs['NAME'])
 
-    # array to store terms that need to be dropped from the dataset
-    drop_names = np.array(["HOME SCHOOL", "HOME AND SCHOOL", "LESBIANS AND GAYS", "LESBIANS & GAYS"])
-    
-    # function to check if a given string contains all the words in a given array 
-    def contain_terms(text, words):
-        return all(word in text for word in words)
-
-    # initialize all organization codes to 0 before categorizing
-    df_orgs['ORG CODE'] = 0
-    
-    # variable to keep track of each row
-    row_counter = 0 
-    # iterate through each organization name in the dataframe
-    for org_name in df_orgs['NAME']:
-        # identify orgs that need to be immediately dropped and mark it as 0 
-        if any(word in org_name for word in drop_names):
-            df_orgs.loc[row_counter,'ORG CODE'] = 0
-        # identifying and categorizing PTAs 
-        if any(word in org_name for word in pta_names):
-            df_orgs.loc[row_counter,'ORG CODE'] = 1
-        # identifying and categorizing PTOs 
-        elif any(word in org_name for word in pto_names):
-            df_orgs.loc[row_counter,'ORG CODE'] = 2
-        elif any(contain_terms(org_name,words) for words in pto_terms):
-            df_orgs.loc[row_counter,'ORG CODE'] = 2
-        # identifying and categorizing boosters 
-        elif any(word in org_name for word in booster_names):
-            df_orgs.loc[row_counter,'ORG CODE'] = 3
-        elif any(contain_terms(org_name,words) for words in booster_terms):
-            df_orgs.loc[row_counter,'ORG CODE'] = 3
-        # identifying and categorizing other school-linked non-profits
-        elif any(word in org_name for word in other_names):
-            df_orgs.loc[row_counter,'ORG CODE'] = 4
-        elif any(contain_terms(org_name,words) for words in other_terms):
-            df_orgs.loc[row_counter,'ORG CODE'] = 4
-        # if the org doesn't fall into any category, we mark it as 0
-        else:
-            #dataFrame = dataFrame.drop(row_counter)
-            df_orgs.loc[row_counter,'ORG CODE'] = 0
-
-        row_counter += 1 # continue iterating through each row
-
-    # remove the organization entries that are marked NA
-    df_orgs = df_orgs[df_orgs['ORG CODE'] != 0]
+        # remove the organization entries that are marked NA
+        df_orgs = df_orgs[df_orgs['ORG CODE'] != 0]
+        stage['rows_out'] = len(df_orgs)
     # all column strings in organization files are upper case for a cohesive format
     df_orgs = df_orgs.rename(columns=lambda x: x.upper())
 
@@ -194,9 +329,15 @@ def format_orgs(df_allorgs):
 
     # create a boolean variable to indicate whether or not an address is incomplete with just po box information
     df_allorgs['PO BOX'] = df_allorgs['ADDRESS_final'].str.startswith("PO BOX") 
+
+    # create a single county variable when the files carry a FIPS county code, it is used for county blocking
+    county_cols = []
+    if 'FIPS_x' in df_allorgs.columns and 'FIPS_y' in df_allorgs.columns:
+        df_allorgs['FIPS_final'] = df_allorgs['FIPS_x'].fillna(df_allorgs['FIPS_y'])
+        county_cols = ['FIPS_final']
     
     # only keep the columns required in the merged dataframe and remove all other columns 
-    df_allorgs = df_allorgs[['EIN', 'SEC_NAME_x', 'NAME_x', 'ADDRESS_x', 'NTEEFINAL_x','ZIP5_x','ORG CODE_x', 'NAME_y', 'ADDRESS_y', 'ZIP5_y', 'NAME_final', 'ADDRESS_final', 'PO BOX', 'ZIP_final', 'ORG CODE_y','TOTREV', 'TOTREV2', '_merge']]
+    df_allorgs = df_allorgs[['EIN', 'SEC_NAME_x', 'NAME_x', 'ADDRESS_x', 'NTEEFINAL_x','ZIP5_x','ORG CODE_x', 'NAME_y', 'ADDRESS_y', 'ZIP5_y', 'NAME_final', 'ADDRESS_final', 'PO BOX', 'ZIP_final', 'ORG CODE_y','TOTREV', 'TOTREV2', '_merge'] + county_cols]
 
     # make organization name and street lowercase for better comparison
     df_allorgs['NAME_final'] = df_allorgs['NAME_final'].str.lower()
@@ -236,10 +377,459 @@ def format_schools(path):
     df_schools['school_name'] = df_schools['school_name'].str.lower()
     df_schools['street_location'] = df_schools['street_location'].str.lower()
     df_schools['school_level'] = df_schools['school_level'].str.lower()
-    return df_schools 
+    return df_schools
 
 
-def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo):
+# candidate generation strategies that can be used for either round of the matching process
+# full: every org against every school, zip5: exact ZIP, zip3: first three ZIP digits,
+# county: same county FIPS code, name_token: org and school names share a rare word,
+# ngram: the schools with the most similar character n-grams in their name, see NameIndex
+BLOCKING_STRATEGIES = ['full', 'zip5', 'zip3', 'county', 'name_token', 'ngram']
+
+# words that are too common in org and school names to be used as a name block
+BLOCKING_STOPWORDS = ["the", "and", "of", "for", "inc", "school", "schools", "elem", "elementary", "middle", "high",
+    "academy", "pta", "pto", "ptsa", "ptso", "parent", "parents", "teacher", "teachers", "association", "assoc", "assn",
+    "organization", "booster", "boosters", "club", "foundation", "friends", "band", "athletic", "music", "arts", "county"]
+
+
+def zip_key(zips, digits=5):
+    """
+    Normalizes ZIP codes to a string prefix that can be used as a blocking key.
+
+    ZIP codes can be read in as integers, floats (when the column has missing values) or ZIP+4 strings,
+    so they are converted to a zero-padded 5 digit string before taking the prefix.
+
+    Args:
+        zips (pandas.Series): The ZIP codes to normalize.
+        digits (int): The number of leading ZIP digits to keep.
+
+    Returns:
+        pandas.Series: The ZIP prefixes, with missing values for missing or malformed ZIP codes.
+
+    """
+    zips = zips.astype(str).str.strip().str.replace(r'\.0$', '', regex=True).str[:5].str.zfill(5)
+    return zips.where(zips.str.isdigit()).str[:digits]
+
+
+def name_tokens(names):
+    """
+    Splits names into the set of words that can be used as name blocks.
+
+    Args:
+        names (pandas.Series): The lowercase org or school names.
+
+    Returns:
+        pandas.Series: A list of distinct words for each name, without stopwords and very short words.
+
+    """
+    words = names.fillna('').str.lower().str.findall(r'[a-z0-9]+')
+    return words.apply(lambda x: sorted({word for word in x if len(word) > 2 and word not in BLOCKING_STOPWORDS}))
+
+
+def _pairs_on_keys(keys_orgs, keys_schools):
+    """
+    Builds the (org, school) index pairs of every org and school that share a blocking key.
+
+    Args:
+        keys_orgs (pandas.Series): The blocking keys of each org, indexed like the org dataframe.
+        keys_schools (pandas.Series): The blocking keys of each school, indexed like the school dataframe.
+
+    Returns:
+        pandas.MultiIndex: The candidate pairs, with the org index first and the school index second.
+
+    """
+    left = pd.DataFrame({'key': keys_orgs.values, 'level_0': keys_orgs.index}).dropna()
+    right = pd.DataFrame({'key': keys_schools.values, 'level_1': keys_schools.index}).dropna()
+    pairs = left.merge(right, on='key')[['level_0', 'level_1']].drop_duplicates()
+    return pd.MultiIndex.from_arrays([pairs['level_0'].values, pairs['level_1'].values])
+
+
+def block_pairs(df_orgs, df_schools, strategy='full', max_token_share=0.02, name_index=None, top_k=10):
+    """
+    Generates the candidate (org, school) pairs to score for a blocking strategy.
+
+    The zip5 strategy compares ZIP codes the same way as the exact Zip_Score comparison, so it keeps every
+    pair that can pass the Zip_Score == 1 filter of round 1. The name_token strategy only keeps pairs whose
+    names share at least one rare word, where a word is rare if it appears in at most max_token_share of
+    the school names. The ngram strategy keeps the top_k schools whose names have the most similar
+    character n-gram profile to each org name.
+
+    Args:
+        df_orgs (pandas.DataFrame): The organization data DataFrame.
+        df_schools (pandas.DataFrame): The school data DataFrame.
+        strategy (str): One of the strategies in BLOCKING_STRATEGIES.
+        max_token_share (float): The largest share of schools a word can appear in to be used as a name block.
+        name_index (NameIndex): The n-gram index of the school names for the ngram strategy, built if not given.
+        top_k (int): The number of schools to keep for each org with the ngram strategy.
+
+    Returns:
+        pandas.MultiIndex: The candidate pairs, with the org index first and the school index second.
+
+    Raises:
+        ValueError: If the strategy is unknown or the data does not have the columns the strategy needs.
+
+    """
+    indexer = recordlinkage.Index()
+
+    if strategy == 'full':
+        indexer.full()
+    elif strategy == 'zip5':
+        indexer.block(left_on='ZIP_final', right_on='zip_location')
+    elif strategy == 'zip3':
+        return _pairs_on_keys(zip_key(df_orgs['ZIP_final'], 3), zip_key(df_schools['zip_location'], 3))
+    elif strategy == 'county':
+        if 'FIPS_final' not in df_orgs.columns or 'county_code' not in df_schools.columns:
+            raise ValueError("county blocking needs a FIPS_final column for orgs and a county_code column for schools")
+        return _pairs_on_keys(pd.to_numeric(df_orgs['FIPS_final'], errors='coerce'),
+                              pd.to_numeric(df_schools['county_code'], errors='coerce'))
+    elif strategy == 'name_token':
+        school_tokens = name_tokens(df_schools['school_name']).explode()
+        # drop the words that are shared by too many schools to narrow down the candidates
+        token_share = school_tokens.value_counts() / max(len(df_schools), 1)
+        rare_tokens = token_share[token_share <= max_token_share].index
+        school_tokens = school_tokens[school_tokens.isin(rare_tokens)]
+        return _pairs_on_keys(name_tokens(df_orgs['NAME_final']).explode(), school_tokens)
+    elif strategy == 'ngram':
+        if name_index is None:
+            name_index = NameIndex(df_schools['school_name'])
+        return name_index.pairs(df_orgs['NAME_final'], top_k)
+    else:
+        raise ValueError(f"unknown blocking strategy '{strategy}', expected one of {BLOCKING_STRATEGIES}")
+
+    return indexer.index(df_orgs, df_schools)
+
+
+def filter_bad_matches(final_matches, cutoff=0.7):
+    """
+    Removes the weak matches from the combined matches of both rounds.
+
+    A round 1 match is bad if both its name and address score are below the cutoff and a
+    round 2 match is bad if its name score is below the cutoff.
+
+    Args:
+        final_matches (pandas.DataFrame): The merged matches from round 1 and round 2.
+        cutoff (float): The smallest similarity score of a good match.
+
+    Returns:
+        pandas.DataFrame: The matches that are not bad matches.
+
+    """
+    # keep the rows that do not satisfy the given conditions
+    # bad match if both name and address score are less than the cutoff
+    final_matches = final_matches[
+        ~(
+            (final_matches['Match_Parameter'] == "name,address") &
+            (final_matches['Name_Score'] < cutoff) &
+            (final_matches['Address_Score'] < cutoff)
+        )
+    ]
+    # bad match is name score is less than the cutoff
+    final_matches = final_matches[
+        ~(
+            (final_matches['Match_Parameter'] == "name") &
+            (final_matches['Name_Score'] < cutoff)
+        )
+    ]
+    return final_matches
+
+
+def blocking_report(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo, strategies=BLOCKING_STRATEGIES, cutoff=0.7):
+    """
+    Compares how many pairs each blocking strategy generates and how many good matches it keeps.
+
+    The reference matches come from running the matching process on the full index and removing
+    bad matches. The recall of a strategy is the share of reference matches of a round whose
+    (org, school) pair is among the candidate pairs the strategy generates for that round.
+
+    Args:
+        df_allorgs (pandas.DataFrame): The organization data DataFrame without PO box addresses.
+        df_schools (pandas.DataFrame): The school data DataFrame.
+        df_allorgs_copy (pandas.DataFrame): A copy of the organization data DataFrame.
+        df_allorgs_withpo (pandas.DataFrame): The organizations with PO box addresses.
+        strategies (list): The blocking strategies to compare.
+        cutoff (float): The smallest similarity score of a good match.
+
+    Returns:
+        pandas.DataFrame: One row per round and strategy with the number of candidate pairs,
+            the share of the full index they make up and the recall of reference matches.
+
+    """
+    matches_round1, matches_round2 = matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo,
+                                                      round1_blocking='full', round2_blocking='full')
+    # round 2 orgs are indexed by their position in the unmatched orgs, not the original orgs
+    df_round2_orgs = round2_orgs(df_allorgs, df_allorgs_withpo, matches_round1['level_0'].values)
+
+    report = []
+    for round_number, df_orgs, matches in [(1, df_allorgs, matches_round1), (2, df_round2_orgs, matches_round2)]:
+        reference = filter_bad_matches(matches, cutoff)
+        reference_pairs = pd.MultiIndex.from_arrays([reference['level_0'].values, reference['level_1'].values])
+        full_pairs = len(df_orgs) * len(df_schools)
+        for strategy in strategies:
+            try:
+                pairs = block_pairs(df_orgs, df_schools, strategy)
+            except ValueError:
+                # skip the strategies the data does not have the columns for
+                continue
+            report.append({
+                'Round': round_number,
+                'Strategy': strategy,
+                'Pairs': len(pairs),
+                'Pair_Share': len(pairs) / full_pairs if full_pairs else 0.0,
+                'Reference_Matches': len(reference_pairs),
+                'Recall': reference_pairs.isin(pairs).mean() if len(reference_pairs) else 1.0,
+            })
+
+    return pd.DataFrame(report)
+
+
+def round2_orgs(df_allorgs, df_allorgs_withpo, matched_index):
+    """
+    Collects the organizations left to be matched in round 2.
+
+    Args:
+        df_allorgs (pandas.DataFrame): The organization data DataFrame without PO box addresses.
+        df_allorgs_withpo (pandas.DataFrame): The organizations with PO box addresses.
+        matched_index (array-like): The indices of the orgs that were matched in round 1.
+
+    Returns:
+        pandas.DataFrame: The orgs that were not matched in round 1 followed by the PO box orgs.
+
+    """
+    # this dataframe will now include the ones that were removed because of po box condition
+    # and ones that weren't matched
+    df_nonmatch = df_allorgs.drop(matched_index)
+    return pd.concat([df_nonmatch, df_allorgs_withpo], axis=0, ignore_index=True)
+
+
+# words that describe the kind of organization or school rather than which school it is,
+# they are removed from names to get the name stem used by the exact matching stage
+GENERIC_NAME_WORDS = ["the", "of", "and", "for", "at", "inc", "incorporated", "pta", "pto", "ptsa", "ptso", "parent", "parents",
+    "teacher", "teachers", "student", "students", "association", "assoc", "assn", "organization", "org", "booster", "boosters",
+    "club", "foundation", "friends", "support", "school", "schools", "band", "music", "athletic", "athletics", "arts", "fine",
+    "performing", "sports", "cheer", "choir"]
+
+# school level words and the level they stand for, the level is kept as part of the name stem
+LEVEL_WORDS = {"elem": "elementary", "elementary": "elementary", "es": "elementary", "primary": "elementary",
+    "middle": "middle", "ms": "middle", "high": "high", "hs": "high"}
+
+# common street suffixes and the abbreviation they are replaced with
+STREET_ABBREVIATIONS = {"street": "st", "road": "rd", "avenue": "ave", "drive": "dr", "lane": "ln", "boulevard": "blvd",
+    "highway": "hwy", "court": "ct", "place": "pl", "parkway": "pkwy", "circle": "cir", "north": "n", "south": "s",
+    "east": "e", "west": "w"}
+
+
+def name_stem(names):
+    """
+    Canonicalizes names to the words that identify a school, such as "altamahaw ossipee" for both
+    "altamahaw ossipee school pta" and "altamahaw ossipee elem".
+
+    Args:
+        names (pandas.Series): The lowercase org or school names.
+
+    Returns:
+        tuple: The name stems without generic or level words, and the school level named in each
+            name ("elementary", "middle", "high" or an empty string).
+
+    """
+    words = names.fillna('').str.lower().str.findall(r'[a-z0-9]+')
+    stems = words.apply(lambda x: ' '.join(word for word in x if word not in GENERIC_NAME_WORDS and word not in LEVEL_WORDS))
+    levels = words.apply(lambda x: next((LEVEL_WORDS[word] for word in x if word in LEVEL_WORDS), ''))
+    return stems, levels
+
+
+def street_key(streets, zips):
+    """
+    Canonicalizes street addresses and joins them with the 5 digit ZIP code.
+
+    Args:
+        streets (pandas.Series): The lowercase street addresses.
+        zips (pandas.Series): The ZIP codes.
+
+    Returns:
+        pandas.Series: The canonical address keys, with missing values where the street or ZIP is missing.
+
+    """
+    words = streets.fillna('').str.lower().str.findall(r'[a-z0-9]+')
+    streets = words.apply(lambda x: ' '.join(STREET_ABBREVIATIONS.get(word, word) for word in x))
+    keys = streets + ' ' + zip_key(zips)
+    return keys.where((streets != '') & zip_key(zips).notna())
+
+
+def _unique_lookup(keys):
+    """
+    Builds a hash index from keys to the index of the only school with that key. Keys shared by
+    several schools are left out since they cannot be resolved with a single lookup.
+
+    Args:
+        keys (pandas.Series): The key of each school, indexed like the school dataframe.
+
+    Returns:
+        pandas.Series: The school index of each unique key, indexed by the key so its hash table is
+            only built once when the same lookup is mapped again.
+
+    """
+    keys = keys[keys.notna() & (keys != '')]
+    keys = keys[~keys.duplicated(keep=False)]
+    return pd.Series(keys.index, index=keys.values)
+
+
+def school_lookups(df_schools):
+    """
+    Builds the hash indexes of the schools used by exact_matches.
+
+    Args:
+        df_schools (pandas.DataFrame): The school data DataFrame.
+
+    Returns:
+        tuple: The school index of each unique canonical address, name stem with level and name stem.
+            The name stems are keyed together with the 3 digit ZIP code of the school.
+
+    """
+    school_stems, school_levels = name_stem(df_schools['school_name'])
+    school_stems = school_stems.where(school_stems != '') + '|' + zip_key(df_schools['zip_location'], 3)
+    address_index = _unique_lookup(street_key(df_schools['street_location'], df_schools['zip_location']))
+    level_index = _unique_lookup(school_stems + '|' + school_levels)
+    stem_index = _unique_lookup(school_stems)
+    return address_index, level_index, stem_index
+
+
+def exact_matches(df_allorgs, df_schools, df_allorgs_withpo, score_cache=None, lookups=None):
+    """
+    Matches the organizations that share a canonical street address and ZIP or a canonical name stem
+    with exactly one school, before the fuzzy matching rounds.
+
+    Orgs are first looked up by their address and ZIP, and the rest by their name stem together with
+    the school level in their name, or by the name stem alone if their name has no level. A name stem
+    only matches a school in the same 3 digit ZIP code, so an org is not matched to the only school
+    with its name in another part of the state before round 1 can find its local school. PO box orgs
+    are only looked up by name. Each lookup is a single hash index lookup, so only the orgs that are
+    not resolved here need to go through matching_process.
+
+    Args:
+        df_allorgs (pandas.DataFrame): The organization data DataFrame without PO box addresses.
+        df_schools (pandas.DataFrame): The school data DataFrame.
+        df_allorgs_withpo (pandas.DataFrame): The organizations with PO box addresses.
+        score_cache (ScoreCache): The cache of name and address scores used to score the exact matches.
+        lookups (tuple): The hash indexes of the schools built by school_lookups, None to build them.
+
+    Returns:
+        tuple: The exact matches in the same format as the matches of matching_process, with a
+            Match_Parameter of 'exact address' or 'exact name', followed by the orgs without and with
+            a PO box address that are left to be matched.
+
+    """
+    if score_cache is None:
+        score_cache = ScoreCache()
+
+    # hash indexes of the schools, keyed on the canonical address and on the name stem with and without level
+    if lookups is None:
+        lookups = school_lookups(df_schools)
+    address_index, level_index, stem_index = lookups
+
+    df_orgs = pd.concat([df_allorgs, df_allorgs_withpo], axis=0)
+    org_stems, org_levels = name_stem(df_orgs['NAME_final'])
+    org_stems = org_stems.where(org_stems != '') + '|' + zip_key(df_orgs['ZIP_final'], 3)
+    org_addresses = street_key(df_orgs['ADDRESS_final'], df_orgs['ZIP_final']).where(~df_orgs.index.isin(df_allorgs_withpo.index))
+
+    # look up the address first and fall back to the name stem
+    by_address = org_addresses.map(address_index)
+    by_name = (org_stems + '|' + org_levels).map(level_index).where(org_levels != '', org_stems.map(stem_index))
+    matches = pd.DataFrame({'level_0': df_orgs.index, 'level_1': by_address.fillna(by_name).values,
+                            'Match_Parameter': np.where(by_address.notna(), 'exact address', 'exact name')})
+    matches = matches[matches['level_1'].notna()].reset_index(drop=True)
+    matches['level_1'] = matches['level_1'].astype(df_schools.index.dtype)
+
+    orgs, schools = df_orgs.loc[matches['level_0']], df_schools.loc[matches['level_1']]
+    matches['Name_Score'] = score_cache.name_score(orgs['NAME_final'], schools['school_name']).values
+    matches['Address_Score'] = score_cache.address_score(orgs['ADDRESS_final'], schools['street_location']).values
+    matches['Zip_Score'] = (orgs['ZIP_final'].values == schools['zip_location'].values).astype(float)
+    matches['Total_Score'] = matches.loc[:, 'Name_Score':'Zip_Score'].sum(axis=1)
+
+    matches['EIN'] = orgs['EIN'].values
+    matches['Organization_Name'] = orgs['NAME_final'].values
+    matches['Org_code'] = orgs['ORG CODE_x'].values
+    matches['School_Name'] = schools['school_name'].values
+    matches['schID'] = schools['school_id'].values
+    matches['leaID'] = schools['leaid'].values
+    matches['Organization_Street'] = orgs['ADDRESS_final'].values
+    matches['School_Street'] = schools['street_location'].values
+    matches['School_level'] = schools['school_level'].values
+    matches['Revenue'] = orgs['TOTREV'].values
+    # keep the match parameter as the last column like the matches of matching_process
+    matches = matches[[col for col in matches.columns if col != 'Match_Parameter'] + ['Match_Parameter']]
+
+    matched = matches['level_0'].values
+    return matches, df_allorgs.drop(matched, errors='ignore'), df_allorgs_withpo.drop(matched, errors='ignore')
+
+
+def best_matches(df_orgs, df_schools, compare, strategy, keep=None, chunk_size=None, name_index=None, top_k=10, manifest=None):
+    """
+    Scores the candidate pairs of a matching round and keeps the best school of each organization.
+
+    When a chunk size is given, the orgs are scored in batches of that size. Every pair of an org is
+    in the same batch, so only the best school of each org in a batch is kept and the full table of
+    scored pairs is never held in memory at once.
+
+    Args:
+        df_orgs (pandas.DataFrame): The organizations to match.
+        df_schools (pandas.DataFrame): The school data DataFrame.
+        compare (recordlinkage.Compare): The comparisons to compute for each pair.
+        strategy (str): The blocking strategy used to generate the pairs, see block_pairs.
+        keep (callable): Takes the scored pairs and returns a boolean mask of the pairs that can be a match.
+        chunk_size (int): The number of orgs to score at a time, None to score all orgs at once.
+        name_index (NameIndex): The n-gram index of the school names for the ngram strategy.
+        top_k (int): The number of schools to score for each org with the ngram strategy.
+        manifest (RunManifest): Counts the candidate pairs and the pairs that can be a match in the open stage.
+
+    Returns:
+        pandas.DataFrame: The best pair of each matched org with its org index in level_0, its school
+            index in level_1, the computed scores and a Total_Score.
+
+    """
+    if manifest is None:
+        manifest = RunManifest()
+
+    # the n-gram index only depends on the schools, so it is built once for all batches
+    if strategy == 'ngram' and name_index is None:
+        name_index = NameIndex(df_schools['school_name'])
+
+    chunk_size = chunk_size or max(len(df_orgs), 1)
+    best = []
+    for start in range(0, len(df_orgs), chunk_size):
+        df_batch = df_orgs.iloc[start:start + chunk_size]
+        pairs = block_pairs(df_batch, df_schools, strategy, name_index=name_index, top_k=top_k)
+        manifest.count('candidate_pairs', len(pairs))
+        if len(pairs) == 0:
+            continue
+
+        # compute the specified features for each pair 
+        features = compare.compute(pairs, df_batch, df_schools)
+        # select the potential matches where the sum of the comparison scores across all features is greater than zero. 
+        potential_matches = features[features.sum(axis=1) > 0].reset_index()
+
+        # set address and zip score to 0 when they are not considered in this round
+        for col in ['Address_Score', 'Zip_Score']:
+            if col not in potential_matches.columns:
+                potential_matches[col] = 0.0
+        # create a total score variable which is the sum of all computed similarity scores
+        potential_matches['Total_Score'] = potential_matches.loc[:, 'Name_Score':'Zip_Score'].sum(axis=1)
+
+        if keep is not None:
+            potential_matches = potential_matches[keep(potential_matches)]
+        manifest.count('kept_pairs', len(potential_matches))
+
+        # for each organization, only keep its match that has the highest score 
+        max_score = potential_matches.groupby('level_0')['Total_Score'].idxmax()
+        best.append(potential_matches.loc[max_score])
+
+    if not best:
+        # typed like the scored pairs so the round can still be merged with the other round
+        empty = {'level_0': df_orgs.index[:0], 'level_1': df_schools.index[:0]}
+        return pd.DataFrame({**empty, **{col: np.array([], dtype=float) for col in ['Name_Score', 'Address_Score', 'Zip_Score', 'Total_Score']}})
+    return pd.concat(best, ignore_index=True)
+
+
+def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo, round1_blocking='zip5', round2_blocking='ngram', name_index=None, top_k=10, chunk_size=None, score_cache=None, name_cutoff=None, manifest=None):
     """
     Performs the matching process between organization and school data.
 
@@ -252,6 +842,16 @@ def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo)
         df_allorgs (pandas.DataFrame): The organization data DataFrame.
         df_schools (pandas.DataFrame): The school data DataFrame.
         df_allorgs_copy (pandas.DataFrame): A copy of the organization data DataFrame.
+        df_allorgs_withpo (pandas.DataFrame): The organizations with PO box addresses.
+        round1_blocking (str): The blocking strategy used to generate the round 1 pairs, see block_pairs.
+        round2_blocking (str): The blocking strategy used to generate the round 2 pairs, see block_pairs.
+        name_index (NameIndex): The n-gram index of the school names, built once and reused across calls.
+        top_k (int): The number of schools to score for each org with the ngram strategy.
+        chunk_size (int): The number of orgs to score at a time in each round, None to score all orgs at once.
+        score_cache (ScoreCache): The cache of name and address scores, a new one is shared by both rounds if not given.
+        name_cutoff (float): The cutoff STEP 8 applies to name only matches. Round 2 pairs that cannot reach it
+            are given a name score of 0 without being scored, None to score every pair.
+        manifest (RunManifest): Records the time, orgs, candidate pairs and matches of each round.
 
     Returns:
         tuple: A tuple containing the potential matches from round 1 and round 2 as DataFrames.
@@ -260,40 +860,30 @@ def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo)
 
     """
     
-    # create an indexer object
-    indexer = recordlinkage.Index() 
-
-    # use full indexer to evaluate all potential pairs 
-    indexer.full()
-
-    # for round 1, build up all potential pairings to check
-    matches_round1 = indexer.index(df_allorgs, df_schools) 
+    # name and address scores are cached so each distinct pair of strings is only scored once across both rounds
+    if score_cache is None:
+        score_cache = ScoreCache()
+    if manifest is None:
+        manifest = RunManifest()
 
     # now we define how we want to perform their comparison logic 
     compare1 = recordlinkage.Compare() # create a compare object 
 
     # ROUND 1 OF MATCHING BASED ON EXACT ZIP, NAME AND ADDRESS
-    # compare organization name and school name 
-    compare1.string('NAME_final', 'school_name', method='jarowinkler', label='Name_Score') 
-    # compare organization address and school addres
-    compare1.string('ADDRESS_final', 'street_location', method='jarowinkler', label='Address_Score')
+    # compare organization name and school name with jaro-winkler
+    compare1.compare_vectorized(score_cache.name_score, 'NAME_final', 'school_name', label='Name_Score') 
+    # compare organization address and school addres with jaro-winkler
+    compare1.compare_vectorized(score_cache.address_score, 'ADDRESS_final', 'street_location', label='Address_Score')
     # compare ZIP codes where 0 indicates differet ZIP and 1 indicates exact ZIP
     compare1.exact('ZIP_final', 'zip_location', label='Zip_Score')
 
-    # compute the specified features for each pair 
-    features1 = compare1.compute(matches_round1, df_allorgs, df_schools)
-    # select the potential matches where the sum of the comparison scores across all features is greater than zero. 
-    potential_matches1 = features1[features1.sum(axis=1) > 0].reset_index()
-
-    # create a total score variable which is the sum of all computed similarity scores
-    potential_matches1['Total_Score'] = potential_matches1.loc[:, 'Name_Score':'Zip_Score'].sum(axis=1)
-    
+    # for round 1, build up all potential pairings to check and keep the best one of each org
+    # only pairs with an exact zip can be kept, so by default only orgs and schools that share a zip are paired
     # keep stronger matches with an exact zip 
-    potential_matches1 = potential_matches1[potential_matches1['Zip_Score'] == 1]
-
-    # for each organization, only keep its match that has the highest score 
-    max_score = potential_matches1.groupby('level_0')['Total_Score'].idxmax()
-    potential_matches1 = potential_matches1.loc[max_score]
+    with manifest.stage('round1', rows_in=len(df_allorgs), blocking=round1_blocking) as stage:
+        potential_matches1 = best_matches(df_allorgs, df_schools, compare1, round1_blocking,
+                                          keep=lambda pairs: pairs['Zip_Score'] == 1, chunk_size=chunk_size, manifest=manifest)
+        stage['rows_out'] = len(potential_matches1)
 
     potential_matches1['EIN'] = df_allorgs.loc[potential_matches1['level_0'], 'EIN'].values
     # create a column to assign the organization names based on the matched indices in the 'level_0' column
@@ -316,10 +906,7 @@ def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo)
     matched_index = potential_matches1['level_0'].values 
     
     # create new dataframe and remove the ones that already matched 
-    # this dataframe will now include the ones that were removed because of po box condition 
-    # and ones that weren't matched 
-    df_nonmatch = df_allorgs.drop(matched_index) 
-    df_nonmatch_pobox = pd.concat([df_nonmatch, df_allorgs_withpo], axis=0, ignore_index=True)
+    df_nonmatch_pobox = round2_orgs(df_allorgs, df_allorgs_withpo, matched_index)
     #potential_matches1.to_csv("/Users/malavikakalani/Desktop/2021_round1.csv")
     #df_nonmatch_pobox.to_csv("/Users/malavikakalani/Desktop/check2021.csv")
     
@@ -327,18 +914,19 @@ def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo)
     # same process as round 1
 
     # use the new organization dataframe that includes organizations left to be matched
-    matches_round2 = indexer.index(df_nonmatch_pobox, df_schools)
+    # by default each org is only paired with the schools whose names have the most similar n-grams
+    # the names of orgs that were not matched in round 1 were already scored against the schools they were paired with,
+    # so only new pairs such as the ones of PO box orgs are scored again
+    # round 2 matches below the cutoff are dropped in STEP 8 whichever school they are with, so pairs that
+    # cannot reach it are skipped instead of scored
     compare2 = recordlinkage.Compare()
-    compare2.string('NAME_final', 'school_name',method='jarowinkler', label='Name_Score')
-    features2 = compare2.compute(matches_round2, df_nonmatch_pobox, df_schools)
-    potential_matches2 = features2[features2.sum(axis=1) > 0].reset_index()
-    # set address and zip score to 0 since we are not considering that in this round 
-    potential_matches2['Address_Score'] = 0.0
-    potential_matches2['Zip_Score'] = 0.0
-    potential_matches2['Total_Score'] = potential_matches2.loc[:, 'Name_Score':'Zip_Score'].sum(axis=1)
-    # for each organization, only keep its match that has the highest score 
-    max_name_score = potential_matches2.groupby('level_0')['Total_Score'].idxmax()
-    potential_matches2 = potential_matches2.loc[max_name_score]
+    compare2.compare_vectorized(lambda s1, s2: score_cache.jarowinkler(s1, s2, field='name', threshold=name_cutoff),
+                                'NAME_final', 'school_name', label='Name_Score')
+    # address and zip score are set to 0 since we are not considering that in this round 
+    with manifest.stage('round2', rows_in=len(df_nonmatch_pobox), blocking=round2_blocking) as stage:
+        potential_matches2 = best_matches(df_nonmatch_pobox, df_schools, compare2, round2_blocking,
+                                          chunk_size=chunk_size, name_index=name_index, top_k=top_k, manifest=manifest)
+        stage['rows_out'] = len(potential_matches2)
     potential_matches2['EIN'] = df_nonmatch_pobox.loc[potential_matches2['level_0'], 'EIN'].values
     potential_matches2['Organization_Name'] = df_nonmatch_pobox.loc[potential_matches2['level_0'], 'NAME_final'].values
     potential_matches2['Org_code'] = df_nonmatch_pobox.loc[potential_matches2['level_0'], 'ORG CODE_x'].values
@@ -358,74 +946,320 @@ def matching_process(df_allorgs, df_schools, df_allorgs_copy, df_allorgs_withpo)
     return potential_matches1, potential_matches2
 
 
-#STEP 1: filter BMF data file using the function created 
-# TODO: give the correct BMF file path according to file location on your computer 
-df_bmf = filter_data("/Users/malavikakalani/Desktop/CRF 2023/BMF data files/2019")
+# everything other than the input files that the filtered and formatted organizations depend on
+CLASSIFIER_PARAMS = {'rules': ORG_CODE_RULES, 'drop': DROP_NAMES, 'drop_overrides': False, 'columns': ORG_COLUMNS}
+
+
+def prepare_orgs(bmf_path, core_path, cache=None, state='NC', manifest=None):
+    """
+    Filters the BMF and Core files of a year and formats the combined organizations (STEP 1 to STEP 4).
+
+    When a cache is given, the outputs of filter_data and format_orgs are read from it if the input
+    files and classifier rule lists are unchanged, and the raw files are only parsed on a miss.
+
+    Args:
+        bmf_path (str): The directory containing the BMF files of the year.
+        core_path (str): The directory containing the Core files of the year.
+        cache (FrameCache): The cache to read and write the outputs, None to always run the steps.
+        state (str): The state the organizations need to be in.
+        manifest (RunManifest): Records the time and rows of each step, steps read from the cache have no inner stages.
+
+    Returns:
+        tuple: The three dataframes returned by format_orgs.
 
-# STEP 1A: if an organization in the BMF data has a secondary name, then use that value instead of primary name 
-df_bmf['NAME'] = df_bmf['SEC_NAME'].fillna(df_bmf['NAME'])
+    """
+    params = {**CLASSIFIER_PARAMS, 'state': state}
+    if manifest is None:
+        manifest = RunManifest()
 
-# STEP 2: filter core data file using the function created 
-# TODO: give the correct core file path according to file location on your computer
-df_core = filter_data("/Users/malavikakalani/Desktop/CRF 2023/Core files/2019")
+    def filter_step(path):
+        with manifest.stage('filter_data', path=path) as stage:
+            if cache is None:
+                df_orgs = filter_data(path, state=state, manifest=manifest)
+            else:
+                df_orgs = cache.cached('filter_data', [path], params, filter_data, path, state=state, manifest=manifest)
+            stage['rows_out'] = len(df_orgs)
+        return df_orgs
 
-# STEP 3: combine the dataframes of BMF and Core Files to get all organizations
-df_allorgs = pd.merge(df_bmf,df_core, on = 'EIN', how = 'outer', indicator = True) # use EIN as merging factor because some organizations are in both files
+    def build():
+        #STEP 1: filter BMF data file using the function created 
+        df_bmf = filter_step(bmf_path)
 
-#df_final_orgs = pd.read_csv("/Users/malavikakalani/Desktop/CRF 2023/allorgs2021.csv")
-#df_final_orgs_copy = pd.read_csv("/Users/malavikakalani/Desktop/CRF 2023/allorgs2021_copy.csv")
-#df_allorgs_withpo = pd.read_csv("/Users/malavikakalani/Desktop/po_2021.csv")
+        # STEP 1A: if an organization in the BMF data has a secondary name, then use that value instead of primary name 
+        df_bmf['NAME'] = df_bmf['SEC_NAME'].fillna(df_bmf['NAME'])
 
-# STEP 4: formatting all orgs file to only keep the columns we need and creating a copy for easier access 
-df_final_orgs, df_final_orgs_copy, df_allorgs_withpo = format_orgs(df_allorgs) # final file that we will be using for matching process 
+        # STEP 2: filter core data file using the function created 
+        df_core = filter_step(core_path)
 
-# STEP 5: formatting schools file and creating the school dataframe 
-# TODO: give the correct school file path according to file location on your computer 
-df_schools = format_schools("/Users/malavikakalani/Desktop/CRF 2023/schools_2021.csv")
+        # STEP 3: combine the dataframes of BMF and Core Files to get all organizations
+        df_allorgs = pd.merge(df_bmf,df_core, on = 'EIN', how = 'outer', indicator = True) # use EIN as merging factor because some organizations are in both files
 
-# STEP 6: perform the matching process and retrieve the matches from round 1 and round 2 
-matches_round1, matches_round2 = matching_process(df_final_orgs, df_schools, df_final_orgs_copy, df_allorgs_withpo)
+        # STEP 4: formatting all orgs file to only keep the columns we need and creating a copy for easier access 
+        with manifest.stage('format_orgs', rows_in=len(df_allorgs)) as stage:
+            formatted = format_orgs(df_allorgs)
+            stage['rows_out'] = len(formatted[0]) + len(formatted[2])
+        return formatted
 
-# STEP 7: merge the two rounds of matches 
-final_matches = pd.merge(matches_round1, matches_round2, how = "outer")
+    with manifest.stage('prepare_orgs') as stage:
+        formatted = build() if cache is None else cache.cached('format_orgs', [bmf_path, core_path], params, build)
+        stage['rows_out'] = len(formatted[0]) + len(formatted[2])
+    return formatted
 
-# STEP 8: additional conditions to filter out bad matches 
-# keep the rows that do not satisfy the given conditions
-# bad match if both name and address score are less than 0.7 
-final_matches = final_matches[
-    ~(
-        (final_matches['Match_Parameter'] == "name,address") &
-        (final_matches['Name_Score'] < 0.7) &
-        (final_matches['Address_Score'] < 0.7)
-    )
-]
-# bad match is name score is less than 0.7 
-final_matches = final_matches[
-    ~(
-        (final_matches['Match_Parameter'] == "name") &
-        (final_matches['Name_Score'] < 0.7)
-    )
-]
 
-# STEP 9: convert your match results to a CSV file for further use 
-# TODO: give the correct file path for where you want to save the matches on your computer
-final_matches.to_csv("/Users/malavikakalani/Desktop/finalmatches2021.csv")
+def prepare_schools(path, cache=None):
+    """
+    Formats the school data of a year (STEP 5), reading it from the cache if the school file is unchanged.
+
+    Args:
+        path (str): The file path to the CSV file containing the school data.
+        cache (FrameCache): The cache to read and write the output, None to always run the step.
 
+    Returns:
+        pandas.DataFrame: The formatted school data as a DataFrame.
 
+    """
+    if cache is None:
+        return format_schools(path)
+    return cache.cached('format_schools', [path], None, format_schools, path)
 
 
+def find_matches(df_final_orgs, df_final_orgs_copy, df_allorgs_withpo, df_schools, chunk_size=None, score_cache=None, name_cutoff=None, manifest=None,
+                 name_index=None, lookups=None, blocking_report_path=None):
+    """
+    Finds the matches of a year before the bad matches are filtered out, from STEP 6A to STEP 7.
 
-     
+    Args:
+        df_final_orgs (pandas.DataFrame): The formatted organizations without PO box addresses.
+        df_final_orgs_copy (pandas.DataFrame): A copy of the formatted organizations.
+        df_allorgs_withpo (pandas.DataFrame): The organizations with PO box addresses.
+        df_schools (pandas.DataFrame): The formatted schools.
+        chunk_size (int): The number of orgs to score at a time in each matching round, None to score all orgs at once.
+        score_cache (ScoreCache): The cache of name and address scores.
+        name_cutoff (float): Skip the round 2 name pairs that cannot reach this score, None to score every pair.
+            Matches below the cutoff are only dropped by filter_bad_matches.
+        manifest (RunManifest): Records the time and rows of each step.
+        name_index (NameIndex): The n-gram index of the school names, None to build it.
+        lookups (tuple): The hash indexes of the schools built by school_lookups, None to build them.
+        blocking_report_path (str): The CSV file to write the blocking_report of the orgs left after the exact
+            matches to, None to not write it. The report runs both rounds on the full index, which is slow.
 
+    Returns:
+        pandas.DataFrame: The exact matches and the matches of both rounds.
 
+    """
+    if score_cache is None:
+        score_cache = ScoreCache()
+    if manifest is None:
+        manifest = RunManifest()
+
+    # STEP 6A: resolve the orgs that share a canonical address or name stem with exactly one school
+    with manifest.stage('exact_matches', rows_in=len(df_final_orgs) + len(df_allorgs_withpo)) as stage:
+        exact, df_final_orgs, df_allorgs_withpo = exact_matches(df_final_orgs, df_schools, df_allorgs_withpo, score_cache, lookups)
+        stage['rows_out'] = len(exact)
+
+    # STEP 6: perform the matching process and retrieve the matches from round 1 and round 2 
+    # round 1 only pairs orgs and schools with the same zip and round 2 only pairs each org with the
+    # schools that have the most similar names according to the n-gram index
+    matches_round1, matches_round2 = matching_process(df_final_orgs, df_schools, df_final_orgs_copy, df_allorgs_withpo, round1_blocking = 'zip5', round2_blocking = 'ngram', name_index = name_index, top_k = 10, chunk_size = chunk_size, score_cache = score_cache, name_cutoff = name_cutoff, manifest = manifest)
+    if blocking_report_path is not None:
+        # compare the number of pairs and recall of each blocking strategy against the full index
+        blocking_report(df_final_orgs, df_schools, df_final_orgs_copy, df_allorgs_withpo).to_csv(blocking_report_path, index=False)
+
+    # STEP 7: merge the two rounds of matches 
+    final_matches = pd.merge(matches_round1, matches_round2, how = "outer")
+    return pd.concat([exact, final_matches], axis=0, ignore_index=True)
+
+
+def write_matches(final_matches, year, output_root, cutoff=0.7, manifest=None):
+    """
+    Filters out the bad matches of a year and writes the rest to finalmatches<year>.csv, STEP 8 and STEP 9.
 
+    Args:
+        final_matches (pandas.DataFrame): The matches found by find_matches.
+        year (int): The school year of the matches.
+        output_root (str): The directory to write the matches to.
+        cutoff (float): The smallest similarity score of a good match.
+        manifest (RunManifest): Records the matches of each Match_Parameter and how many the cutoff removed.
 
+    Returns:
+        str: The path of the written matches.
 
+    """
+    if manifest is None:
+        manifest = RunManifest()
+
+    # STEP 8: additional conditions to filter out bad matches 
+    # bad match if both name and address score are less than the cutoff or if name score is less than the cutoff for name only matches
+    matches_before = final_matches['Match_Parameter'].value_counts()
+    final_matches = filter_bad_matches(final_matches, cutoff = cutoff)
+    # record how many matches of each kind were found and how many STEP 8 removed
+    matches_after = final_matches['Match_Parameter'].value_counts()
+    manifest.record('matches', {parameter: int(count) for parameter, count in matches_after.items()})
+    manifest.record('dropped_by_cutoff', {parameter: int(matches_before[parameter] - matches_after.get(parameter, 0)) for parameter in matches_before.index})
+
+    # STEP 9: convert your match results to a CSV file for further use 
+    os.makedirs(output_root, exist_ok=True)
+    output_path = os.path.join(output_root, f"finalmatches{year}.csv")
+    # IDs and codes are written as integers and revenues as numbers
+    final_matches = apply_schema(final_matches, MATCH_SCHEMA)
+    final_matches.to_csv(output_path)
+    return output_path
+
+
+def run_year(year, bmf_root, core_root, schools_root, output_root, org_year=None, cutoff=0.7, cache_dir=None, cache_max_bytes=2 * 1024 ** 3, chunk_size=None,
+             score_cache_path=None, score_cache_max_entries=None, score_threads=None, state='NC', profile=0, blocking_report=False,
+             score_stats=False):
+    """
+    Runs the whole pipeline for one year, from filtering the BMF and Core files to writing the final matches.
 
+    The BMF and Core files of a year are read from the year's directory under bmf_root and core_root,
+    the school data from schools_<year>.csv under schools_root, and the matches are written to
+    finalmatches<year>.csv under output_root.
 
+    Args:
+        year (int): The school year to match.
+        bmf_root (str): The directory containing one directory of BMF files per year.
+        core_root (str): The directory containing one directory of Core files per year.
+        schools_root (str): The directory containing the school files.
+        output_root (str): The directory to write the matches to.
+        org_year (int): The year of BMF and Core files to match against the schools, defaults to year.
+        cutoff (float): The smallest similarity score of a good match.
+        cache_dir (str): The directory of the cache for the filtered and formatted data, None to not use a cache.
+        cache_max_bytes (int): The largest total size of the cache.
+        chunk_size (int): The number of orgs to score at a time in each matching round, None to score all orgs at once.
+        score_cache_path (str): The SQLite file of name and address scores shared by all years, None to not keep scores across runs.
+        score_cache_max_entries (int): The largest number of scores to keep in the score file.
+        score_threads (int): The number of threads to score new name and address pairs on, defaults to one.
+        state (str): The state the organizations need to be in.
+        profile (int): The profiling level of the run manifest written next to the matches, see run_manifest.py.
+            0 does not write a manifest.
+        blocking_report (bool): Also write the blocking_report of the year to blocking_report<year>.csv under output_root.
+        score_stats (bool): Also return the hits, misses and hit rate of the score cache, see ScoreCache.stats.
 
+    Returns:
+        str: The path of the written matches, or the path and the score cache stats if score_stats is set.
 
+    """
+    org_year = year if org_year is None else org_year
+    cache = None if cache_dir is None else FrameCache(cache_dir, cache_max_bytes)
+    score_cache = ScoreCache(score_cache_path, score_cache_max_entries, score_threads)
+    manifest = RunManifest(profile, year=year, org_year=org_year, state=state, cutoff=cutoff)
+
+    # STEP 1 to STEP 4: filter the BMF and Core files and format the combined organizations
+    df_final_orgs, df_final_orgs_copy, df_allorgs_withpo = prepare_orgs(os.path.join(bmf_root, str(org_year)), os.path.join(core_root, str(org_year)), cache, state, manifest) # final file that we will be using for matching process 
+
+    # STEP 5: formatting schools file and creating the school dataframe 
+    with manifest.stage('prepare_schools') as stage:
+        df_schools = prepare_schools(os.path.join(schools_root, f"schools_{year}.csv"), cache)
+        stage['rows_out'] = len(df_schools)
+
+    # STEP 6A to STEP 7: exact matches, the two fuzzy matching rounds and their merge
+    report_path = None
+    if blocking_report:
+        os.makedirs(output_root, exist_ok=True)
+        report_path = os.path.join(output_root, f"blocking_report{year}.csv")
+    final_matches = find_matches(df_final_orgs, df_final_orgs_copy, df_allorgs_withpo, df_schools, chunk_size = chunk_size,
+                                 score_cache = score_cache, name_cutoff = cutoff, manifest = manifest, blocking_report_path = report_path)
+    score_cache.close()
+    # how many name and address pairs were already scored in this or an earlier run
+    stats = score_cache.stats()
+    for row in stats.itertuples():
+        manifest.record(f"{row.Field}_score_cache", {'hits': row.Hits, 'misses': row.Misses})
+
+    # STEP 8 and STEP 9: filter out the bad matches and write the rest
+    output_path = write_matches(final_matches, year, output_root, cutoff, manifest)
+    manifest.write(os.path.join(output_root, f"manifest{year}.json"))
+
+    if score_stats:
+        return output_path, stats
+    return output_path
+
+
+def run_years(years, bmf_root, core_root, schools_root, output_root, org_years=None, workers=None, cutoff=0.7, cache_dir=None, cache_max_bytes=2 * 1024 ** 3, chunk_size=None,
+              score_cache_path=None, score_cache_max_entries=None, score_threads=None, profile=0, blocking_report=False, score_stats=False):
+    """
+    Runs the pipeline for several years at once, with each year running in its own process.
 
+    Args:
+        years (list): The school years to match.
+        bmf_root (str): The directory containing one directory of BMF files per year.
+        core_root (str): The directory containing one directory of Core files per year.
+        schools_root (str): The directory containing the school files.
+        output_root (str): The directory to write the matches to.
+        org_years (list): The year of BMF and Core files to use for each school year, defaults to years.
+        workers (int): The number of processes to use, defaults to the number of cores.
+        cutoff (float): The smallest similarity score of a good match.
+        cache_dir (str): The directory of the cache for the filtered and formatted data, None to not use a cache.
+        cache_max_bytes (int): The largest total size of the cache.
+        chunk_size (int): The number of orgs to score at a time in each matching round, None to score all orgs at once.
+        score_cache_path (str): The SQLite file of name and address scores shared by all years, None to not keep scores across runs.
+        score_cache_max_entries (int): The largest number of scores to keep in the score file.
+        score_threads (int): The number of threads to score new name and address pairs on, defaults to one.
+        profile (int): The profiling level of the run manifest written next to the matches of each year.
+        blocking_report (bool): Also write the blocking_report of each year next to its matches.
+        score_stats (bool): Also return the score cache stats of each year.
 
+    Returns:
+        dict: The path of the written matches for each year, followed by a dict of the score cache
+            stats of each year if score_stats is set.
 
+    Raises:
+        ValueError: If org_years is not the same length as years.
 
+    """
+    org_years = list(years) if org_years is None else list(org_years)
+    if len(org_years) != len(years):
+        raise ValueError("org_years needs one year of BMF and Core files for each school year")
+
+    # never start more processes than there are years to run
+    workers = min(workers or os.cpu_count() or 1, len(years)) or 1
+
+    outputs, stats = {}, {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_year, year, bmf_root, core_root, schools_root, output_root, org_year=org_year, cutoff=cutoff,
+                                   cache_dir=cache_dir, cache_max_bytes=cache_max_bytes, chunk_size=chunk_size,
+                                   score_cache_path=score_cache_path, score_cache_max_entries=score_cache_max_entries, score_threads=score_threads, profile=profile,
+                                   blocking_report=blocking_report, score_stats=True): year
+                   for year, org_year in zip(years, org_years)}
+        # the stats are sent back to this process, so the workers never write to stdout at the same time
+        for future in as_completed(futures):
+            outputs[futures[future]], stats[futures[future]] = future.result()
+
+    outputs = dict(sorted(outputs.items()))
+    if score_stats:
+        return outputs, dict(sorted(stats.items()))
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match school-linked non-profits to schools for a list of years.")
+    parser.add_argument("--years", type=int, nargs="+", default=[2016, 2017, 2018, 2019, 2020, 2021], help="school years to match")
+    parser.add_argument("--org-years", type=int, nargs="+", help="year of BMF and Core files to use for each school year")
+    parser.add_argument("--bmf-root", required=True, help="directory with one directory of BMF files per year")
+    parser.add_argument("--core-root", required=True, help="directory with one directory of Core files per year")
+    parser.add_argument("--schools-root", required=True, help="directory with a schools_<year>.csv file per year")
+    parser.add_argument("--output-root", required=True, help="directory to write finalmatches<year>.csv files to")
+    parser.add_argument("--workers", type=int, help="number of processes, defaults to the number of cores")
+    parser.add_argument("--cutoff", type=float, default=0.7, help="smallest similarity score of a good match")
+    parser.add_argument("--cache-dir", help="directory to cache the filtered and formatted data in")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="largest size of the cache in megabytes")
+    parser.add_argument("--score-cache", help="SQLite file to keep name and address scores in across years and runs")
+    parser.add_argument("--score-cache-max-entries", type=int, help="largest number of scores to keep in the score cache")
+    parser.add_argument("--score-threads", type=int, help="number of threads each year scores name and address pairs on")
+    parser.add_argument("--chunk-size", type=int, help="number of orgs to score at a time, bounds the memory used by matching")
+    parser.add_argument("--profile", type=int, choices=[0, 1, 2], default=0,
+                        help="write a manifest<year>.json of each run, 1 records time, memory and counts of each stage, 2 also traces allocations")
+    parser.add_argument("--blocking-report", action="store_true",
+                        help="write a blocking_report<year>.csv comparing the pairs and recall of each blocking strategy, slow")
+    args = parser.parse_args()
+
+    outputs, stats = run_years(args.years, args.bmf_root, args.core_root, args.schools_root, args.output_root,
+                        org_years=args.org_years, workers=args.workers, cutoff=args.cutoff,
+                        cache_dir=args.cache_dir, cache_max_bytes=args.cache_max_mb * 1024 ** 2, chunk_size=args.chunk_size,
+                        score_cache_path=args.score_cache, score_cache_max_entries=args.score_cache_max_entries, score_threads=args.score_threads, profile=args.profile,
+                        blocking_report=args.blocking_report, score_stats=True)
+    for year, output_path in outputs.items():
+        print(f"{year}: {output_path}")
+        # report how many name and address pairs were already scored in this or an earlier run
+        for row in stats[year].itertuples():
+            print(f"{year}: {row.Field} scores {row.Hits} cached, {row.Misses} new, hit rate {row.Hit_Rate:.1%}")
@@ -0,0 +1,190 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module records where the time and memory of a run go. Each step of the pipeline is wrapped
+in a stage that records its wall time, the resident memory of the process when it starts and
+ends and how much it grew, the rows it read and wrote and any counts the step adds, such as the
+number of candidate pairs of a matching round. The peak resident memory of the process is only
+known for the whole run, so each stage records it as the process peak so far. The stages and
+counts of a run are written as a JSON manifest next to its outputs.
+
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # the resource module is not available on Windows
+    resource = None
+
+
+# profiling levels, off records nothing, stages records time, memory and counts of each stage
+# and memory also traces the Python allocations of each stage, which slows the run down
+PROFILE_OFF = 0
+PROFILE_STAGES = 1
+PROFILE_MEMORY = 2
+
+
+def peak_rss_mb():
+    """
+    Reads the peak resident memory of the process so far.
+
+    Returns:
+        float: The peak resident set size in megabytes, None where the resource module is not available.
+
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes and Linux reports kilobytes
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def current_rss_mb():
+    """
+    Reads the current resident memory of the process.
+
+    Returns:
+        float: The resident set size in megabytes, None where /proc/self/statm is not available.
+
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            pages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+class RunManifest:
+    """
+    The stages and counts of one run.
+
+    Args:
+        level (int): One of PROFILE_OFF, PROFILE_STAGES and PROFILE_MEMORY.
+        **info: Values that describe the run, such as the year, written at the top of the manifest.
+
+    """
+
+    def __init__(self, level=PROFILE_OFF, **info):
+        self.level = level
+        self.info = info
+        self.stages = []
+        self.counts = {}
+        self.current = None
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **info):
+        """
+        Records a stage of the run.
+
+        The stage record is yielded so the step can add its output rows and other values to it,
+        and count adds to the stage that is currently open.
+
+        Args:
+            name (str): The name of the stage.
+            rows_in (int): The number of rows the stage reads.
+            **info: Other values that describe the stage.
+
+        Yields:
+            dict: The record of the stage.
+
+        """
+        record = {'stage': name, 'rows_in': rows_in, **info}
+        if self.level <= PROFILE_OFF:
+            yield record
+            return
+
+        parent, self.current = self.current, record
+        trace = self.level >= PROFILE_MEMORY and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        rss_start = current_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            # the memory the stage held on to, memory freed before it ends is not counted
+            rss_end = current_rss_mb()
+            record['rss_start_mb'] = rss_start
+            record['rss_end_mb'] = rss_end
+            record['rss_growth_mb'] = None if rss_start is None or rss_end is None else rss_end - rss_start
+            record['process_peak_rss_mb'] = peak_rss_mb()
+            if trace:
+                record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+            self.current = parent
+            self.stages.append(record)
+
+    def count(self, key, value=1):
+        """
+        Adds to a count of the stage that is currently open, or of the whole run outside of a stage.
+
+        Args:
+            key (str): The name of the count.
+            value (int): The amount to add.
+
+        """
+        if self.level <= PROFILE_OFF:
+            return
+        counts = self.counts if self.current is None else self.current
+        counts[key] = counts.get(key, 0) + value
+
+    def record(self, key, value):
+        """
+        Sets a value of the whole run, such as the matches of each Match_Parameter.
+
+        Args:
+            key (str): The name of the value.
+            value: Any value that can be written as JSON.
+
+        """
+        if self.level > PROFILE_OFF:
+            self.counts[key] = value
+
+    def to_dict(self):
+        """
+        Builds the manifest.
+
+        Returns:
+            dict: The run information, stages in the order they finished and counts.
+
+        """
+        return {
+            **self.info,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'seconds': time.time() - self.started,
+            'process_peak_rss_mb': peak_rss_mb(),
+            'python': platform.python_version(),
+            'stages': self.stages,
+            'counts': self.counts,
+        }
+
+    def write(self, path):
+        """
+        Writes the manifest as JSON, unless profiling is off.
+
+        Args:
+            path (str): The path of the manifest.
+
+        Returns:
+            str: The path of the manifest, None if nothing was written.
+
+        """
+        if self.level <= PROFILE_OFF:
+            return None
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2, default=str)
+        os.replace(tmp, path)
+        return path
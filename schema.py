@@ -0,0 +1,227 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module defines the column types of the yearly matches, of the panel, of the district
+rollups and of the org lifecycles, and reads and writes the panel and rollups as Parquet files
+partitioned by year.
+
+Without a schema, IDs and codes come out of the CSV files as floats, revenues can be strings with
+dollar signs and the same school and organization names are stored again on every row. With it,
+EINs are nullable 64 bit integers, school and district IDs and years are 32 bit integers, codes
+and flags are nullable 8 bit integers, revenues are parsed to floats when they are read in and
+names and school levels are categoricals.
+
+"""
+
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+# the type of each column as (column name pattern, type), 'revenue' is a float64 parsed from strings like '$1,234'
+# schID is the raw 12 digit NCES ID in the matches of 2020 on, it is only shortened when the panel is built
+MATCH_SCHEMA = [
+    (r'level_[01]', 'Int64'),
+    (r'(Name|Address|Zip|Total)_Score', 'float64'),
+    (r'EIN', 'Int64'),
+    (r'Organization_Name', 'category'),
+    (r'Org_code', 'Int8'),
+    (r'School_Name', 'category'),
+    (r'schID', 'Int64'),
+    (r'leaID', 'Int32'),
+    (r'School_level', 'category'),
+    (r'Revenue', 'revenue'),
+    (r'Match_Parameter', 'category'),
+    (r'Year', 'Int32'),
+]
+
+# the wide panel has EIN{i}, Org_name{i}, Org_code{i} and Rev{i} columns and the long panel has them without a number
+PANEL_SCHEMA = [
+    (r'schID', 'Int32'),
+    (r'Year', 'Int32'),
+    (r'leaID', 'Int32'),
+    (r'School_Name', 'category'),
+    (r'School_level', 'category'),
+    (r'School_org', 'Int16'),
+    (r'EIN\d*', 'Int64'),
+    (r'Org_name\d*', 'category'),
+    (r'Org_code\d*', 'Int8'),
+    (r'Rev\d*', 'revenue'),
+    (r'TotRev', 'float64'),
+    (r'Orgs', 'Int16'),
+    # the revenue tiers and the alive flags, missing for the schools without any matched organization
+    (r'ANY\w+|\w+alive', 'Int8'),
+]
+
+# the district rollups of districts.py, one row per district and year
+DISTRICT_SCHEMA = [
+    (r'leaID', 'Int32'),
+    (r'Year', 'Int32'),
+    (r'Schools|SchoolsWithOrgs|Orgs|[A-Z]+orgs', 'Int32'),
+    (r'\w+', 'float64'),
+]
+
+# the org lifecycles of lifecycle.py, with one row per EIN and year, per EIN or per school
+LIFECYCLE_SCHEMA = [
+    (r'EIN', 'Int64'),
+    (r'(Prev_|First_|Last_)?schID|leaID', 'Int32'),
+    (r'(Prev_|First_|Last_)?Year|Years(_Seen)?|Gap_Years|Gaps|School_Changes|Reclassifications|\w+_(Births|Deaths)', 'Int32'),
+    (r'(Prev_|First_|Last_)?Org_code', 'Int8'),
+    (r'(Prev_|First_|Last_)?Revenue|Rev_Delta|Rev_Change', 'float64'),
+]
+
+INT_RANGES = {'Int8': np.int8, 'Int16': np.int16, 'Int32': np.int32}
+
+
+def to_revenue(col):
+    """
+    Converts a revenue column to numbers, removing dollar signs and thousands separators from strings.
+
+    Args:
+        col (pandas.Series): The revenues.
+
+    Returns:
+        pandas.Series: The revenues as float64, with missing values where there is no revenue.
+
+    """
+    if col.dtype == object or isinstance(col.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+        col = col.astype(object).astype(str).str.replace(r'[$,]', '', regex=True).where(col.notna())
+    return pd.to_numeric(col, errors='coerce').astype('float64')
+
+
+def _to_int(col, dtype):
+    """
+    Converts a column to an integer type, using Int64 instead of a smaller type the values do not fit in.
+    """
+    values = pd.to_numeric(col.astype(object) if isinstance(col.dtype, pd.CategoricalDtype) else col, errors='coerce')
+    if dtype in INT_RANGES and len(values.dropna()):
+        info = np.iinfo(INT_RANGES[dtype])
+        if values.min() < info.min or values.max() > info.max:
+            # such as the 12 digit NCES school IDs of states other than NC
+            return values.astype('Int64')
+    return values.astype(dtype)
+
+
+def column_type(col, schema):
+    """
+    Finds the type of a column in a schema.
+
+    Args:
+        col (str): The column name.
+        schema (list): The schema as (column name pattern, type).
+
+    Returns:
+        str: The type of the column, None if the schema does not cover it.
+
+    """
+    for pattern, dtype in schema:
+        if re.fullmatch(pattern, str(col)):
+            return dtype
+    return None
+
+
+def apply_schema(df, schema, categorical=True):
+    """
+    Converts the columns of a dataframe to the types of a schema. Columns the schema does not cover
+    are left as they are.
+
+    Args:
+        df (pandas.DataFrame): The matches or panel.
+        schema (list): MATCH_SCHEMA or PANEL_SCHEMA.
+        categorical (bool): Whether to convert names and levels to categoricals. Grouping on
+            categoricals needs observed=True, so steps that group on names use False.
+
+    Returns:
+        pandas.DataFrame: A copy of the dataframe with the schema types.
+
+    """
+    df = df.copy()
+    for col in df.columns:
+        dtype = column_type(col, schema)
+        if dtype is None or df[col].dtype == dtype:
+            continue
+        if dtype == 'revenue':
+            df[col] = to_revenue(df[col])
+        elif dtype == 'category':
+            if categorical:
+                df[col] = df[col].astype('category')
+        elif dtype == 'float64':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        else:
+            df[col] = _to_int(df[col], dtype)
+    return df
+
+
+def _panel_key(df):
+    """
+    Finds the ID a panel is sorted by, schID for the school panels and leaID for the district rollups.
+    """
+    return 'schID' if 'schID' in df.columns else 'leaID'
+
+
+def write_panel(panel, root, years=None, schema=PANEL_SCHEMA):
+    """
+    Writes a panel as Parquet files partitioned by year, one Year=<year> directory per year.
+
+    Each year is written to a temporary directory first and then swapped in, so readers never see a
+    partly written year.
+
+    Args:
+        panel (pandas.DataFrame): The panel, wide or long.
+        root (str): The directory to write the panel to.
+        years (list): The years to write, None to write every year of the panel. The other years
+            already in the directory are kept, so a single year can be replaced.
+        schema (list): The column types of the panel, PANEL_SCHEMA or DISTRICT_SCHEMA.
+
+    Returns:
+        str: The directory of the panel.
+
+    """
+    panel = apply_schema(panel, schema)
+    os.makedirs(root, exist_ok=True)
+    years = sorted(panel['Year'].dropna().unique()) if years is None else years
+    for year in years:
+        year_dir = os.path.join(root, f"Year={int(year)}")
+        tmp = tempfile.mkdtemp(dir=root, prefix='.tmp-')
+        # the year is stored in the directory name
+        panel[panel['Year'] == year].drop(columns='Year').to_parquet(os.path.join(tmp, 'part-0.parquet'), index=False)
+        if os.path.exists(year_dir):
+            shutil.rmtree(year_dir)
+        os.replace(tmp, year_dir)
+    return root
+
+
+def read_panel(root, years=None, columns=None, schema=PANEL_SCHEMA):
+    """
+    Reads a panel written by write_panel, only reading the files of the requested years.
+
+    Args:
+        root (str): The directory of the panel.
+        years (list): The years to read, None to read every year.
+        columns (list): The columns to read, None to read every column.
+        schema (list): The column types of the panel, PANEL_SCHEMA or DISTRICT_SCHEMA.
+
+    Returns:
+        pandas.DataFrame: The panel with the schema types, sorted by schID, or leaID for the district
+            rollups, and Year.
+
+    """
+    filters = None if years is None else [('Year', 'in', [int(year) for year in years])]
+    if columns is not None and 'Year' not in columns:
+        columns = list(columns) + ['Year']
+    panel = pd.read_parquet(root, columns=columns, filters=filters)
+    # the year is read back from the directory names as a categorical
+    panel['Year'] = panel['Year'].astype(str).astype(int)
+    panel = apply_schema(panel, schema)
+    # put the year back after the school or district ID where it was written from
+    key = _panel_key(panel)
+    cols = [col for col in panel.columns if col != 'Year']
+    cols.insert(cols.index(key) + 1 if key in cols else 0, 'Year')
+    panel = panel[cols]
+    keys = [col for col in [key, 'Year'] if col in panel.columns]
+    return panel.sort_values(keys).reset_index(drop=True)
@@ -0,0 +1,208 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module keeps a crosswalk from the school IDs of the yearly rosters to the canonical integer
+school key used by the panel. From 2020 on, the rosters carry 12-digit NCES IDs with a 370 prefix
+and leading zeros, while the earlier years carry the shorter IDs, so the same school has a
+different raw ID depending on the year.
+
+The crosswalk has one row per roster school and year with the raw ID, the district, the key and the
+name of the school that year. It flags the schools whose name changed from their previous year, and
+whether the change is only a different spelling of the same name, such as "altamahaw ossipee elem"
+and "altamahaw-ossipee elementary". It is built once per roster and kept in a Parquet file, so the
+panel steps look the keys up with a join instead of rewriting the IDs of every file they read.
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from frame_cache import file_digest
+from pto_codebook import name_stem
+
+
+# the columns of the school rosters as they are named in the panel
+ROSTER_COLUMNS = {'school_id': 'schID', 'year': 'Year', 'leaid': 'leaID', 'school_name': 'School_Name', 'school_level': 'School_level'}
+
+# powers of ten used to count the digits of school IDs
+ID_DIGITS = 10 ** np.arange(19, dtype=np.int64)
+
+
+def normalize_school_ids(ids, years):
+    """
+    Converts raw school IDs to the canonical school keys, in one pass over the whole column.
+
+    From 2020 on, school IDs are 12-digit NCES IDs with a 370 prefix and leading zeros. The prefix is
+    removed, which also removes the leading zeros, so they become the shorter IDs of the earlier years.
+
+    Args:
+        ids (pandas.Series): The school IDs, as numbers or strings.
+        years (pandas.Series or int): The year of each ID.
+
+    Returns:
+        pandas.Series: The school keys as int64.
+
+    """
+    ids = pd.to_numeric(ids).astype(np.int64)
+    values = ids.to_numpy()
+    # the ID without its first three digits, which are 370 for the NCES IDs
+    scale = ID_DIGITS[np.maximum(np.searchsorted(ID_DIGITS, values, side='right') - 3, 0)]
+    nces = (np.asarray(years) >= 2020) & (values // scale == 370) & (values >= 1000)
+    return pd.Series(np.where(nces, values % scale, values), index=ids.index)
+
+
+def read_roster(schools_root, year):
+    """
+    Reads the school roster of a year with the columns named as in the panel.
+
+    Args:
+        schools_root (str): The directory containing the schools_<year>.csv files.
+        year (int): The year of the roster.
+
+    Returns:
+        pandas.DataFrame: The raw schID, Year, leaID, School_Name and School_level of each school,
+            with the year of the file as Year. The 2021 roster has 'mixed - most recent' as its year.
+
+    """
+    roster = pd.read_csv(os.path.join(schools_root, f"schools_{year}.csv"), usecols=lambda col: col in ROSTER_COLUMNS)
+    roster = roster.rename(columns=ROSTER_COLUMNS)
+    roster['Year'] = year
+    return roster
+
+
+def flag_renames(crosswalk):
+    """
+    Flags the school-years whose name differs from the previous year of the same school.
+
+    Args:
+        crosswalk (pandas.DataFrame): The crosswalk sorted by schID and Year.
+
+    Returns:
+        pandas.DataFrame: The crosswalk with Renamed, set when the lowercase name changed, and
+            Respelled, set when it changed but its name stem and school level are the same.
+
+    """
+    crosswalk = crosswalk.copy()
+    names = crosswalk['School_Name'].astype(str).str.lower()
+    stems, levels = name_stem(names)
+    previous = crosswalk['schID'].shift() == crosswalk['schID']
+    renamed = previous & (names != names.shift())
+    same_stem = (stems == stems.shift()) & (levels == levels.shift())
+    crosswalk['Renamed'] = renamed
+    crosswalk['Respelled'] = renamed & same_stem
+    return crosswalk
+
+
+class SchoolRegistry:
+    """
+    The crosswalk from raw roster school IDs to canonical school keys.
+
+    Args:
+        path (str): The Parquet file to keep the crosswalk in across runs, None to only keep it in memory.
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.crosswalk = None
+        if path is not None and os.path.exists(path):
+            self.crosswalk = pd.read_parquet(path)
+
+    def add_years(self, years, schools_root):
+        """
+        Adds the rosters of years to the crosswalk. A year already in the crosswalk is only read
+        again if its roster file changed.
+
+        Args:
+            years (list): The years to add.
+            schools_root (str): The directory containing the schools_<year>.csv files.
+
+        Returns:
+            SchoolRegistry: The registry.
+
+        """
+        crosswalk = self.crosswalk
+        added = []
+        for year in years:
+            digest = file_digest(os.path.join(schools_root, f"schools_{year}.csv"))
+            if crosswalk is not None and (crosswalk.loc[crosswalk['Year'] == year, 'Roster_Digest'] == digest).any():
+                continue
+            roster = read_roster(schools_root, year).rename(columns={'schID': 'raw_schID'})
+            roster['Roster_Digest'] = digest
+            added.append(roster)
+        if not added:
+            return self
+
+        added = pd.concat(added, axis=0, ignore_index=True)
+        added['schID'] = normalize_school_ids(added['raw_schID'], added['Year'])
+        if crosswalk is not None:
+            crosswalk = crosswalk[~crosswalk['Year'].isin(added['Year'].unique())]
+        crosswalk = pd.concat([crosswalk, added], axis=0, ignore_index=True)
+        crosswalk = crosswalk.sort_values(['schID', 'Year'], kind='stable').reset_index(drop=True)
+        self.crosswalk = flag_renames(crosswalk[['raw_schID', 'Year', 'leaID', 'schID', 'School_Name', 'School_level', 'Roster_Digest']])
+        if self.path is not None:
+            tmp = f"{self.path}.tmp"
+            self.crosswalk.to_parquet(tmp, index=False)
+            os.replace(tmp, self.path)
+        return self
+
+    def school_keys(self, ids, years):
+        """
+        Looks up the school keys of raw school IDs.
+
+        Args:
+            ids (pandas.Series): The raw school IDs.
+            years (pandas.Series or int): The roster year of each ID.
+
+        Returns:
+            pandas.Series: The school keys as int64. IDs that are not in the crosswalk are normalized
+                directly.
+
+        """
+        ids = pd.to_numeric(ids).astype(np.int64)
+        years = pd.Series(np.broadcast_to(np.asarray(years), len(ids)), index=ids.index)
+        keys = pd.Series(np.nan, index=ids.index)
+        if self.crosswalk is not None:
+            crosswalk = self.crosswalk.drop_duplicates(['raw_schID', 'Year'])
+            index = pd.MultiIndex.from_arrays([crosswalk['raw_schID'], crosswalk['Year']])
+            positions = index.get_indexer(pd.MultiIndex.from_arrays([ids, years]))
+            found = positions >= 0
+            keys[found] = crosswalk['schID'].to_numpy()[positions[found]]
+        missing = keys.isna()
+        if missing.any():
+            keys[missing] = normalize_school_ids(ids[missing], years[missing])
+        return keys.astype(np.int64)
+
+    def schools(self, years):
+        """
+        Reads the roster schools of years from the crosswalk.
+
+        Args:
+            years (list): The years to read.
+
+        Returns:
+            pandas.DataFrame: The schID, Year, leaID, School_Name and School_level of each school-year.
+
+        """
+        schools = self.crosswalk[self.crosswalk['Year'].isin(years)]
+        return schools[[col for col in ROSTER_COLUMNS.values() if col in schools.columns]].reset_index(drop=True)
+
+    def renames(self, respelled=None):
+        """
+        Lists the school-years whose name changed from the previous year of the school.
+
+        Args:
+            respelled (bool): True for only the respellings, False for only the other renames, None for both.
+
+        Returns:
+            pandas.DataFrame: The renamed school-years with the name of the previous year as Previous_Name.
+
+        """
+        crosswalk = self.crosswalk.assign(Previous_Name=self.crosswalk['School_Name'].shift())
+        renames = crosswalk[crosswalk['Renamed']]
+        if respelled is not None:
+            renames = renames[renames['Respelled'] == respelled]
+        return renames[['schID', 'Year', 'leaID', 'Previous_Name', 'School_Name', 'Respelled']].reset_index(drop=True)
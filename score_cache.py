@@ -0,0 +1,196 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module contains a cache of Jaro-Winkler similarity scores between organization and school
+strings. The matching process scores each distinct (org string, school string) pair at most once
+and looks the score up whenever the same pair comes up again, whether in the same round, in the
+other round or for another organization or school with the same name or address.
+
+The cache can be kept in a SQLite file so that the yearly runs share their scores. Most orgs and
+schools keep the same name and address from year to year, so a new year only needs to score the
+pairs that changed. The file is kept under a number of entries by evicting the least recently
+used scores. A long running process, such as the match service, can also bound the scores kept in
+memory, which are then written to the file and dropped from memory once there are too many.
+
+"""
+
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from jaro_winkler import jaro_winkler
+
+
+class ScoreCache:
+    """
+    A cache of Jaro-Winkler scores, with one namespace per compared field.
+
+    The scores are computed with the batched kernel in jaro_winkler.py, which gives the same scores
+    as recordlinkage's Compare.string(..., method='jarowinkler'), so cached and uncached scores are identical.
+    The keys are the org and school strings as formatted by format_orgs and format_schools,
+    which are already lowercase.
+
+    Args:
+        path (str): The SQLite file to keep the scores in across runs, None to only keep them in memory.
+        max_entries (int): The largest number of scores to keep in the file, None for no limit.
+        workers (int): The number of threads to score new pairs on, defaults to one.
+        max_memory_entries (int): The largest number of scores to keep in memory, None for no limit.
+            Over the limit, the scores are flushed to the file and dropped from memory.
+
+    """
+
+    def __init__(self, path=None, max_entries=None, workers=None, max_memory_entries=None):
+        self.scores = {}
+        self.max_memory_entries = max_memory_entries
+        self.hits = {}
+        self.misses = {}
+        self.max_entries = max_entries
+        self.workers = workers
+        self.db = None
+        if path is not None:
+            # several yearly runs can share the file, so wait for the other writers instead of failing
+            self.db = sqlite3.connect(path, timeout=600)
+            # write-ahead logging lets the other runs keep reading while one of them writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores (field TEXT, s1 TEXT, s2 TEXT, score REAL, used REAL)")
+            self.db.execute("CREATE UNIQUE INDEX IF NOT EXISTS scores_key ON scores (field, s1, s2)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS scores_used ON scores (used)")
+            self.db.commit()
+
+    def _load(self, field, pairs):
+        """
+        Reads the scores of pairs from the file.
+
+        Args:
+            field (str): The namespace of the scores.
+            pairs (pandas.MultiIndex): The (org string, school string) pairs to look up.
+
+        Returns:
+            dict: The score of each pair that is in the file.
+
+        """
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (s1 TEXT, s2 TEXT)")
+        self.db.execute("DELETE FROM lookup")
+        self.db.executemany("INSERT INTO lookup VALUES (?, ?)", list(pairs))
+        rows = self.db.execute("SELECT l.s1, l.s2, s.score FROM lookup l JOIN scores s "
+                               "ON s.field = ? AND s.s1 = l.s1 AND s.s2 = l.s2", (field,)).fetchall()
+        # end the read so that other runs can write to the file
+        self.db.commit()
+        return {(s1, s2): score for s1, s2, score in rows}
+
+    def jarowinkler(self, s1, s2, field='name', threshold=None):
+        """
+        Computes the Jaro-Winkler similarity of each pair of strings, scoring distinct pairs that are
+        not in the cache yet and looking up the others.
+
+        Args:
+            s1 (array-like): The org strings.
+            s2 (array-like): The school strings, aligned with s1.
+            field (str): The namespace of the scores, such as 'name' or 'address'.
+            threshold (float): Skip the new pairs that cannot reach this similarity, None to score every pair.
+
+        Returns:
+            pandas.Series: The similarity of each pair, 0 where either string is missing or the pair was
+                skipped. Skipped pairs are not cached.
+
+        """
+        pairs = pd.DataFrame({'s1': np.asarray(s1, dtype=object), 's2': np.asarray(s2, dtype=object)})
+        result = np.zeros(len(pairs))
+        present = (pairs['s1'].notna() & pairs['s2'].notna()).values
+        if not present.any():
+            return pd.Series(result)
+
+        # score each distinct pair of strings once
+        pair_ids, distinct = pd.factorize(pd.MultiIndex.from_frame(pairs[present]))
+        scores = self.scores.setdefault(field, {})
+        distinct_scores = np.array([scores.get(pair, np.nan) for pair in distinct])
+
+        # look up the pairs that were scored in an earlier run
+        missing = np.isnan(distinct_scores)
+        if missing.any() and self.db is not None:
+            stored = self._load(field, distinct[missing])
+            if stored:
+                distinct_scores[missing] = [stored.get(pair, np.nan) for pair in distinct[missing]]
+                scores.update(stored)
+                missing = np.isnan(distinct_scores)
+
+        self.hits[field] = self.hits.get(field, 0) + int((~missing).sum())
+        self.misses[field] = self.misses.get(field, 0) + int(missing.sum())
+
+        if missing.any():
+            new_pairs = distinct[missing]
+            new_scores = jaro_winkler(new_pairs.get_level_values(0).values, new_pairs.get_level_values(1).values,
+                                      threshold=threshold, workers=self.workers)
+            scored = ~np.isnan(new_scores)
+            distinct_scores[missing] = np.nan_to_num(new_scores)
+            scores.update(zip(new_pairs[scored], new_scores[scored]))
+
+        result[present] = distinct_scores[pair_ids]
+        self.trim()
+        return pd.Series(result)
+
+    def trim(self):
+        """
+        Flushes the scores to the file and drops them from memory once there are more than
+        max_memory_entries of them. Dropped scores are read back from the file when they come up again.
+        """
+        if self.max_memory_entries is None or sum(len(scores) for scores in self.scores.values()) <= self.max_memory_entries:
+            return
+        self.flush()
+        self.scores = {}
+
+    def name_score(self, s1, s2):
+        """
+        Scores org names against school names, for use with recordlinkage.Compare.compare_vectorized.
+        """
+        return self.jarowinkler(s1, s2, field='name')
+
+    def address_score(self, s1, s2):
+        """
+        Scores org addresses against school streets, for use with recordlinkage.Compare.compare_vectorized.
+        """
+        return self.jarowinkler(s1, s2, field='address')
+
+    def stats(self):
+        """
+        Reports how many distinct pairs were found in the cache and how many had to be scored.
+
+        Returns:
+            pandas.DataFrame: One row per field with its hits, misses and hit rate.
+
+        """
+        rows = []
+        for field in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits.get(field, 0), self.misses.get(field, 0)
+            rows.append({'Field': field, 'Hits': hits, 'Misses': misses,
+                         'Hit_Rate': hits / (hits + misses) if hits + misses else 0.0})
+        return pd.DataFrame(rows, columns=['Field', 'Hits', 'Misses', 'Hit_Rate'])
+
+    def flush(self):
+        """
+        Writes the scores used in this run to the file, marks them as recently used and evicts the
+        least recently used scores if the file is over max_entries.
+        """
+        if self.db is None:
+            return
+        now = time.time()
+        with self.db:
+            for field, scores in self.scores.items():
+                self.db.executemany("INSERT INTO scores VALUES (?, ?, ?, ?, ?) "
+                                    "ON CONFLICT (field, s1, s2) DO UPDATE SET used = excluded.used",
+                                    ((field, s1, s2, score, now) for (s1, s2), score in scores.items()))
+            if self.max_entries is not None:
+                self.db.execute("DELETE FROM scores WHERE rowid IN (SELECT rowid FROM scores ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                                (self.max_entries,))
+
+    def close(self):
+        """
+        Flushes the scores to the file and closes it.
+        """
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
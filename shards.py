@@ -0,0 +1,380 @@
+"""
+
+CRF 2023 - Team PTO
+
+This module runs the codebook for all states at once by splitting the organizations and schools
+into shards. Each state is a shard, and states with many schools can be split further into groups
+of neighboring 3 digit ZIP codes. Every shard is classified and matched on its own, so orgs are
+never compared with the schools of another state, and the shards of all years run in parallel.
+
+Each shard writes a marker file with the settings of its run when its matches are complete. A run
+that fails or is stopped can be started again with the same arguments and only runs the shards that
+are not complete yet. The partition of a year is keyed on the contents of its input files and the
+largest shard size, and a shard on the settings it was run with, so new input files or settings
+partition or match the shards again instead of reusing their old matches.
+Once all shards of a year are complete, their matches are combined into one finalmatches<year>.csv
+file that panel.py can build the panel from.
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import panel
+import pto_codebook
+from frame_cache import file_digest, input_files
+
+
+# the column of the school files with the state of each school
+SCHOOL_STATE_COLUMN = 'state_location'
+
+
+def plan_shards(df_schools, max_shard_schools=None):
+    """
+    Splits the schools into shards, one per state, with the states that have more than
+    max_shard_schools schools split into groups of consecutive 3 digit ZIP codes.
+
+    Args:
+        df_schools (pandas.DataFrame): The schools of all states.
+        max_shard_schools (int): The largest number of schools in a shard, None to never split a state.
+
+    Returns:
+        pandas.DataFrame: One row per shard with its name, state, lowest 3 digit ZIP code and number
+            of schools. The shards of a state cover all ZIP codes from their lowest ZIP code up to the
+            lowest ZIP code of the next shard.
+
+    """
+    schools = pd.DataFrame({'state': df_schools[SCHOOL_STATE_COLUMN].str.upper().values,
+                            'zip3': pto_codebook.zip_key(df_schools['zip_location'], 3).fillna('000').values})
+    rows = []
+    for state, group in schools.groupby('state'):
+        counts = group['zip3'].value_counts().sort_index()
+        if max_shard_schools is None or counts.sum() <= max_shard_schools:
+            rows.append({'shard': state, 'state': state, 'zip3': '000', 'schools': int(counts.sum())})
+            continue
+        # pack consecutive ZIP codes into shards until a shard is full
+        start, size = '000', 0
+        for zip3, count in counts.items():
+            if size and size + count > max_shard_schools:
+                rows.append({'shard': f'{state}-{start}', 'state': state, 'zip3': start, 'schools': size})
+                start, size = zip3, 0
+            size += count
+        rows.append({'shard': f'{state}-{start}', 'state': state, 'zip3': start, 'schools': size})
+    return pd.DataFrame(rows, columns=['shard', 'state', 'zip3', 'schools'])
+
+
+def assign_shards(states, zips, plan):
+    """
+    Finds the shard of each org or school from its state and ZIP code.
+
+    Args:
+        states (pandas.Series): The states.
+        zips (pandas.Series): The ZIP codes.
+        plan (pandas.DataFrame): The shards, as returned by plan_shards.
+
+    Returns:
+        pandas.Series: The name of the shard of each row, missing for states without schools.
+
+    """
+    states = states.astype(str).str.upper()
+    zip3 = pto_codebook.zip_key(zips, 3).fillna('000')
+    shards = pd.Series(np.nan, index=states.index, dtype=object)
+    for state, group in plan.groupby('state'):
+        rows = states == state
+        # the shard with the highest lowest ZIP code that is not above the row's ZIP code
+        position = np.searchsorted(group['zip3'].values, zip3[rows].values, side='right') - 1
+        shards[rows] = group['shard'].values[np.maximum(position, 0)]
+    return shards
+
+
+def _write_atomic(path, write):
+    """
+    Writes a file through a temporary file in the same directory, so readers never see a partial file.
+    """
+    tmp = tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), prefix='.tmp-', suffix=os.path.basename(path), delete=False)
+    tmp.close()
+    try:
+        write(tmp.name)
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.remove(tmp.name)
+        raise
+
+
+def partition_key(year, bmf_root, core_root, schools_root, org_year, max_shard_schools, ntee):
+    """
+    Computes the key of the partition of a year, from the contents of its input files and the
+    settings that change how they are split.
+
+    Args:
+        year (int): The school year.
+        bmf_root (str): The directory containing one directory of BMF files per year.
+        core_root (str): The directory containing one directory of Core files per year.
+        schools_root (str): The directory containing the school files of all states.
+        org_year (int): The year of BMF and Core files.
+        max_shard_schools (int): The largest number of schools in a shard.
+        ntee (str): The NTEE code the organizations need to have.
+
+    Returns:
+        str: The hex SHA-256 key of the partition.
+
+    """
+    digest = hashlib.sha256()
+    params = {'year': year, 'org_year': org_year, 'max_shard_schools': max_shard_schools, 'ntee': ntee}
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    paths = [os.path.join(bmf_root, str(org_year)), os.path.join(core_root, str(org_year)), os.path.join(schools_root, f"schools_{year}.csv")]
+    for path in input_files(paths):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def shard_key(year, state, org_year, kwargs):
+    """
+    Computes the key of the run of a shard, from the arguments it is passed to run_year with.
+
+    Returns:
+        str: The arguments as sorted JSON, written to the marker of a complete shard.
+
+    """
+    return json.dumps({'year': year, 'state': state, 'org_year': org_year, **kwargs}, sort_keys=True, default=str)
+
+
+def partition_year(year, bmf_root, core_root, schools_root, shard_root, org_year=None, max_shard_schools=None, ntee='B'):
+    """
+    Splits the BMF, Core and school files of a year into shards.
+
+    Each shard gets its own directory in the layout run_year reads, with its BMF and Core rows in
+    bmf/<org year>/orgs.csv and core/<org year>/orgs.csv and its schools in schools_<year>.csv. Only
+    orgs with the NTEE code are kept, and orgs of states without any school are left out. Later runs
+    reuse the partition as long as its input files and max_shard_schools are the same, otherwise
+    it is written again from scratch, without the matches of its old shards.
+
+    Args:
+        year (int): The school year.
+        bmf_root (str): The directory containing one directory of BMF files per year.
+        core_root (str): The directory containing one directory of Core files per year.
+        schools_root (str): The directory containing the school files of all states.
+        shard_root (str): The directory to write the shards to.
+        org_year (int): The year of BMF and Core files, defaults to year.
+        max_shard_schools (int): The largest number of schools in a shard, None to have one shard per state.
+        ntee (str): The NTEE code the organizations need to have.
+
+    Returns:
+        pandas.DataFrame: The shards of the year, as returned by plan_shards.
+
+    """
+    org_year = year if org_year is None else org_year
+    year_root = os.path.join(shard_root, str(year))
+    plan_path = os.path.join(year_root, 'shards.json')
+    key_path = os.path.join(year_root, 'partition.key')
+    key = partition_key(year, bmf_root, core_root, schools_root, org_year, max_shard_schools, ntee)
+    if os.path.exists(plan_path) and os.path.exists(key_path):
+        with open(key_path) as file:
+            if file.read() == key:
+                return pd.read_json(plan_path, dtype={'zip3': str})
+
+    df_schools = pd.read_csv(os.path.join(schools_root, f"schools_{year}.csv"), low_memory=False)
+    plan = plan_shards(df_schools, max_shard_schools)
+    school_shards = assign_shards(df_schools[SCHOOL_STATE_COLUMN], df_schools['zip_location'], plan)
+
+    # write the shards to a temporary directory first, so a failed partition leaves nothing behind
+    os.makedirs(shard_root, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=shard_root, prefix=f'.tmp-{year}-')
+    try:
+        for shard, df_shard in df_schools.groupby(school_shards):
+            os.makedirs(os.path.join(tmp, shard), exist_ok=True)
+            df_shard.to_csv(os.path.join(tmp, shard, f"schools_{year}.csv"), index=False)
+
+        # shards without orgs in one of the files still need the directory to be read
+        for shard in plan['shard']:
+            for source in ['bmf', 'core']:
+                os.makedirs(os.path.join(tmp, shard, source, str(org_year)), exist_ok=True)
+
+        for source, root in [('bmf', bmf_root), ('core', core_root)]:
+            # the orgs of every state are streamed one chunk at a time, and the state filter is applied by the shards
+            written = set()
+            for df_orgs in pto_codebook.iter_orgs(os.path.join(root, str(org_year)), state=None, ntee=ntee):
+                org_shards = assign_shards(df_orgs['STATE'], df_orgs['ZIP5'], plan)
+                for shard, df_shard in df_orgs.groupby(org_shards):
+                    # the first chunk of a shard writes the header, the later chunks are appended to it
+                    df_shard.to_csv(os.path.join(tmp, shard, source, str(org_year), 'orgs.csv'), index=False,
+                                    mode='a' if shard in written else 'w', header=shard not in written)
+                    written.add(shard)
+        plan.to_json(os.path.join(tmp, 'shards.json'), orient='records')
+        with open(os.path.join(tmp, 'partition.key'), 'w') as file:
+            file.write(key)
+
+        if os.path.exists(year_root):
+            # a partition that was stopped half way or whose inputs changed, the shards are written again from scratch
+            shutil.rmtree(year_root)
+        os.replace(tmp, year_root)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return plan
+
+
+def run_shard(year, shard_dir, state, org_year=None, **kwargs):
+    """
+    Classifies and matches the orgs and schools of one shard, unless the shard is already complete
+    with the same arguments.
+
+    Args:
+        year (int): The school year.
+        shard_dir (str): The directory of the shard, as written by partition_year.
+        state (str): The state of the shard.
+        org_year (int): The year of BMF and Core files, defaults to year.
+        **kwargs: Any other arguments for pto_codebook.run_year, such as cutoff or score_cache_path.
+
+    Returns:
+        str: The path of the matches of the shard.
+
+    """
+    output_root = os.path.join(shard_dir, 'matches')
+    output_path = os.path.join(output_root, f"finalmatches{year}.csv")
+    done_path = os.path.join(shard_dir, 'done')
+    key = shard_key(year, state, org_year, kwargs)
+    if os.path.exists(done_path):
+        with open(done_path) as file:
+            if file.read() == key:
+                return output_path
+        # the shard was run with other arguments, it is not complete until it runs with these
+        os.remove(done_path)
+
+    pto_codebook.run_year(year, os.path.join(shard_dir, 'bmf'), os.path.join(shard_dir, 'core'), shard_dir, output_root,
+                          org_year=org_year, state=state, **kwargs)
+
+    # the marker is only written once the matches are complete
+    def write_key(path):
+        with open(path, 'w') as file:
+            file.write(key)
+    _write_atomic(done_path, write_key)
+    return output_path
+
+
+def combine_matches(year, shard_root, output_root):
+    """
+    Combines the matches of all shards of a year into one finalmatches<year>.csv file.
+
+    Args:
+        year (int): The school year.
+        shard_root (str): The directory the shards were written to.
+        output_root (str): The directory to write the combined matches to.
+
+    Returns:
+        str: The path of the combined matches.
+
+    """
+    year_root = os.path.join(shard_root, str(year))
+    plan = pd.read_json(os.path.join(year_root, 'shards.json'), dtype={'zip3': str})
+    matches = [pd.read_csv(os.path.join(year_root, shard, 'matches', f"finalmatches{year}.csv"), index_col=0)
+               for shard in plan['shard']]
+    final_matches = pd.concat(matches, axis=0, ignore_index=True)
+
+    os.makedirs(output_root, exist_ok=True)
+    output_path = os.path.join(output_root, f"finalmatches{year}.csv")
+    _write_atomic(output_path, final_matches.to_csv)
+    return output_path
+
+
+def run_sharded(years, bmf_root, core_root, schools_root, shard_root, output_root, org_years=None, workers=None, max_shard_schools=None,
+                retries=2, **kwargs):
+    """
+    Runs the pipeline for all states and years, with the shards of all years running in parallel.
+
+    Shards that fail are run again up to retries times. Shards that are complete from an earlier
+    run are not run again, so a run that failed can be restarted with the same arguments.
+
+    Args:
+        years (list): The school years to match.
+        bmf_root (str): The directory containing one directory of BMF files per year.
+        core_root (str): The directory containing one directory of Core files per year.
+        schools_root (str): The directory containing the school files of all states.
+        shard_root (str): The directory to write the shards to.
+        output_root (str): The directory to write the combined matches to.
+        org_years (list): The year of BMF and Core files to use for each school year, defaults to years.
+        workers (int): The number of processes to use, defaults to the number of cores.
+        max_shard_schools (int): The largest number of schools in a shard, None to have one shard per state.
+        retries (int): The number of times to run a failed shard again.
+        **kwargs: Any other arguments for pto_codebook.run_year, such as cutoff or score_cache_path.
+
+    Returns:
+        dict: The path of the combined matches of each year.
+
+    Raises:
+        RuntimeError: If some shards still fail after all retries. The years whose shards all
+            completed are combined before the error is raised.
+
+    """
+    org_years = list(years) if org_years is None else list(org_years)
+    if len(org_years) != len(years):
+        raise ValueError("org_years needs one year of BMF and Core files for each school year")
+
+    tasks = {}
+    for year, org_year in zip(years, org_years):
+        plan = partition_year(year, bmf_root, core_root, schools_root, shard_root, org_year, max_shard_schools)
+        for shard, state, schools in zip(plan['shard'], plan['state'], plan['schools']):
+            tasks[(year, shard)] = (os.path.join(shard_root, str(year), shard), state, org_year, schools)
+
+    failed = {}
+    # run the largest shards first so the last ones to finish are small
+    pending = sorted(tasks, key=lambda task: -tasks[task][3])
+    for attempt in range(retries + 1):
+        failed = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_shard, year, tasks[(year, shard)][0], tasks[(year, shard)][1],
+                                       org_year=tasks[(year, shard)][2], **kwargs): (year, shard)
+                       for year, shard in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as err:
+                    failed[futures[future]] = err
+                    print(f"{futures[future][0]} {futures[future][1]}: failed on attempt {attempt + 1}: {err!r}")
+        pending = [task for task in pending if task in failed]
+        if not pending:
+            break
+
+    outputs = {}
+    for year in years:
+        if not any(failed_year == year for failed_year, _ in failed):
+            outputs[year] = combine_matches(year, shard_root, output_root)
+    if failed:
+        raise RuntimeError(f"{len(failed)} shards failed: " + ", ".join(f"{year} {shard}" for year, shard in sorted(failed)))
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Match school-linked non-profits to schools in all states, one shard at a time.")
+    parser.add_argument("--years", type=int, nargs="+", default=[2016, 2017, 2018, 2019, 2020, 2021], help="school years to match")
+    parser.add_argument("--org-years", type=int, nargs="+", help="year of BMF and Core files to use for each school year")
+    parser.add_argument("--bmf-root", required=True, help="directory with one directory of BMF files per year")
+    parser.add_argument("--core-root", required=True, help="directory with one directory of Core files per year")
+    parser.add_argument("--schools-root", required=True, help=f"directory with a schools_<year>.csv file of all states per year, with a {SCHOOL_STATE_COLUMN} column")
+    parser.add_argument("--shard-root", required=True, help="directory to write the shards to, reused when the run is restarted")
+    parser.add_argument("--output-root", required=True, help="directory to write the combined finalmatches<year>.csv files to")
+    parser.add_argument("--max-shard-schools", type=int, help="split states with more schools than this by 3 digit ZIP code")
+    parser.add_argument("--workers", type=int, help="number of processes, defaults to the number of cores")
+    parser.add_argument("--retries", type=int, default=2, help="number of times to run a failed shard again")
+    parser.add_argument("--cutoff", type=float, default=0.7, help="smallest similarity score of a good match")
+    parser.add_argument("--score-cache", help="SQLite file to keep name and address scores in across shards, years and runs")
+    parser.add_argument("--profile", type=int, choices=[0, 1, 2], default=0, help="write a manifest<year>.json of each shard, see pto_codebook.py")
+    parser.add_argument("--panel-output", help="path to write the panel of all years and states to")
+    args = parser.parse_args()
+
+    outputs = run_sharded(args.years, args.bmf_root, args.core_root, args.schools_root, args.shard_root, args.output_root,
+                          org_years=args.org_years, workers=args.workers, max_shard_schools=args.max_shard_schools,
+                          retries=args.retries, cutoff=args.cutoff, score_cache_path=args.score_cache, profile=args.profile)
+    for year, output_path in outputs.items():
+        print(f"{year}: {output_path}")
+    if args.panel_output:
+        panel.build_final_panel(args.years, args.output_root, args.schools_root).to_csv(args.panel_output)
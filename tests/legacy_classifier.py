@@ -0,0 +1,137 @@
+"""
+
+CRF 2023 - Team PTO
+
+The original row by row classifier loop of filter_data, kept as the reference the tests check
+classify_orgs against. It is not used by the pipeline.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from pto_codebook import classify_orgs
+
+
+def classify_orgs_legacy(names):
+    """
+    Categorizes organization names with the original row by row loop of filter_data, copied as it
+    was with its own rule arrays. This is the reference classify_orgs is checked against.
+
+    Args:
+        names (pandas.Series): The upper case organization names.
+
+    Returns:
+        pandas.Series: The organization code of each name, indexed like names.
+
+    """
+    df_orgs = pd.DataFrame({'NAME': names.values})
+
+    # In the original file, 4 and 6 are recoded to boosters, 5, 8, 9, 10, 11, 12 are recoded as other
+
+    # array to store possible explicit terms for a PTA
+    pta_names = np.array(["PTA ", " PTA", "P T A", "PTA-", "PTSA", "P T S A", "PARENT TEACHER ASSOCIATION", "PARENT-TEACHER ASSOCIATION", "PARENT-TEACHER ASS", 
+    "PARENT TEACHER ASS", "PARENT TEACHER STUDENT ASSOCIATION", "PARENT AND TEACHER ASSOCIATION", "PARENTS AND TEACHERS ASSOCIATION", 
+    "PARENTS TEACHERS ASSOCIATION", "PARENT & TEACHER ASSOCIATION", "PARENT TEACHERS ASSOCIATION", "PARENT- TEACHERS ASSOCIATION", 
+    "PARENT- TEACHER ASSOCIATION", "PARENT-TEACHERS ASSOCIATION", "PARENTS-TEACHERS ASSOCIATION", "PARENT-TEACHER- STUDENT ASSOCIATION", 
+    "PARENT- TEACHER-STUDENT ASSOCIATION", "PARENT TEACHER STUDENT ASSOCIATON", "PARENTS TEACHERS AND STUDENTS ASSOC", "PARENTS TEACHERS & STUDENTS ASSO", 
+    "PARENT-TEACHER-STUDENT ASSOCIATION", "PARENT-TEACHER STUDENT ASSOCIATION", "PARENT TEACHER STUDENT ASS", "PARENT TEACHERS STUDENT ASSOCIATION", 
+    "PARENTS & TEACHERS ASSN", "PARENT & TEACHERS ASSOC", "PARENT AND TEACHERS ASSOCATION", "PARENT TEACHERS ASSN", "PARENT TEACHERS ASSO", "PARENTS TEACHERS ASSOC", 
+    "PARENT-TEACHERS ASSN", "PARENTS TEACHER ASSOCIATION", "PARENT TEACHERS ASS", "PARENTS & TEACHERS ASSOCIATION", "PARENT TEACHER AND STUDENT ASSOC", "PARENT & TEACHER ASSOC", "PARENT TEACHER FELLOWSHIP"])
+
+    # array to store possible explicit terms for a PTO
+    pto_names = np.array(["PTO "," PTO","P T O","PTO-","-PTO","PTSO","P T S O","PTO "," PTO",
+                        "P T O","-PTO", "PTSO", "SUNDANCE PARENTS ASSOCIATION", "LULING PARENTEACHER BOOSTERS", 
+                        "BEVERLEY MANOR ELEMENTARY PARENT TEACHER BOOSTER CLUB"])
+
+    # array to store possible occurences of words in any order to indicate a PTO
+    pto_terms = np.array([["PARENT","TEACHER", "ORG"],["PARENTS","TEACHER", "ORG"],
+                        ["PARENT","TEACHER", " ORG"],["PARENT","TEACH", " ORG"],["PARENT","TEACH"," ASS"],
+                        ["PARENT","STAFF"," ORG"],["PARENT","SCHOOL"," ORG"],["PARENT","SCHOOL"," ORG"],
+                        ["PARENT","FACUL"," ORG"]])
+
+    # array to store possible explicit terms for arts and sports boosters 
+    booster_names = np.array(["BOOSTER CLUB", "BOOSTERS CLUB", "BAND BOOSTER", "MUSIC BOOSTER", "BAND", "MUSIC", "MARCHING", "CHOIR", "SPIRIT", "DANCE", "FIRST FLIGHT HIGH SCHOOL FINE ARTS BOOSTERS", 
+    "MINT HILL MIDDLE SCHOOL PERFORMING ARTS BOOSTER CLUB", "PANTHER CREEK HIGH SCHOOL FINE ARTS BOOSTER CLUB", "HOLLY SPRINGS HIGH SCHOOL FINE ARTS BOOSTERS INC", 
+    "CRESTDALE MIDDLE SCHOOL ARTS BOOSTERS INC", "GREEN HOPE HIGH SCHOOL FINE ARTS BOOSTERS", "CARY HIGH SCHOOL PERFORMING ARTS BOOSTER CLUB", 
+    "LEESVILLE ROAD HIGH SCHOOL PERFORMING ARTS BOOSTERS", "CLAYTON HIGH SCHOOL PERFORMING ARTS BOOSTER CLUB", "SOUTH CHARLOTTE MIDDLE SCHOOL FINE ARTS NETWORK", 
+    "NORTHEAST MIDDLE SCHOOL PERFORMING ARTS BOOSTER CLUB", "EAST MECK ART BOOSTERS", "ATHLETIC BOOSTER", "FOOTBALL BOOSTER", " SPORTS BOOSTER", "ATHLETIC", 
+    "QUARTERBACK CLUB", "SOCCER", "SWIM", "GYMNAST", "FOOTBALL", "TOUCHDOWN", "CHEER", "CREW", " SPORT", "PARENT BOOSTER", "BOOSTER ASSOCIATION", "MILE-HIGH DIVING TEAM BOOSTER CLUB", 
+    "CREW BOOSTERS OF WINTER PARK INC", "CREW BOOSTERS CLUB OF CENTRAL FLORIDA INC", "LAKE ZURICH POM BOOSTER CLUB", "ICE ATHLETICS BOOSTERS CLUB INC", "LAKES CROSS-COUNTRY BOOSTER CLU", 
+    "J J PEARCE PACESETTER BOOSTER CLUB", "HARMONY HIGH BALLROOM BOOSTERS INC", "YORBA LINDA MIDDLE SCHOOL INSTRUCTIONAL MUCIC BOOSTER CLUB", "BOOSTER ASSOCIATION FOR STRING STUDENTS", 
+    "FORT MADISON VOCAL BOOSTERS INC", "MERIDIAN MARCHING UNIT BOOSTERS", "FRIENDS OF BEETHOVEN BOOSTER CLUB", "CASTILLERO VOCAL BOOSTER CLUB 6384 LEYLAND PARK DR"])
+
+    # array to store possible occurences of words in any order to indicate arts and sports boosters 
+    booster_terms = np.array([["SCHOOL", "BAND"], ["SCHOOL", "MUSIC"], ["SCHOOL", "CHOIR"], ["SCHOOL", "CHORAL"],
+    ["SCHOOL", "THEATER"], ["SCHOOL", "THEATRE"], ["SCHOOL", "DRAMA"], ["SCHOOL", "DANCE"], ["BAND", "HIGH"], ["CHORAL", "HIGH"],
+    ["DRAMA", "HIGH"], ["BAND", "HS "], ["PARENT", "GYMNAST"], ["PARENT", " SPORT"], ["PARENT", "CHEER"], ["SCHOOL", "ATHLETIC BOOSTER"],
+    ["SCHOOL", "QUARTERBACK CLUB"], ["SCHOOL", "LACROSSE"], ["SCHOOL", "CHEER"], ["SCHOOL", "VOLLEYBALL"], ["SCHOOL", "ATHLETIC"], 
+    ["HIGH", "ATHLETIC BOOSTER"], ["HIGH", "ATHLETIC"], ["HS ", "ATHLETIC BOOSTER"], [ "HS ", "CHEER"], ])
+
+    # array to store possible explicit terms for other school-linked organizations 
+    other_names = np.array(["NEWPORT HARBOR HIGH SCHOOL AQUATIC BOOSTER CLUB", "FOUNTAIN VALLEY HIGH SCHOOL GIRLS VALLEYBALL BOOSTERS", "LINCOLN HIGH HOMEPLATE CLUB INC HIGH SCHOOL BOOSTER ORGANIZA", 
+    "KENNESAW MOUNTAIN HIGH SCHOOL LACROSS BOOSTER CLUB", "CHAMPAIGN CENTRAL HIGH SCHOOL BASEB ALL BOOSTERS", "AG BOOSTER", "AGRICULTURE BOOSTER", "SPEECH AND DEBATE BOOSTER", "TECHNOLOGY BOOSTER", 
+    "INTERNATIONAL BACCALAUREATE BOOSTER", "COMMUNITY COUNCIL", "PARTNERS IN EDUCATION", "EDUCATIONAL SUPPORT", "SCHOOL SUPPORT", "SCHOOL FOUNDATION", "PARENT"])
+
+    # array to store possible occurences of words in any order to indicate other school-linked organizations
+    other_terms = np.array([["SCHOOL", "FOUNDATION"], ["FRIENDS OF", "HIGH"], ["FRIENDS OF", "HS"], ["FRIENDS OF", "ELEM"], ["FRIENDS OF", "SCHOOL"]])
+
+    # array to store terms that need to be dropped from the dataset
+    drop_names = np.array(["HOME SCHOOL", "HOME AND SCHOOL", "LESBIANS AND GAYS", "LESBIANS & GAYS"])
+    
+    # function to check if a given string contains all the words in a given array 
+    def contain_terms(text, words):
+        return all(word in text for word in words)
+
+    # initialize all organization codes to 0 before categorizing
+    df_orgs['ORG CODE'] = 0
+    
+    # variable to keep track of each row
+    row_counter = 0 
+    # iterate through each organization name in the dataframe
+    for org_name in df_orgs['NAME']:
+        # identify orgs that need to be immediately dropped and mark it as 0 
+        if any(word in org_name for word in drop_names):
+            df_orgs.loc[row_counter,'ORG CODE'] = 0
+        # identifying and categorizing PTAs 
+        if any(word in org_name for word in pta_names):
+            df_orgs.loc[row_counter,'ORG CODE'] = 1
+        # identifying and categorizing PTOs 
+        elif any(word in org_name for word in pto_names):
+            df_orgs.loc[row_counter,'ORG CODE'] = 2
+        elif any(contain_terms(org_name,words) for words in pto_terms):
+            df_orgs.loc[row_counter,'ORG CODE'] = 2
+        # identifying and categorizing boosters 
+        elif any(word in org_name for word in booster_names):
+            df_orgs.loc[row_counter,'ORG CODE'] = 3
+        elif any(contain_terms(org_name,words) for words in booster_terms):
+            df_orgs.loc[row_counter,'ORG CODE'] = 3
+        # identifying and categorizing other school-linked non-profits
+        elif any(word in org_name for word in other_names):
+            df_orgs.loc[row_counter,'ORG CODE'] = 4
+        elif any(contain_terms(org_name,words) for words in other_terms):
+            df_orgs.loc[row_counter,'ORG CODE'] = 4
+        # if the org doesn't fall into any category, we mark it as 0
+        else:
+            #dataFrame = dataFrame.drop(row_counter)
+            df_orgs.loc[row_counter,'ORG CODE'] = 0
+
+        row_counter += 1 # continue iterating through each row
+
+    return pd.Series(df_orgs['ORG CODE'].values, index=names.index)
+
+
+def check_classifier_parity(names):
+    """
+    Compares classify_orgs against the original row by row loop of filter_data.
+
+    Args:
+        names (pandas.Series): The upper case organization names to compare on.
+
+    Returns:
+        pandas.DataFrame: The names where the two classifiers disagree, empty if they agree everywhere.
+
+    """
+    names = names.fillna('').astype(str)
+    result = pd.DataFrame({'NAME': names, 'ORG CODE': classify_orgs(names), 'LEGACY CODE': classify_orgs_legacy(names)})
+    return result[result['ORG CODE'] != result['LEGACY CODE']]
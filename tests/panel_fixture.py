@@ -0,0 +1,79 @@
+"""
+
+CRF 2023 - Team PTO
+
+Writes small school rosters and yearly matches in the layout of the pipeline outputs, for the
+tests of the panel, its schema and the lifecycle. From 2020 on, the school IDs are 12-digit NCES
+IDs like in the real rosters.
+
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+LEVELS = ["Primary", "Middle", "High"]
+
+
+def raw_school_id(school, year):
+    return 370000000000 + school if year >= 2020 else school
+
+
+def write_years(root, years=(2019, 2020, 2021), n_schools=30, n_orgs=40, seed=0):
+    """
+    Writes schools_<year>.csv and finalmatches<year>.csv for each year to root.
+
+    Each org is matched to one school in most years. Some orgs skip a year, move to another school or
+    change their Org_code, and some schools have no match at all.
+
+    Returns:
+        str: The root.
+
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    schools = pd.DataFrame({
+        'school': 1000 + np.arange(n_schools),
+        'leaid': 3700000 + np.arange(n_schools) % 4,
+        'school_name': [f"School {i} {LEVELS[i % 3]}" for i in range(n_schools)],
+        'street_location': [f"{100 + i} MAIN ST" for i in range(n_schools)],
+        'zip_location': 27000 + np.arange(n_schools),
+        'school_level': [LEVELS[i % 3] for i in range(n_schools)],
+    })
+    # orgs start at a school with a code, the first schools are left without orgs
+    org_school = rng.integers(3, n_schools, n_orgs)
+    org_code = rng.integers(1, 5, n_orgs)
+
+    for year in years:
+        roster = schools.assign(school_id=raw_school_id(schools['school'], year), year=year)
+        roster.drop(columns='school').to_csv(os.path.join(root, f"schools_{year}.csv"), index=False)
+
+        # a few orgs move or are reclassified each year, and some are not matched in a year
+        moved = rng.random(n_orgs) < 0.1
+        org_school = np.where(moved, rng.integers(3, n_schools, n_orgs), org_school)
+        org_code = np.where(rng.random(n_orgs) < 0.1, rng.integers(1, 5, n_orgs), org_code)
+        present = rng.random(n_orgs) < 0.85
+        matched = schools.set_index('school').loc[1000 + org_school[present]]
+        score = rng.uniform(0.7, 1.0, present.sum())
+        matches = pd.DataFrame({
+            'level_0': np.flatnonzero(present),
+            'level_1': org_school[present],
+            'Name_Score': score,
+            'Address_Score': 0.0,
+            'Zip_Score': 0.0,
+            'Total_Score': score,
+            'EIN': 560000000 + np.flatnonzero(present),
+            'Organization_Name': [f"org {i} pta" for i in np.flatnonzero(present)],
+            'Org_code': org_code[present],
+            'School_Name': matched['school_name'].str.lower().values,
+            'schID': raw_school_id(matched.index.values, year),
+            'leaID': matched['leaid'].values,
+            'Organization_Street': "1 elm st",
+            'School_Street': matched['street_location'].str.lower().values,
+            'School_level': matched['school_level'].str.lower().values,
+            'Revenue': np.where(rng.random(present.sum()) < 0.2, np.nan, rng.integers(1000, 500000, present.sum()).astype(float)),
+            'Match_Parameter': 'name',
+        })
+        matches.to_csv(os.path.join(root, f"finalmatches{year}.csv"))
+    return root
@@ -0,0 +1,68 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that the blocked candidate pairs of round 1 keep every match of the full index, on the small
+synthetic files of benchmark.py.
+
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import benchmark
+from pto_codebook import block_pairs, blocking_report, exact_matches, filter_bad_matches, matching_process, prepare_orgs, prepare_schools, zip_key
+
+
+def sorted_matches(matches):
+    return matches.sort_values(['level_0', 'level_1']).reset_index(drop=True)
+
+
+class BlockingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        paths = benchmark.generate(cls.root, 'small', 2019, seed=1)
+        df_orgs, df_orgs_copy, df_withpo = prepare_orgs(paths['bmf'], paths['core'])
+        cls.df_schools = prepare_schools(paths['schools'])
+        # the rounds only see the orgs that the exact matches leave over, as in find_matches
+        _, df_orgs, df_withpo = exact_matches(df_orgs, cls.df_schools, df_withpo)
+        cls.orgs = (df_orgs, df_orgs_copy, df_withpo)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def test_zip5_pairs_are_the_full_pairs_with_the_same_zip(self):
+        df_orgs = self.orgs[0]
+        full = block_pairs(df_orgs, self.df_schools, 'full')
+        same_zip = (zip_key(df_orgs['ZIP_final']).loc[full.get_level_values(0)].values
+                    == zip_key(self.df_schools['zip_location']).loc[full.get_level_values(1)].values)
+        expected = set(full[same_zip])
+        self.assertTrue(expected)
+        self.assertEqual(set(block_pairs(df_orgs, self.df_schools, 'zip5')), expected)
+
+    def test_round1_matches_equal_the_full_index(self):
+        df_orgs, df_orgs_copy, df_withpo = self.orgs
+        full1, full2 = matching_process(df_orgs, self.df_schools, df_orgs_copy, df_withpo, round1_blocking='full', round2_blocking='full')
+        zip1, zip2 = matching_process(df_orgs, self.df_schools, df_orgs_copy, df_withpo, round1_blocking='zip5', round2_blocking='full')
+        self.assertFalse(full1.empty)
+        pd.testing.assert_frame_equal(sorted_matches(zip1), sorted_matches(full1))
+        # round 2 gets the same unmatched orgs, so the good matches of both rounds are the same
+        pd.testing.assert_frame_equal(sorted_matches(filter_bad_matches(pd.merge(zip1, zip2, how='outer'))),
+                                      sorted_matches(filter_bad_matches(pd.merge(full1, full2, how='outer'))))
+
+    def test_report_recall(self):
+        report = blocking_report(*self.orgs[:1], self.df_schools, *self.orgs[1:], strategies=['full', 'zip5', 'ngram'])
+        report = report.set_index(['Round', 'Strategy'])
+        self.assertEqual(report.loc[(1, 'zip5'), 'Recall'], 1.0)
+        self.assertEqual(report.loc[(2, 'full'), 'Recall'], 1.0)
+        self.assertLess(report.loc[(2, 'ngram'), 'Pairs'], report.loc[(2, 'full'), 'Pairs'])
+
+
+if __name__ == "__main__":
+    unittest.main()
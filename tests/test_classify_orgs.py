@@ -0,0 +1,51 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that the column-at-once classifier gives the same organization codes as the original row
+by row loop of filter_data. Run from the repository root with python -m unittest discover tests.
+
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from legacy_classifier import check_classifier_parity, classify_orgs_legacy
+from pto_codebook import (BOOSTER_NAMES, BOOSTER_TERMS, DROP_NAMES, OTHER_NAMES, OTHER_TERMS, PTA_NAMES, PTO_NAMES, PTO_TERMS,
+                          classify_orgs)
+
+
+def synthetic_names(n=3000, seed=0):
+    """
+    Builds org names out of the words of every rule list, the drop list and filler words, so that
+    names fall into several categories, onto the drop list or into no category at all.
+    """
+    rng = np.random.default_rng(seed)
+    words = PTA_NAMES + PTO_NAMES + BOOSTER_NAMES + OTHER_NAMES + DROP_NAMES
+    words += [word for terms in PTO_TERMS + BOOSTER_TERMS + OTHER_TERMS for word in terms]
+    words += ["MILL CREEK", "PINE RIDGE", "ELEMENTARY", "INC", "OF", "SCHOOL", "CLUB", "CHESS", "SCIENCE"]
+    sizes = rng.integers(1, 5, n)
+    return pd.Series([' '.join(rng.choice(words, size)) for size in sizes])
+
+
+class ClassifyOrgsTest(unittest.TestCase):
+
+    def test_parity_with_original_loop(self):
+        names = synthetic_names()
+        mismatches = check_classifier_parity(names)
+        self.assertTrue(mismatches.empty, mismatches.head(10).to_string())
+
+    def test_drop_list_keeps_category_by_default(self):
+        names = pd.Series(["HOME SCHOOL PARENT-TEACHERS ASSOCIATION", "HOME SCHOOL CHESS", "MILL CREEK PTO"])
+        self.assertEqual(classify_orgs_legacy(names).tolist(), [1, 0, 2])
+        self.assertEqual(classify_orgs(names).tolist(), [1, 0, 2])
+
+    def test_drop_flag_overrides_category(self):
+        names = pd.Series(["HOME SCHOOL PARENT-TEACHERS ASSOCIATION", "MILL CREEK PTO"])
+        self.assertEqual(classify_orgs(names, drop=True).tolist(), [0, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
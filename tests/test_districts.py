@@ -0,0 +1,100 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the district rollups against the same measures computed one district at a time with
+pandas, for the wide and the long layouts, and the refresh of a single year of the rollup files.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from districts import DISTRICT_PERCENTILES, ORG_CODE_COUNTS, district_rollup, read_rollup, write_rollup
+from panel import build_final_panel, build_long_final_panel
+from panel_fixture import write_years
+from panel_index import panel_links, panel_school_years
+from schema import PANEL_SCHEMA, apply_schema
+
+
+YEARS = [2019, 2020, 2021]
+
+
+def reference_rollup(panel):
+    """
+    Computes the rollups of a wide panel one district and year at a time.
+    """
+    schools = panel_school_years(panel)
+    links = panel_links(panel)
+    rows = []
+    for (lea, year), group in schools.groupby(['leaID', 'Year']):
+        rev = np.sort(group['TotRev'].astype(float).fillna(0.0).to_numpy())
+        n = len(rev)
+        group_links = links[(links['leaID'] == lea) & (links['Year'] == year)]
+        row = {'leaID': lea, 'Year': year, 'Schools': n, 'SchoolsWithOrgs': group_links['schID'].nunique(),
+               'Orgs': len(group_links), 'TotRev': rev.sum(), 'MeanRev': rev.mean()}
+        for col, code in ORG_CODE_COUNTS.items():
+            row[col] = (group_links['Org_code'] == code).sum()
+        for q in DISTRICT_PERCENTILES:
+            row[f'P{q}Rev'] = pd.Series(rev).quantile(q / 100)
+        # mean absolute difference over all pairs, divided by twice the mean
+        row['Gini'] = np.abs(rev[:, None] - rev[None, :]).sum() / (2 * n * n * rev.mean())
+        top = max(int(np.ceil(n / 10)), 1)
+        row['TopDecileShare'] = rev[-top:].sum() / rev.sum()
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+class DistrictRollupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = write_years(tempfile.mkdtemp(), YEARS)
+        cls.panel = apply_schema(build_final_panel(YEARS, cls.root, cls.root), PANEL_SCHEMA)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def test_rollup_equals_the_reference(self):
+        rollup = district_rollup(self.panel)
+        expected = reference_rollup(self.panel)
+        self.assertEqual(len(rollup), 4 * len(YEARS))
+        for col in expected.columns:
+            np.testing.assert_allclose(rollup[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float), err_msg=col)
+        self.assertTrue(np.allclose(rollup['ShareWithOrgs'], rollup['SchoolsWithOrgs'] / rollup['Schools']))
+
+    def test_hand_built_district(self):
+        panel = pd.DataFrame({'schID': [1, 2, 3, 4], 'Year': 2020, 'leaID': 7, 'TotRev': [np.nan, 0.0, 10.0, 30.0],
+                              'EIN1': [pd.NA, 5, 6, 7], 'Org_code1': [pd.NA, 1, 2, 2], 'Org_name1': None, 'Rev1': np.nan})
+        row = district_rollup(panel).iloc[0]
+        self.assertEqual((row['Schools'], row['SchoolsWithOrgs'], row['PTAorgs'], row['PTOorgs']), (4, 3, 1, 2))
+        self.assertAlmostEqual(row['P50Rev'], 5.0)
+        self.assertAlmostEqual(row['Gini'], 0.625)
+        self.assertAlmostEqual(row['TopDecileShare'], 0.75)
+
+    def test_long_layout_gives_the_same_rollup(self):
+        long_panel, school_years = build_long_final_panel(YEARS, self.root, self.root)
+        pd.testing.assert_frame_equal(district_rollup(long_panel, school_years), district_rollup(self.panel))
+
+    def test_refresh_of_one_year(self):
+        root = os.path.join(self.root, 'districts')
+        write_rollup(self.panel, root)
+        changed = self.panel.copy()
+        changed.loc[changed['Year'] == 2020, 'TotRev'] = 1.0
+        write_rollup(changed, root, years=[2020])
+        back = read_rollup(root)
+        expected = district_rollup(self.panel)
+        kept = back['Year'] != 2020
+        pd.testing.assert_frame_equal(back[kept].reset_index(drop=True), expected[kept.to_numpy()].reset_index(drop=True))
+        self.assertTrue((back.loc[~kept, 'MeanRev'] == 1.0).all())
+        self.assertEqual(list(read_rollup(root, years=[2021], columns=['leaID', 'Gini']).columns), ['leaID', 'Year', 'Gini'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the exact matching stage on a few hand-built orgs and schools: address hits, name stem hits,
+stems shared by several schools, stems of schools in another ZIP area and PO box orgs.
+
+"""
+
+import unittest
+
+import pandas as pd
+
+from pto_codebook import exact_matches
+
+
+def schools_frame():
+    """
+    Builds four formatted schools, two of them named Smith in different ZIP areas and two Oak Ridge
+    schools in the same ZIP area.
+    """
+    return pd.DataFrame({
+        'school_id': [1, 2, 3, 4],
+        'leaid': [10, 10, 20, 10],
+        'school_name': ["mill creek elementary", "smith elementary", "oak ridge elementary", "oak ridge middle"],
+        'street_location': ["100 main street", "5 elm road", "9 pine avenue", "12 oak drive"],
+        'zip_location': [27501, 27502, 28801, 27503],
+        'school_level': ["primary", "primary", "primary", "middle"],
+    })
+
+
+def orgs_frame(rows, start=0):
+    """
+    Builds formatted orgs from (name, address, zip) rows, indexed from start.
+    """
+    df_orgs = pd.DataFrame(rows, columns=['NAME_final', 'ADDRESS_final', 'ZIP_final'])
+    df_orgs.index = range(start, start + len(df_orgs))
+    df_orgs['EIN'] = 560000000 + df_orgs.index
+    df_orgs['ORG CODE_x'] = 1
+    df_orgs['TOTREV'] = 1000.0
+    return df_orgs
+
+
+def matched_schools(matches):
+    return dict(zip(matches['level_0'], zip(matches['schID'], matches['Match_Parameter'])))
+
+
+class ExactMatchesTest(unittest.TestCase):
+
+    def test_address_hit(self):
+        df_orgs = orgs_frame([("unrelated booster club", "100 Main St", 27501)])
+        matches, rest, rest_po = exact_matches(df_orgs, schools_frame(), orgs_frame([], start=1))
+        self.assertEqual(matched_schools(matches), {0: (1, 'exact address')})
+        self.assertTrue(rest.empty and rest_po.empty)
+
+    def test_stem_hit_in_same_zip_area(self):
+        df_orgs = orgs_frame([("smith elementary pta", "1 other rd", 27599)])
+        matches, rest, _ = exact_matches(df_orgs, schools_frame(), orgs_frame([], start=1))
+        self.assertEqual(matched_schools(matches), {0: (2, 'exact name')})
+        self.assertTrue(rest.empty)
+
+    def test_stem_in_other_zip_area_is_left_to_the_rounds(self):
+        df_orgs = orgs_frame([("smith pta", "1 other rd", 28805)])
+        matches, rest, _ = exact_matches(df_orgs, schools_frame(), orgs_frame([], start=1))
+        self.assertTrue(matches.empty)
+        self.assertEqual(rest.index.tolist(), [0])
+
+    def test_ambiguous_stem_is_left_to_the_rounds(self):
+        # two oak ridge schools share the 275 ZIP area when the level does not tell them apart
+        df_schools = schools_frame()
+        df_schools.loc[2, 'zip_location'] = 27504
+        df_orgs = orgs_frame([("oak ridge pto", "1 other rd", 27599), ("oak ridge middle pto", "1 other rd", 27599)])
+        matches, rest, _ = exact_matches(df_orgs, df_schools, orgs_frame([], start=2))
+        self.assertEqual(matched_schools(matches), {1: (4, 'exact name')})
+        self.assertEqual(rest.index.tolist(), [0])
+
+    def test_po_box_orgs_are_only_matched_by_name(self):
+        df_orgs = orgs_frame([], start=0)
+        df_po = orgs_frame([("mill creek elem pta", "5 elm road", 27502), ("chess club", "100 main street", 27501)])
+        matches, _, rest_po = exact_matches(df_orgs, schools_frame(), df_po)
+        self.assertEqual(matched_schools(matches), {0: (1, 'exact name')})
+        self.assertEqual(rest_po.index.tolist(), [1])
+
+    def test_scores_of_exact_matches(self):
+        df_orgs = orgs_frame([("smith elementary pta", "1 other rd", 27599), ("unrelated booster club", "100 Main St", 27501)])
+        matches, _, _ = exact_matches(df_orgs, schools_frame(), orgs_frame([], start=2))
+        self.assertEqual(matches['Zip_Score'].tolist(), [0.0, 1.0])
+        # the scores are taken on the raw streets, not the canonical address keys
+        self.assertGreater(matches['Address_Score'].iloc[1], 0.7)
+
+
+if __name__ == "__main__":
+    unittest.main()
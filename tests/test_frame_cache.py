@@ -0,0 +1,80 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that the frame cache reuses an entry only while its input files and parameters are the same,
+and evicts the least recently used entries over its size limit.
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from frame_cache import FrameCache
+
+
+class FrameCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.input = os.path.join(self.root, 'orgs.csv')
+        pd.DataFrame({'EIN': [1, 2], 'NAME': ["A PTA", "B PTO"]}).to_csv(self.input, index=False)
+        self.cache = FrameCache(os.path.join(self.root, 'cache'))
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self, path):
+        self.calls += 1
+        df = pd.read_csv(path)
+        return df, df[df['NAME'].str.contains('PTA')]
+
+    def test_hit_and_miss(self):
+        first = self.cache.cached('read', [self.input], {'cutoff': 0.7}, self.read, self.input)
+        second = self.cache.cached('read', [self.input], {'cutoff': 0.7}, self.read, self.input)
+        self.assertEqual(self.calls, 1)
+        self.assertIsInstance(second, tuple)
+        for a, b in zip(first, second):
+            pd.testing.assert_frame_equal(a, b)
+
+        # other parameters or new file contents are a miss
+        self.cache.cached('read', [self.input], {'cutoff': 0.8}, self.read, self.input)
+        self.assertEqual(self.calls, 2)
+        pd.DataFrame({'EIN': [3], 'NAME': ["C PTA"]}).to_csv(self.input, index=False)
+        third = self.cache.cached('read', [self.input], {'cutoff': 0.7}, self.read, self.input)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(third[0]['EIN'].tolist(), [3])
+
+    def test_directory_key_follows_its_csv_files(self):
+        key = self.cache.key('read', [self.root])
+        self.assertEqual(self.cache.key('read', [self.root]), key)
+        with open(os.path.join(self.root, 'notes.txt'), 'w') as file:
+            file.write("not an input")
+        self.assertEqual(self.cache.key('read', [self.root]), key)
+        pd.DataFrame({'EIN': [4]}).to_csv(os.path.join(self.root, 'more.csv'), index=False)
+        self.assertNotEqual(self.cache.key('read', [self.root]), key)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        frame = pd.DataFrame({'value': range(1000)})
+        self.cache.put('a', frame)
+        size = self.cache.entries()['bytes'].iloc[0]
+        self.cache.max_bytes = 2 * size
+        time.sleep(0.01)
+        self.cache.put('b', frame)
+        time.sleep(0.01)
+        # reading a makes b the least recently used entry
+        self.assertIsNotNone(self.cache.get('a'))
+        time.sleep(0.01)
+        self.cache.put('c', frame)
+        self.assertEqual(sorted(self.cache.entries()['key']), ['a', 'c'])
+        self.assertIsNone(self.cache.get('b'))
+
+
+if __name__ == "__main__":
+    unittest.main()
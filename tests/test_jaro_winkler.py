@@ -0,0 +1,75 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that the batched Jaro-Winkler kernel gives exactly the scores of jellyfish, which recordlinkage
+uses for its jarowinkler comparator, and that the pairs skipped by a threshold cannot reach it.
+
+"""
+
+import unittest
+
+import jellyfish
+import numpy as np
+
+from jaro_winkler import jaro_winkler
+
+
+def random_pairs(alphabet, n=5000, max_length=12, seed=0):
+    """
+    Builds n pairs of random strings over alphabet, with the second strings partly copied from the
+    first so that many pairs share characters and prefixes.
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(alphabet))
+    s1 = [''.join(rng.choice(letters, rng.integers(0, max_length + 1))) for _ in range(n)]
+    s2 = []
+    for value in s1:
+        other = ''.join(rng.choice(letters, rng.integers(0, max_length + 1)))
+        s2.append(value[:rng.integers(0, len(value) + 1)] + other if rng.random() < 0.5 else other)
+    return np.array(s1, dtype=object), np.array(s2, dtype=object)
+
+
+def reference(s1, s2):
+    return np.array([jellyfish.jaro_winkler_similarity(a, b) if a and b else 0.0 for a, b in zip(s1, s2)])
+
+
+class JaroWinklerTest(unittest.TestCase):
+
+    def assert_same_scores(self, s1, s2, **kwargs):
+        np.testing.assert_array_equal(jaro_winkler(s1, s2, **kwargs), reference(s1, s2))
+
+    def test_ascii_pairs(self):
+        self.assert_same_scores(*random_pairs("abcde fgh"))
+
+    def test_unicode_pairs(self):
+        # characters that need two and four bytes per code point
+        self.assert_same_scores(*random_pairs("aeé漢字ü🙂 "))
+
+    def test_small_batches_and_threads(self):
+        self.assert_same_scores(*random_pairs("abcdef", n=2000), batch_size=97, workers=3)
+
+    def test_empty_and_missing_strings(self):
+        s1 = np.array(["", "abc", None, "", None, "abc"], dtype=object)
+        s2 = np.array(["", "", "abc", "abc", None, "abc"], dtype=object)
+        np.testing.assert_array_equal(jaro_winkler(s1, s2), [0.0, 0.0, 0.0, 0.0, 0.0, 1.0])
+
+    def test_single_string_against_many(self):
+        _, s2 = random_pairs("mill creek", n=500)
+        np.testing.assert_array_equal(jaro_winkler("mill creek elementary", s2),
+                                      [jellyfish.jaro_winkler_similarity("mill creek elementary", b) if b else 0.0 for b in s2])
+
+    def test_threshold_only_skips_pairs_below_it(self):
+        s1, s2 = random_pairs("abcdefg", n=10000)
+        expected = reference(s1, s2)
+        for threshold in [0.5, 0.7, 0.9]:
+            scores = jaro_winkler(s1, s2, threshold=threshold)
+            skipped = np.isnan(scores)
+            self.assertTrue(skipped.any())
+            # every skipped pair is below the threshold and every other pair has its exact score
+            self.assertTrue((expected[skipped] < threshold).all())
+            np.testing.assert_array_equal(scores[~skipped], expected[~skipped])
+
+
+if __name__ == "__main__":
+    unittest.main()
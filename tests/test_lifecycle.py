@@ -0,0 +1,92 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the org and school transitions of lifecycle.py on a few hand-built matches, and that the
+yearly matches are read with one row per organization and year.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from lifecycle import build_lifecycle, org_lifecycles, org_transitions, read_year_matches, school_transitions
+from panel_fixture import write_years
+
+
+def hand_matches():
+    """
+    Org 1 is matched to school 10 in 2016 and 2017, skips 2018 and is matched to school 11 as a PTO
+    in 2019 without a revenue. Org 2 is only matched in 2017.
+    """
+    return pd.DataFrame({
+        'EIN': [1, 1, 1, 2],
+        'Year': [2016, 2017, 2019, 2017],
+        'schID': [10, 10, 11, 11],
+        'leaID': [5, 5, 5, 5],
+        'Org_code': [1, 1, 2, 3],
+        'Revenue': [100.0, 150.0, np.nan, 50.0],
+    })
+
+
+def values(col):
+    return col.astype(object).where(col.notna(), None).tolist()
+
+
+class LifecycleTest(unittest.TestCase):
+
+    def test_org_transitions(self):
+        transitions = org_transitions(hand_matches())
+        self.assertEqual(values(transitions['Prev_Year']), [None, 2016, 2017, None])
+        self.assertEqual(values(transitions['Gap_Years']), [None, 0, 1, None])
+        self.assertEqual(transitions['School_Changed'].tolist(), [False, False, True, False])
+        self.assertEqual(transitions['Reclassified'].tolist(), [False, False, True, False])
+        self.assertEqual(values(transitions['Rev_Delta']), [None, 50.0, None, None])
+        self.assertEqual(transitions['First_Seen'].tolist(), [True, False, False, True])
+        self.assertEqual(transitions['Last_Seen'].tolist(), [False, False, True, True])
+
+    def test_org_lifecycles(self):
+        lifecycles = org_lifecycles(org_transitions(hand_matches())).set_index('EIN')
+        self.assertEqual(lifecycles.loc[1, ['First_Year', 'Last_Year', 'Years_Seen', 'Gap_Years', 'Gaps', 'School_Changes', 'Reclassifications']].tolist(),
+                         [2016, 2019, 3, 1, 1, 1, 1])
+        self.assertEqual(lifecycles.loc[1, ['First_schID', 'Last_schID', 'First_Org_code', 'Last_Org_code']].tolist(), [10, 11, 1, 2])
+        self.assertTrue(pd.isna(lifecycles.loc[1, 'Rev_Change']))
+        self.assertEqual(lifecycles.loc[2, ['Years_Seen', 'Gap_Years', 'Gaps', 'School_Changes']].tolist(), [1, 0, 0, 0])
+        self.assertEqual(lifecycles.loc[2, 'Rev_Change'], 0.0)
+
+    def test_school_transitions(self):
+        school_years = pd.DataFrame({'schID': [10] * 4 + [11] * 3, 'Year': [2016, 2017, 2018, 2019, 2017, 2018, 2019]})
+        schools = school_transitions(hand_matches(), school_years).set_index('schID')
+        self.assertEqual(schools['Years'].tolist(), [4, 3])
+        # school 10 loses its PTA in 2018, its first year is not counted as a birth
+        self.assertEqual(schools.loc[10, ['ANYalive_Births', 'ANYalive_Deaths', 'PTAalive_Births', 'PTAalive_Deaths']].tolist(), [0, 1, 0, 1])
+        # school 11 loses its booster in 2018 and gets a PTO in 2019
+        self.assertEqual(schools.loc[11, ['ANYalive_Births', 'ANYalive_Deaths', 'BOOSTalive_Deaths', 'PTOalive_Births']].tolist(), [1, 1, 1, 1])
+        self.assertEqual(schools.loc[11, 'PTAalive_Births'], 0)
+
+    def test_read_year_matches_keeps_the_best_match(self):
+        root = write_years(tempfile.mkdtemp(), [2019, 2020])
+        try:
+            path = os.path.join(root, 'finalmatches2019.csv')
+            matches = pd.read_csv(path, index_col=0)
+            # a second, weaker match of the first org in 2019
+            extra = matches.iloc[[0]].assign(Total_Score=0.1, schID=1001)
+            pd.concat([matches, extra], ignore_index=True).to_csv(path)
+            years = read_year_matches([2019, 2020], root)
+            self.assertFalse(years.duplicated(['EIN', 'Year']).any())
+            self.assertEqual(years.loc[(years['EIN'] == extra['EIN'].iloc[0]) & (years['Year'] == 2019), 'schID'].tolist(),
+                             [matches['schID'].iloc[0]])
+
+            lifecycle = build_lifecycle([2019, 2020], root, root)
+            self.assertEqual(lifecycle['orgs']['Years_Seen'].sum(), len(lifecycle['org_years']))
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    unittest.main()
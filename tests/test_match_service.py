@@ -0,0 +1,86 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the match service against run_year on the small synthetic files of benchmark.py, with and
+without a bound on the scores it keeps in memory.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+import benchmark
+from match_service import MatchService
+from pto_codebook import prepare_orgs, run_year
+
+
+def request_orgs(df_orgs):
+    """
+    Builds the request records of the formatted Core orgs, in upper case like the files.
+    """
+    orgs = []
+    for org in df_orgs.itertuples():
+        if not isinstance(org.NAME_final, str):
+            continue
+        orgs.append({'EIN': int(org.EIN), 'NAME': org.NAME_final.upper(), 'STATE': 'NC', 'NTEE1': 'B',
+                     'ADDRESS': org.ADDRESS_final.upper() if isinstance(org.ADDRESS_final, str) else None,
+                     'ZIP5': None if pd.isna(org.ZIP_final) else int(org.ZIP_final),
+                     'TOTREV': None if pd.isna(org.TOTREV) else float(org.TOTREV)})
+    return orgs
+
+
+class MatchServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        paths = benchmark.generate(cls.root, 'small', 2019, seed=1)
+        output = run_year(2019, os.path.dirname(paths['bmf']), os.path.dirname(paths['core']), os.path.dirname(paths['schools']),
+                          os.path.join(cls.root, 'out'))
+        cls.expected = pd.read_csv(output, index_col=0).set_index('EIN')['schID']
+        cls.schools = paths['schools']
+        cls.orgs = request_orgs(prepare_orgs(paths['bmf'], paths['core'])[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def matched_schools(self, service):
+        response = service.handle({'orgs': self.orgs})
+        return pd.DataFrame(response['matches']).set_index('EIN')['schID']
+
+    def test_batch_agrees_with_run_year(self):
+        matched = self.matched_schools(MatchService(self.schools))
+        common = matched.index.intersection(self.expected.index)
+        self.assertGreater(len(common), 0.9 * len(self.expected))
+        pd.testing.assert_series_equal(matched[common], self.expected[common], check_dtype=False)
+
+    def test_memory_bound_keeps_the_matches(self):
+        unbounded = self.matched_schools(MatchService(self.schools))
+        service = MatchService(self.schools, max_memory_scores=1000, score_cache_path=os.path.join(self.root, 'scores.sqlite'))
+        try:
+            pd.testing.assert_series_equal(self.matched_schools(service), unbounded)
+            self.assertLessEqual(sum(len(scores) for scores in service.score_cache.scores.values()), 1000)
+            # a second batch reads the dropped scores back from the file
+            pd.testing.assert_series_equal(self.matched_schools(service), unbounded)
+        finally:
+            service.close()
+
+    def test_single_org_and_unmatched_reasons(self):
+        service = MatchService(self.schools)
+        response = service.handle({'orgs': [{'EIN': 1, 'NAME': "GARDEN CLUB", 'ADDRESS': "1 MAIN ST", 'STATE': 'NC'},
+                                            {'EIN': 2, 'NAME': "OAK PTA", 'STATE': 'VA'}]})
+        self.assertEqual(response['unmatched'], [{'EIN': 1, 'Reason': 'not school-linked'}, {'EIN': 2, 'Reason': 'state'}])
+        single = service.handle(self.orgs[0])
+        self.assertEqual(len(single['matches']) + len(single['unmatched']), 1)
+        with self.assertRaises(ValueError):
+            service.handle({'EIN': 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the queries of the indexed panel against the same rows filtered from the panel, for the
+wide and the long layouts, and the update of a single year.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from panel import build_final_panel, build_long_final_panel
+from panel_fixture import write_years
+from panel_index import PanelIndex, panel_links, panel_school_years
+from schema import PANEL_SCHEMA, apply_schema
+
+
+YEARS = [2019, 2020, 2021]
+
+
+def comparable(df):
+    df = df.reset_index(drop=True)
+    return df.apply(lambda col: col.astype(object).where(col.notna(), None))
+
+
+class PanelIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = write_years(tempfile.mkdtemp(), YEARS)
+        cls.panel = apply_schema(build_final_panel(YEARS, cls.root, cls.root), PANEL_SCHEMA)
+        cls.links = panel_links(cls.panel)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.index = PanelIndex(os.path.join(self.root, 'panel.sqlite')).build(self.panel)
+
+    def tearDown(self):
+        self.index.close()
+
+    def test_school_queries(self):
+        schID = int(self.links['schID'].iloc[0])
+        expected = panel_school_years(self.panel)
+        expected = expected[expected['schID'] == schID].sort_values('Year')
+        school = self.index.school(schID)
+        pd.testing.assert_frame_equal(comparable(school[expected.columns]), comparable(expected))
+        orgs = self.index.school_orgs(schID, years=[2020, 2021])
+        expected = self.links[(self.links['schID'] == schID) & self.links['Year'].isin([2020, 2021])]
+        self.assertEqual(orgs['EIN'].tolist(), expected['EIN'].tolist())
+
+    def test_district_and_ein_queries(self):
+        schools = self.index.district_schools(3700001, years=[2019], columns=['schID', 'Year', 'leaID'])
+        expected = self.panel[(self.panel['leaID'] == 3700001) & (self.panel['Year'] == 2019)]
+        self.assertTrue(len(expected))
+        self.assertEqual(schools['schID'].tolist(), sorted(expected['schID'].tolist()))
+        ein = int(self.links['EIN'].iloc[0])
+        expected = self.links[self.links['EIN'] == ein]
+        schools = self.index.ein_schools(ein)
+        self.assertEqual(list(zip(schools['schID'], schools['Year'])), list(zip(expected['schID'], expected['Year'])))
+
+    def test_long_layout_has_the_same_links(self):
+        long_panel, school_years = build_long_final_panel(YEARS, self.root, self.root)
+        long_links = panel_links(long_panel)
+        pd.testing.assert_frame_equal(comparable(long_links[['schID', 'Year', 'EIN', 'School_org']]),
+                                      comparable(self.links[['schID', 'Year', 'EIN', 'School_org']]))
+        index = PanelIndex(os.path.join(self.root, 'long.sqlite')).build(long_panel, school_years)
+        try:
+            self.assertEqual(len(index.district_schools(3700002)), len(self.panel[self.panel['leaID'] == 3700002]))
+        finally:
+            index.close()
+
+    def test_update_replaces_only_its_year(self):
+        changed = self.panel.copy()
+        changed.loc[changed['Year'] == 2021, 'EIN1'] = pd.NA
+        self.index.build(changed, years=[2021])
+        for year in YEARS:
+            links = pd.read_sql_query("SELECT COUNT(*) AS n FROM links WHERE Year = ?", self.index.db, params=[year])['n'][0]
+            expected = panel_links(changed if year == 2021 else self.panel)
+            self.assertEqual(links, (expected['Year'] == year).sum(), year)
+        self.assertEqual(pd.read_sql_query("SELECT COUNT(*) AS n FROM school_years", self.index.db)['n'][0], len(self.panel))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that adding a year to an existing wide or long panel gives the same panel as building all
+years at once, and that rerunning an update does not change it.
+
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from panel import build_final_panel, build_long_final_panel, order_panel_columns, update_long_panel, update_panel
+from panel_fixture import write_years
+
+
+YEARS = [2019, 2020, 2021]
+
+
+def same_rows(df):
+    return df.reset_index(drop=True)
+
+
+class PanelUpdateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = write_years(tempfile.mkdtemp(), YEARS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def test_wide_update_equals_full_build(self):
+        full = order_panel_columns(build_final_panel(YEARS, self.root, self.root))
+        updated = update_panel(build_final_panel(YEARS[:2], self.root, self.root), YEARS[2], self.root, self.root)
+        self.assertEqual(sorted(full['Year'].unique()), YEARS)
+        pd.testing.assert_frame_equal(same_rows(updated), same_rows(full[updated.columns]))
+        self.assertEqual(list(updated.columns), list(full.columns))
+
+        # updating the same year again replaces its rows
+        pd.testing.assert_frame_equal(same_rows(update_panel(updated, YEARS[2], self.root, self.root)), same_rows(updated))
+
+    def test_long_update_equals_full_build(self):
+        full_panel, full_school_years = build_long_final_panel(YEARS, self.root, self.root)
+        long_panel, school_years = build_long_final_panel(YEARS[:2], self.root, self.root)
+        long_panel, school_years = update_long_panel(long_panel, school_years, YEARS[2], self.root, self.root)
+        pd.testing.assert_frame_equal(same_rows(long_panel), same_rows(full_panel))
+        pd.testing.assert_frame_equal(same_rows(school_years), same_rows(full_school_years))
+
+        again = update_long_panel(long_panel, school_years, YEARS[2], self.root, self.root)
+        pd.testing.assert_frame_equal(same_rows(again[0]), same_rows(long_panel))
+        pd.testing.assert_frame_equal(same_rows(again[1]), same_rows(school_years))
+
+
+if __name__ == "__main__":
+    unittest.main()
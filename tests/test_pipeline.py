@@ -0,0 +1,90 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks which stages of the pipeline get a new fingerprint when a setting or an input file changes,
+without running the stages.
+
+"""
+
+import ast
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from pipeline import DEFAULT_CONFIG, STAGE_CODE, fingerprint, plan_stages
+
+
+YEARS = [2019, 2020]
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fingerprints(config):
+    result = {}
+    for name, stage in plan_stages(config).items():
+        result[name] = fingerprint(stage, config, result)
+    return result
+
+
+def changed(before, after):
+    return {name for name in before if before[name] != after[name]}
+
+
+class PipelineFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for year in YEARS:
+            for source in ['bmf', 'core']:
+                os.makedirs(os.path.join(self.root, source, str(year)))
+                pd.DataFrame({'EIN': [year], 'NAME': ["A PTA"]}).to_csv(os.path.join(self.root, source, str(year), 'orgs.csv'), index=False)
+            pd.DataFrame({'school_id': [1000], 'school_name': ["A Elem"]}).to_csv(os.path.join(self.root, f"schools_{year}.csv"), index=False)
+        self.config = {**DEFAULT_CONFIG, 'years': YEARS, 'bmf_root': os.path.join(self.root, 'bmf'), 'core_root': os.path.join(self.root, 'core'),
+                       'schools_root': self.root, 'output_root': os.path.join(self.root, 'out'), 'work_dir': os.path.join(self.root, 'work'),
+                       'lifecycle_root': os.path.join(self.root, 'lifecycle')}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_same_config_same_fingerprints(self):
+        self.assertEqual(fingerprints(self.config), fingerprints(dict(self.config)))
+
+    def test_new_cutoff_reruns_from_the_matches(self):
+        before = fingerprints(self.config)
+        after = fingerprints({**self.config, 'cutoff': 0.8})
+        expected = {f'{kind}:{year}' for kind in ['matches', 'panel'] for year in YEARS} | {'export', 'lifecycle'}
+        self.assertEqual(changed(before, after), expected)
+
+    def test_new_school_file_reruns_its_year(self):
+        before = fingerprints(self.config)
+        pd.DataFrame({'school_id': [1001], 'school_name': ["B Elem"]}).to_csv(os.path.join(self.root, "schools_2020.csv"), index=False)
+        after = fingerprints(self.config)
+        expected = {f'{kind}:2020' for kind in ['schools', 'candidates', 'matches', 'panel']} | {'export', 'lifecycle'}
+        self.assertEqual(changed(before, after), expected)
+
+    def test_new_year_keeps_the_other_years(self):
+        before = fingerprints(self.config)
+        os.makedirs(os.path.join(self.root, 'bmf', '2021'))
+        os.makedirs(os.path.join(self.root, 'core', '2021'))
+        shutil.copy(os.path.join(self.root, "schools_2020.csv"), os.path.join(self.root, "schools_2021.csv"))
+        after = fingerprints({**self.config, 'years': YEARS + [2021]})
+        self.assertEqual(changed(before, {name: after[name] for name in before}), {'export', 'lifecycle'})
+
+    def test_stage_code_covers_the_school_registry_imports(self):
+        with open(os.path.join(HERE, 'school_registry.py')) as file:
+            tree = ast.parse(file.read())
+        imported = {f"{node.module}.py" for node in ast.walk(tree) if isinstance(node, ast.ImportFrom)}
+        imported = {module for module in imported if os.path.exists(os.path.join(HERE, module))}
+        self.assertIn('pto_codebook.py', imported)
+        for kind in ['panel', 'lifecycle']:
+            self.assertLessEqual(imported, set(STAGE_CODE[kind]), kind)
+        for modules in STAGE_CODE.values():
+            for module in modules:
+                self.assertTrue(os.path.exists(os.path.join(HERE, module)), module)
+
+
+if __name__ == "__main__":
+    unittest.main()
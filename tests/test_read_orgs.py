@@ -0,0 +1,70 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that reading the BMF and Core files in chunks gives the same organizations as reading them
+at once, with the state and NTEE filters, the column projection and the EIN deduplication across
+files.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from pto_codebook import iter_orgs, read_orgs
+
+
+class ReadOrgsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        n = 50
+        month1 = pd.DataFrame({
+            'EIN': range(n),
+            'NAME': [f"ORG {i} PTA" for i in range(n)],
+            'STATE': ['NC', 'SC'] * (n // 2),
+            'NTEE1': ['B', 'B', 'A', 'B', 'B'] * (n // 5),
+            'ZIP5': range(27000, 27000 + n),
+            'UNUSED': 'x',
+        })
+        # the second month repeats some EINs and has no ZIP5 column
+        month2 = month1.iloc[30:].assign(EIN=range(40, 60), NAME="LATER NAME").drop(columns='ZIP5')
+        month1.to_csv(os.path.join(self.root, 'bmf_01.csv'), index=False)
+        month2.to_csv(os.path.join(self.root, 'bmf_02.csv'), index=False)
+        with open(os.path.join(self.root, 'notes.txt'), 'w') as file:
+            file.write("not a CSV file")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_chunks_give_the_same_orgs(self):
+        whole = read_orgs(self.root, chunksize=1000)
+        chunked = read_orgs(self.root, chunksize=7)
+        pd.testing.assert_frame_equal(chunked, whole)
+        self.assertTrue((whole['STATE'] == 'NC').all() and (whole['NTEE1'] == 'B').all())
+        self.assertFalse(whole['EIN'].duplicated().any())
+        self.assertNotIn('UNUSED', whole.columns)
+
+    def test_first_file_wins_for_repeated_eins(self):
+        orgs = read_orgs(self.root, state=None, chunksize=7).set_index('EIN')
+        self.assertEqual(orgs.loc[40, 'NAME'], "ORG 40 PTA")
+        self.assertEqual(orgs.loc[55, 'NAME'], "LATER NAME")
+        # orgs only in the file without ZIP5 have a missing ZIP code
+        self.assertTrue(pd.isna(orgs.loc[55, 'ZIP5']))
+
+    def test_every_chunk_has_the_columns_of_all_files(self):
+        columns = {tuple(chunk.columns) for chunk in iter_orgs(self.root, state=None, chunksize=7)}
+        self.assertEqual(len(columns), 1)
+        self.assertIn('ZIP5', columns.pop())
+
+    def test_missing_directory(self):
+        with self.assertRaises(FileNotFoundError):
+            read_orgs(os.path.join(self.root, 'missing'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the column types of the schemas and that a panel written as Parquet files partitioned by
+year reads back the same, whole or by year and column.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from panel import build_final_panel, build_long_final_panel, read_matches
+from panel_fixture import write_years
+from schema import MATCH_SCHEMA, PANEL_SCHEMA, apply_schema, read_panel, to_revenue, write_panel
+
+
+YEARS = [2019, 2020, 2021]
+
+
+def comparable(panel):
+    # categories are compared by their values, since each year file has its own dictionary
+    panel = panel.sort_values(['schID', 'Year']).reset_index(drop=True)
+    return panel.apply(lambda col: col.astype(object) if isinstance(col.dtype, pd.CategoricalDtype) else col)
+
+
+class SchemaTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = write_years(tempfile.mkdtemp(), YEARS)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def test_revenue_strings_are_parsed(self):
+        revenues = pd.Series(["$1,234", "56", None, "n/a", 7.5], dtype=object)
+        self.assertEqual(to_revenue(revenues).tolist()[:2], [1234.0, 56.0])
+        self.assertTrue(to_revenue(revenues)[2:4].isna().all())
+        self.assertEqual(to_revenue(revenues)[4], 7.5)
+
+    def test_match_types(self):
+        matches = read_matches(self.root, 2020)
+        self.assertEqual(str(matches['EIN'].dtype), 'Int64')
+        self.assertEqual(str(matches['Org_code'].dtype), 'Int8')
+        self.assertEqual(str(matches['Revenue'].dtype), 'float64')
+        self.assertEqual(str(matches['Year'].dtype), 'Int32')
+        # the 12 digit IDs of 2020 are shortened to the school keys of the earlier years
+        self.assertTrue((matches['schID'] < 10 ** 6).all())
+        self.assertIsInstance(apply_schema(matches, MATCH_SCHEMA)['School_Name'].dtype, pd.CategoricalDtype)
+
+    def test_ids_that_do_not_fit_are_widened(self):
+        df = apply_schema(pd.DataFrame({'schID': [1000, 370000001000], 'Year': [2019, 2020]}), PANEL_SCHEMA)
+        self.assertEqual(str(df['schID'].dtype), 'Int64')
+        self.assertEqual(df['schID'].tolist(), [1000, 370000001000])
+
+    def test_wide_panel_round_trip(self):
+        panel = apply_schema(build_final_panel(YEARS, self.root, self.root), PANEL_SCHEMA)
+        root = os.path.join(self.root, 'wide')
+        write_panel(panel, root)
+        self.assertEqual(sorted(os.listdir(root)), [f"Year={year}" for year in YEARS])
+        back = read_panel(root)
+        self.assertEqual(list(back.columns), list(panel.columns))
+        self.assertEqual(back.dtypes.astype(str).to_dict(), panel.dtypes.astype(str).to_dict())
+        pd.testing.assert_frame_equal(comparable(back), comparable(panel))
+
+        # a single year and a few columns are read on their own
+        year = read_panel(root, years=[2020], columns=['schID', 'TotRev'])
+        self.assertEqual(list(year.columns), ['schID', 'Year', 'TotRev'])
+        pd.testing.assert_frame_equal(comparable(year), comparable(panel[panel['Year'] == 2020][['schID', 'Year', 'TotRev']]))
+
+    def test_rewriting_a_year_keeps_the_others(self):
+        long_panel, _ = build_long_final_panel(YEARS, self.root, self.root)
+        root = os.path.join(self.root, 'long')
+        write_panel(long_panel, root)
+        changed = long_panel.copy()
+        changed.loc[changed['Year'] == 2021, 'Rev'] = 1.0
+        write_panel(changed, root, years=[2021])
+        back = read_panel(root)
+        pd.testing.assert_frame_equal(comparable(back[back['Year'] != 2021]), comparable(long_panel[long_panel['Year'] != 2021]))
+        self.assertTrue((back.loc[back['Year'] == 2021, 'Rev'].dropna() == 1.0).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
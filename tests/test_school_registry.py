@@ -0,0 +1,80 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks the school ID crosswalk: the 12-digit IDs of 2020 on, the keys of the same school across
+years, the rename flags and the Parquet file kept across runs.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from panel_fixture import write_years
+from school_registry import SchoolRegistry, flag_renames, normalize_school_ids
+
+
+YEARS = [2019, 2020, 2021]
+
+
+class SchoolRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = write_years(tempfile.mkdtemp(), YEARS)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_normalize_school_ids(self):
+        ids = pd.Series([370000001000, 370000000042, 1000, 450000001000, 370000001000, 370])
+        years = pd.Series([2020, 2021, 2019, 2020, 2019, 2020])
+        # only the NCES IDs of 2020 on lose their 370 prefix and leading zeros
+        self.assertEqual(normalize_school_ids(ids, years).tolist(), [1000, 42, 1000, 450000001000, 370000001000, 370])
+        self.assertEqual(normalize_school_ids(pd.Series(["370000001000"]), 2020).tolist(), [1000])
+
+    def test_same_school_has_one_key(self):
+        registry = SchoolRegistry().add_years(YEARS, self.root)
+        keys = registry.school_keys(pd.Series([1005, 370000001005, 370000001005]), pd.Series(YEARS))
+        self.assertEqual(keys.tolist(), [1005, 1005, 1005])
+        schools = registry.schools(YEARS)
+        self.assertEqual(len(schools), 3 * 30)
+        self.assertEqual(schools.groupby('schID')['Year'].nunique().unique().tolist(), [3])
+
+    def test_ids_outside_the_rosters_are_normalized(self):
+        registry = SchoolRegistry().add_years(YEARS, self.root)
+        self.assertEqual(registry.school_keys(pd.Series([370000009999]), 2021).tolist(), [9999])
+
+    def test_rename_flags(self):
+        crosswalk = pd.DataFrame({
+            'schID': [1, 1, 1, 2, 2],
+            'Year': [2019, 2020, 2021, 2019, 2020],
+            'School_Name': ["Altamahaw Ossipee Elem", "altamahaw-ossipee elementary", "Jordan Lake Elementary", "Pine Middle", "Pine Middle"],
+            'School_level': ["Primary"] * 3 + ["Middle"] * 2,
+        })
+        flagged = flag_renames(crosswalk)
+        self.assertEqual(flagged['Renamed'].tolist(), [False, True, True, False, False])
+        self.assertEqual(flagged['Respelled'].tolist(), [False, True, False, False, False])
+
+    def test_crosswalk_file_is_reused_and_refreshed(self):
+        path = os.path.join(self.root, 'registry.parquet')
+        registry = SchoolRegistry(path).add_years(YEARS[:2], self.root)
+        reloaded = SchoolRegistry(path)
+        pd.testing.assert_frame_equal(reloaded.crosswalk, registry.crosswalk)
+
+        # a new year is added, a changed roster is read again and the renamed school is flagged
+        roster = pd.read_csv(os.path.join(self.root, "schools_2020.csv"))
+        roster.loc[roster['school_id'] == 370000001004, 'school_name'] = "Riverside Elementary"
+        roster.to_csv(os.path.join(self.root, "schools_2020.csv"), index=False)
+        reloaded.add_years(YEARS, self.root)
+        self.assertEqual(sorted(reloaded.crosswalk['Year'].unique()), YEARS)
+        renames = reloaded.renames()
+        self.assertEqual(list(zip(renames['schID'], renames['Year'])), [(1004, 2020), (1004, 2021)])
+        self.assertEqual(SchoolRegistry(path).crosswalk['Roster_Digest'].nunique(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
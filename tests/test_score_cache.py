@@ -0,0 +1,88 @@
+"""
+
+CRF 2023 - Team PTO
+
+Checks that the score cache scores each pair once, reads the scores of earlier runs back from its
+file, evicts the least recently used scores and keeps at most max_memory_entries scores in memory.
+
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import jellyfish
+import numpy as np
+
+from score_cache import ScoreCache
+
+
+def stats(cache):
+    return {row.Field: (row.Hits, row.Misses) for row in cache.stats().itertuples()}
+
+
+def stored(path):
+    with sqlite3.connect(path) as db:
+        return {(s1, s2) for s1, s2 in db.execute("SELECT s1, s2 FROM scores")}
+
+
+class ScoreCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'scores.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_hits_and_misses_in_memory(self):
+        cache = ScoreCache()
+        scores = cache.name_score(["mill creek pta", "mill creek pta", None], ["mill creek elementary", "mill creek elementary", "oak"])
+        self.assertEqual(scores.tolist()[:2], [jellyfish.jaro_winkler_similarity("mill creek pta", "mill creek elementary")] * 2)
+        self.assertEqual(scores.tolist()[2], 0.0)
+        # the repeated pair is scored once and the missing one is not looked up
+        self.assertEqual(stats(cache), {'name': (0, 1)})
+        cache.name_score(["mill creek pta"], ["mill creek elementary"])
+        self.assertEqual(stats(cache), {'name': (1, 1)})
+        # names and addresses are separate namespaces
+        cache.address_score(["mill creek pta"], ["mill creek elementary"])
+        self.assertEqual(stats(cache)['address'], (0, 1))
+
+    def test_scores_are_read_back_in_a_later_run(self):
+        cache = ScoreCache(self.path)
+        first = cache.name_score(["a b c", "d e f"], ["a b d", "d e g"])
+        cache.close()
+
+        cache = ScoreCache(self.path)
+        second = cache.name_score(["a b c", "d e f", "x y z"], ["a b d", "d e g", "x y y"])
+        cache.close()
+        np.testing.assert_array_equal(second[:2], first)
+        self.assertEqual(stats(cache), {'name': (2, 1)})
+
+    def test_least_recently_used_scores_are_evicted(self):
+        cache = ScoreCache(self.path)
+        cache.name_score(["old"], ["olds"])
+        cache.close()
+        cache = ScoreCache(self.path, max_entries=2)
+        cache.name_score(["new 1", "new 2"], ["news 1", "news 2"])
+        cache.close()
+        self.assertEqual(stored(self.path), {("new 1", "news 1"), ("new 2", "news 2")})
+
+    def test_memory_is_bounded(self):
+        cache = ScoreCache(self.path, max_memory_entries=10)
+        s1, s2 = [f"org {i}" for i in range(8)], [f"school {i}" for i in range(8)]
+        first = cache.name_score(s1, s2)
+        self.assertEqual(len(cache.scores['name']), 8)
+        cache.name_score(s2, s1)
+        # over the limit, the scores are written to the file and dropped from memory
+        self.assertEqual(sum(len(scores) for scores in cache.scores.values()), 0)
+        self.assertEqual(len(stored(self.path)), 16)
+        np.testing.assert_array_equal(cache.name_score(s1, s2), first)
+        self.assertEqual(stats(cache), {'name': (8, 16)})
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()